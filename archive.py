@@ -0,0 +1,261 @@
+# 오래된 메시지 보관소 (로컬 추가 전용 세그먼트 파일)
+# 보존 개수 정리로 저장소에서 빠지는 메시지를 삭제하지 않고 여기에 옮겨 두고, /history에서 과거 페이지를 읽을 때 사용
+# - 방마다 디렉터리 하나, 그 안에 번호순 세그먼트 파일(000001.seg ...)을 쓰고 SEGMENT_SIZE를 넘으면 다음 파일로 넘어감
+# - 파일은 블록의 연속: [헤더][zlib으로 압축한 JSON Lines 메시지]
+#   헤더에 메시지 수, 시퀀스 번호 범위, 시각 범위가 있으므로 헤더만 훑어서 블록마다 한 항목인 희소 색인을 만듦
+# - 읽기는 mmap으로 필요한 블록만 풀어서 처리 (최근 블록부터 거꾸로 순차 읽기)
+# - 쓰기는 방별 잠금 파일(flock)로 여러 워커 프로세스 사이에서 직렬화하고, 잠근 뒤 다른 프로세스가 추가한 블록을 다시 읽음
+# - 같은 메시지를 두 번 보관하지 않음 (보관 후 저장소 삭제 전에 종료되어 다시 정리되는 경우)
+# - 이미 보관된 메시지보다 이른 시각의 메시지(저장이 늦어진 메시지)도 보관 (시각 범위가 겹치는 블록이 생길 수 있음)
+# 모든 메서드는 동기 함수이며, 서버는 이벤트 루프를 막지 않도록 별도 스레드에서 호출
+import bisect
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from datetime import datetime, timezone
+from typing import Optional
+
+# 블록 헤더: 매직, 압축된 본문 길이, 메시지 수, 첫/마지막 시퀀스 번호, 가장 이른/늦은 시각 (UTC 마이크로초)
+BLOCK_HEADER = struct.Struct("<4sIIqqqq")
+BLOCK_MAGIC = b"CAB1"
+SEGMENT_SUFFIX = ".seg"
+# 블록 하나에 넣는 최대 메시지 수 (한 번의 읽기에서 푸는 양)
+BLOCK_MESSAGES = 256
+# 세그먼트 파일 최대 크기 (넘으면 다음 파일에 씀)
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def to_micros(value: str) -> int:
+    """ISO 형식 시각을 UTC 마이크로초로 변환 (타임존 정보가 없으면 UTC로 간주)"""
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+class _Block:
+    __slots__ = ("segment", "offset", "length", "count", "first_seq", "last_seq", "min_ts", "max_ts")
+
+    def __init__(self, segment: str, offset: int, length: int, count: int,
+                 first_seq: int, last_seq: int, min_ts: int, max_ts: int):
+        self.segment = segment
+        self.offset = offset
+        self.length = length
+        self.count = count
+        self.first_seq = first_seq
+        self.last_seq = last_seq
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+
+
+class _RoomArchive:
+    __slots__ = ("directory", "blocks", "peaks", "scanned", "maps")
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # 희소 색인: 가장 이른 시각 순 (대부분 시각 범위가 겹치지 않고 증가하지만 늦은 메시지 블록은 겹칠 수 있음)
+        self.blocks: list[_Block] = []
+        # peaks[i]: blocks[:i + 1] 중 가장 늦은 시각 (이보다 앞 블록에 더 늦은 메시지가 없음을 판단)
+        self.peaks: list[int] = []
+        # 세그먼트 파일 이름 -> 헤더를 읽은 위치 (이후에 추가된 블록만 새로 읽음)
+        self.scanned: dict[str, int] = {}
+        # 세그먼트 파일 이름 -> (mmap, 매핑한 크기)
+        self.maps: dict[str, tuple[mmap.mmap, int]] = {}
+
+
+class MessageArchive:
+    """방별 오래된 메시지 보관소"""
+    def __init__(self, directory: str, segment_size: int = SEGMENT_SIZE, block_messages: int = BLOCK_MESSAGES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.block_messages = block_messages
+        self.rooms: dict[str, _RoomArchive] = {}
+        self._lock = threading.Lock()
+
+    def append(self, room: str, messages: list) -> int:
+        """메시지(ISO 형식 timestamp)를 보관하고 새로 보관한 수 반환 (반환 후 모든 메시지가 보관소에 있음)"""
+        with self._lock:
+            archive = self._room(room, create=True)
+            with open(os.path.join(archive.directory, ".lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    # 다른 프로세스가 그사이 추가한 블록 반영
+                    self._scan(archive)
+                    peak = archive.peaks[-1] if archive.peaks else None
+                    held: dict = {}
+                    late, pending = [], []
+                    for message in messages:
+                        ts = to_micros(message["timestamp"])
+                        if peak is not None and ts <= peak and self._holds(archive, ts, message["id"], held):
+                            continue
+                        (late if peak is not None and ts < peak else pending).append((ts, message))
+                    # 늦은 메시지는 따로 모아 써서 시각 범위가 넓은 블록이 생기지 않도록 함
+                    for items in (late, pending):
+                        items.sort(key=lambda item: item[0])
+                        for start in range(0, len(items), self.block_messages):
+                            self._write_block(archive, items[start:start + self.block_messages])
+                    return len(late) + len(pending)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def before(self, room: str, timestamp: Optional[datetime], limit: int) -> list:
+        """timestamp 이전에 보관된 메시지 중 가장 최근 것 최대 limit개 (과거 -> 현재 순, None이면 가장 최근부터)"""
+        with self._lock:
+            archive = self._room(room)
+            if archive is None:
+                return []
+            self._scan(archive)
+            blocks = archive.blocks
+            if timestamp is None:
+                end = len(blocks)
+                cutoff = None
+            else:
+                cutoff = to_micros(timestamp.isoformat())
+                # cutoff보다 이른 메시지가 있을 수 있는 마지막 블록까지
+                end = bisect.bisect_left(blocks, cutoff, key=lambda b: b.min_ts)
+            # (시각, 블록 위치, 블록 안 위치, 메시지) 중 가장 늦은 limit개
+            found: list = []
+            for i in range(end - 1, -1, -1):
+                # 남은 블록에 이미 모은 것보다 늦은 메시지가 없으면 중단 (겹치는 블록이 없으면 바로 앞 블록에서 멈춤)
+                if len(found) >= limit and archive.peaks[i] < found[0][0]:
+                    break
+                for j, (ts, message) in enumerate(self._read_block(archive, blocks[i])):
+                    if cutoff is None or ts < cutoff:
+                        found.append((ts, i, j, message))
+                if len(found) >= limit:
+                    found.sort(key=lambda item: item[:3])
+                    del found[:len(found) - limit]
+            found.sort(key=lambda item: item[:3])
+            return [message for *_, message in found[-limit:]]
+
+    def count(self, room: str) -> int:
+        """방에 보관된 메시지 수"""
+        with self._lock:
+            archive = self._room(room)
+            if archive is None:
+                return 0
+            self._scan(archive)
+            return sum(block.count for block in archive.blocks)
+
+    def close(self):
+        with self._lock:
+            for archive in self.rooms.values():
+                for mapped, _ in archive.maps.values():
+                    mapped.close()
+                archive.maps.clear()
+
+    def _room(self, room: str, create: bool = False) -> Optional[_RoomArchive]:
+        """방 보관소 (디렉터리는 보관할 때만 만들고, 읽기에서 디렉터리가 없으면 None)"""
+        archive = self.rooms.get(room)
+        if archive is None:
+            directory = os.path.join(self.directory, room)
+            if create:
+                os.makedirs(directory, exist_ok=True)
+            elif not os.path.isdir(directory):
+                return None
+            archive = self.rooms[room] = _RoomArchive(directory)
+        return archive
+
+    def _holds(self, archive: _RoomArchive, ts: int, message_id: str, cache: dict) -> bool:
+        """시각 ts의 메시지 message_id가 이미 보관되어 있는지 (시각 범위에 ts가 들어가는 블록만 읽음)"""
+        blocks = archive.blocks
+        for i in range(bisect.bisect_right(blocks, ts, key=lambda b: b.min_ts) - 1, -1, -1):
+            if archive.peaks[i] < ts:
+                break
+            block = blocks[i]
+            if block.max_ts < ts:
+                continue
+            ids = cache.get(block)
+            if ids is None:
+                ids = cache[block] = {m["id"] for _, m in self._read_block(archive, block)}
+            if message_id in ids:
+                return True
+        return False
+
+    @staticmethod
+    def _add_block(archive: _RoomArchive, block: _Block):
+        blocks, peaks = archive.blocks, archive.peaks
+        if not blocks or blocks[-1].min_ts <= block.min_ts:
+            blocks.append(block)
+            peaks.append(max(peaks[-1], block.max_ts) if peaks else block.max_ts)
+            return
+        # 늦은 메시지 블록: 시각순 위치에 끼워 넣고 그 뒤의 누적 최대 시각을 다시 계산
+        i = bisect.bisect_right(blocks, block.min_ts, key=lambda b: b.min_ts)
+        blocks.insert(i, block)
+        peak = peaks[i - 1] if i else block.max_ts
+        del peaks[i:]
+        for b in blocks[i:]:
+            peak = max(peak, b.max_ts)
+            peaks.append(peak)
+
+    def _segments(self, archive: _RoomArchive) -> list:
+        return sorted(name for name in os.listdir(archive.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def _scan(self, archive: _RoomArchive):
+        """세그먼트 파일에서 아직 읽지 않은 블록 헤더를 읽어 색인에 추가"""
+        for name in self._segments(archive):
+            path = os.path.join(archive.directory, name)
+            offset = archive.scanned.get(name, 0)
+            size = os.path.getsize(path)
+            if offset >= size:
+                continue
+            with open(path, "rb") as f:
+                f.seek(offset)
+                while offset + BLOCK_HEADER.size <= size:
+                    header = f.read(BLOCK_HEADER.size)
+                    magic, length, count, first_seq, last_seq, min_ts, max_ts = BLOCK_HEADER.unpack(header)
+                    # 쓰는 도중에 종료되어 잘린 블록은 무시 (다음 쓰기는 새 세그먼트 파일에서 시작)
+                    if magic != BLOCK_MAGIC or offset + BLOCK_HEADER.size + length > size:
+                        break
+                    self._add_block(archive, _Block(name, offset + BLOCK_HEADER.size, length, count,
+                                                    first_seq, last_seq, min_ts, max_ts))
+                    offset += BLOCK_HEADER.size + length
+                    f.seek(offset)
+            archive.scanned[name] = offset
+
+    def _write_block(self, archive: _RoomArchive, items: list):
+        payload = zlib.compress(
+            "\n".join(json.dumps(m, ensure_ascii=False, separators=(",", ":")) for _, m in items).encode("utf-8")
+        )
+        seqs = [m.get("seq") or 0 for _, m in items]
+        min_ts, max_ts = min(ts for ts, _ in items), max(ts for ts, _ in items)
+        header = BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), len(items), min(seqs), max(seqs), min_ts, max_ts)
+
+        segments = self._segments(archive)
+        name = segments[-1] if segments else None
+        # 가득 찼거나 끝이 잘린 세그먼트에는 이어 쓰지 않음
+        if (name is None or archive.scanned.get(name, 0) >= self.segment_size
+                or archive.scanned.get(name, 0) != os.path.getsize(os.path.join(archive.directory, name))):
+            number = int(name[:-len(SEGMENT_SUFFIX)]) + 1 if name else 1
+            name = f"{number:06d}{SEGMENT_SUFFIX}"
+        path = os.path.join(archive.directory, name)
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(header + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        block = _Block(name, offset + BLOCK_HEADER.size, len(payload), len(items),
+                       min(seqs), max(seqs), min_ts, max_ts)
+        self._add_block(archive, block)
+        archive.scanned[name] = block.offset + block.length
+
+    def _read_block(self, archive: _RoomArchive, block: _Block) -> list:
+        """블록의 (시각, 메시지) 목록 (과거 -> 현재 순)"""
+        end = block.offset + block.length
+        mapped, size = archive.maps.get(block.segment, (None, 0))
+        if mapped is None or size < end:
+            # 파일이 커졌으면 다시 매핑
+            if mapped is not None:
+                mapped.close()
+            with open(os.path.join(archive.directory, block.segment), "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            archive.maps[block.segment] = (mapped, size)
+        lines = zlib.decompress(mapped[block.offset:end]).decode("utf-8").split("\n")
+        return [(to_micros(m["timestamp"]), m) for m in map(json.loads, lines)]
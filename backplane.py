@@ -0,0 +1,204 @@
+# 서버 프로세스 간 메시지 중계 (백플레인)
+# 여러 uvicorn 워커/인스턴스가 하나의 채팅방을 공유할 수 있도록
+# 한 프로세스에서 수락된 메시지를 다른 모든 서버 프로세스에 전달
+import asyncio
+import fcntl
+import json
+import os
+import socket
+import struct
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+# 메시지 봉투(envelope) 형식: {"origin": 보낸 프로세스 ID, "room": 방 이름, "message": 메시지}
+# 수신 측은 자신이 보낸 메시지(origin 동일)를 무시하여 에코를 방지
+
+
+class Backplane(ABC):
+    """백플레인 인터페이스"""
+    def __init__(self):
+        # 프로세스 고유 ID (에코 방지용 origin 태그)
+        self.origin = uuid.uuid4().hex
+        self.on_message: Optional[Callable[[str, dict], None]] = None
+        # 다른 프로세스로 전달하지 못한 메시지 수
+        self.dropped = 0
+
+    async def start(self, on_message: Callable[[str, dict], None]):
+        """수신 시작. 다른 프로세스에서 온 메시지마다 on_message(room, message) 호출"""
+        self.on_message = on_message
+
+    @abstractmethod
+    def publish(self, room: str, message: dict):
+        """방의 메시지를 다른 모든 서버 프로세스에 전달 (즉시 반환)"""
+        raise NotImplementedError
+
+    def next_sequence(self, room: str, floor: int) -> Optional[tuple[int, datetime]]:
+        """프로세스 간에 공유하는 방의 다음 (시퀀스 번호, 수신 시각) (None이면 프로세스가 하나뿐이므로 로컬 카운터 사용)"""
+        return None
+
+    async def close(self):
+        self.on_message = None
+
+    def _deliver(self, envelope: dict):
+        if envelope.get("origin") == self.origin or self.on_message is None:
+            return
+        try:
+            self.on_message(envelope["room"], envelope["message"])
+        except Exception as e:
+            print(f"백플레인 메시지 처리 에러: {e}")
+
+
+class InProcessBackplane(Backplane):
+    """같은 프로세스 안의 인스턴스끼리 메시지를 주고받는 백플레인 (단일 프로세스 기본값)"""
+    # 채널 이름별 구독 인스턴스 목록
+    _channels: dict[str, list["InProcessBackplane"]] = {}
+
+    def __init__(self, channel: str = "default"):
+        super().__init__()
+        self.channel = channel
+
+    async def start(self, on_message: Callable[[str, dict], None]):
+        await super().start(on_message)
+        self._channels.setdefault(self.channel, []).append(self)
+
+    def publish(self, room: str, message: dict):
+        envelope = {"origin": self.origin, "room": room, "message": message}
+        loop = asyncio.get_running_loop()
+        for peer in self._channels.get(self.channel, []):
+            if peer is not self:
+                # 발신자의 처리 흐름과 분리하기 위해 다음 루프 반복에서 전달
+                loop.call_soon(peer._deliver, envelope)
+
+    async def close(self):
+        peers = self._channels.get(self.channel, [])
+        if self in peers:
+            peers.remove(self)
+        await super().close()
+
+
+class UnixSocketBackplane(Backplane):
+    """같은 머신의 서버 프로세스끼리 Unix 도메인 데이터그램 소켓으로 메시지를 주고받는 백플레인
+
+    각 프로세스는 공유 디렉터리에 자신의 소켓 파일을 만들고,
+    발행 시 디렉터리의 다른 모든 소켓 파일로 데이터그램을 전송 (별도 브로커 불필요)
+    """
+    # 피어 목록(디렉터리)을 다시 읽는 최소 간격 (초)
+    PEER_REFRESH_INTERVAL = 1.0
+    # 방별 시퀀스 카운터 파일 (8바이트 정수)
+    SEQUENCE_FORMAT = struct.Struct("<q")
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+        self.path = os.path.join(directory, f"{self.origin}.sock")
+        self._recv_sock: Optional[socket.socket] = None
+        self._send_sock: Optional[socket.socket] = None
+        self._peers: list[str] = []
+        self._peers_refreshed = 0.0
+
+    async def start(self, on_message: Callable[[str, dict], None]):
+        await super().start(on_message)
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._recv_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._recv_sock.bind(self.path)
+        self._recv_sock.setblocking(False)
+        self._send_sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._send_sock.setblocking(False)
+
+        asyncio.get_running_loop().add_reader(self._recv_sock.fileno(), self._on_readable)
+        print(f"백플레인 시작 (Unix 소켓: {self.path})")
+
+    def publish(self, room: str, message: dict):
+        envelope = {"origin": self.origin, "room": room, "message": message}
+        data = json.dumps(envelope, ensure_ascii=False).encode("utf-8")
+        for peer in self._get_peers():
+            try:
+                self._send_sock.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 비정상 종료된 프로세스가 남긴 소켓 파일 정리
+                self._forget_peer(peer, unlink=True)
+            except OSError as e:
+                # 수신 측 버퍼가 가득 찬 경우 등: 해당 피어에 대한 전달만 포기
+                self.dropped += 1
+                print(f"백플레인 전송 실패 ({peer}): {e}")
+
+    def next_sequence(self, room: str, floor: int) -> Optional[tuple[int, datetime]]:
+        # 공유 디렉터리의 방별 카운터 파일을 잠근 상태에서 증가시키므로 여러 워커가 같은 번호를 부여하지 않음
+        # 수신 시각도 잠근 상태에서 정하여 시퀀스 순서와 시각 순서가 같게 유지
+        # (floor: 이 프로세스가 본 가장 큰 번호, 카운터 파일이 지워져도 저장소의 번호 이후부터 이어감)
+        directory = os.path.join(self.directory, "seq")
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, room), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.pread(fd, self.SEQUENCE_FORMAT.size, 0)
+            current = self.SEQUENCE_FORMAT.unpack(data)[0] if len(data) == self.SEQUENCE_FORMAT.size else 0
+            seq = max(current, floor) + 1
+            os.pwrite(fd, self.SEQUENCE_FORMAT.pack(seq), 0)
+            return seq, datetime.now(timezone.utc)
+        finally:
+            os.close(fd)
+
+    async def close(self):
+        if self._recv_sock is not None:
+            asyncio.get_running_loop().remove_reader(self._recv_sock.fileno())
+            self._recv_sock.close()
+            self._recv_sock = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        if self._send_sock is not None:
+            self._send_sock.close()
+            self._send_sock = None
+        await super().close()
+
+    def _on_readable(self):
+        # 읽을 수 있는 데이터그램을 모두 처리
+        while self._recv_sock is not None:
+            try:
+                data = self._recv_sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            try:
+                envelope = json.loads(data)
+            except ValueError as e:
+                print(f"백플레인 메시지 파싱 에러: {e}")
+                continue
+            self._deliver(envelope)
+
+    def _get_peers(self) -> list[str]:
+        now = time.monotonic()
+        if now - self._peers_refreshed >= self.PEER_REFRESH_INTERVAL:
+            self._peers_refreshed = now
+            try:
+                names = os.listdir(self.directory)
+            except FileNotFoundError:
+                names = []
+            self._peers = [
+                os.path.join(self.directory, name) for name in names
+                if name.endswith(".sock") and os.path.join(self.directory, name) != self.path
+            ]
+        return self._peers
+
+    def _forget_peer(self, peer: str, unlink: bool = False):
+        if peer in self._peers:
+            self._peers.remove(peer)
+        if unlink:
+            try:
+                os.unlink(peer)
+            except OSError:
+                pass
+
+
+def create_backplane(kind: str, directory: str) -> Backplane:
+    """설정 값에 맞는 백플레인 생성 (local: 단일 프로세스, unix: 같은 머신의 여러 프로세스)"""
+    if kind == "local":
+        return InProcessBackplane()
+    if kind == "unix":
+        return UnixSocketBackplane(directory)
+    raise ValueError(f"지원하지 않는 BACKPLANE 값입니다: {kind} (local, unix 중 하나)")
@@ -0,0 +1,101 @@
+# 콜드 스타트 측정
+# 서버 프로세스를 새로 띄운 뒤 첫 WebSocket 연결이 수락될 때까지, /healthz가 준비 완료를 알릴 때까지 걸린 시간을 측정
+# 서버가 /metrics로 보고하는 단계별 시간(chat_startup_seconds)도 함께 기록하며 결과는 JSON으로 출력
+#
+# 사용 예:
+#   python bench/cold_start.py --runs 5 --store firestore
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="서버 콜드 스타트 시간 측정")
+    parser.add_argument("--runs", type=int, default=5, help="반복 횟수")
+    parser.add_argument("--store", choices=("memory", "sqlite", "firestore"), default="firestore",
+                        help="서버 메시지 저장소 (firestore는 인메모리 Firestore 대체 모듈 사용)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=60.0, help="한 번의 측정을 기다리는 최대 시간 (초)")
+    parser.add_argument("--output", default="", help="결과 JSON 파일 경로 (비우면 표준 출력)")
+    return parser.parse_args()
+
+
+async def measure_once(args) -> dict:
+    base_url = f"http://127.0.0.1:{args.port}"
+    ws_url = f"ws://127.0.0.1:{args.port}/ws"
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    started = time.monotonic()
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(args.port), "--store", args.store],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    result = {}
+    try:
+        async with aiohttp.ClientSession() as session:
+            deadline = started + args.timeout
+            # 첫 WebSocket 연결 수락
+            while "first_connection" not in result:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("WebSocket 연결을 수락하지 않습니다")
+                try:
+                    ws = await session.ws_connect(ws_url, headers={"x-nickname": "cold-start"})
+                    result["first_connection"] = time.monotonic() - started
+                    await ws.close()
+                except aiohttp.ClientError:
+                    await asyncio.sleep(0.01)
+            # 저장소 준비 완료
+            while "healthz_ready" not in result:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("서버가 준비되지 않았습니다")
+                try:
+                    async with session.get(f"{base_url}/healthz") as resp:
+                        if resp.status == 200:
+                            result["healthz_ready"] = time.monotonic() - started
+                            break
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.01)
+            async with session.get(f"{base_url}/metrics") as resp:
+                for line in (await resp.text()).splitlines():
+                    if line.startswith("chat_startup_seconds{"):
+                        phase = line.split('phase="', 1)[1].split('"', 1)[0]
+                        result[f"server_{phase}"] = float(line.rsplit(" ", 1)[1])
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return result
+
+
+async def run(args) -> dict:
+    runs = [await measure_once(args) for _ in range(args.runs)]
+    keys = sorted({key for r in runs for key in r})
+    return {
+        "benchmark": "cold_start",
+        "config": {"runs": args.runs, "store": args.store},
+        "median_seconds": {key: round(statistics.median(r[key] for r in runs if key in r), 4) for key in keys},
+        "runs": runs,
+    }
+
+
+def main():
+    args = parse_args()
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
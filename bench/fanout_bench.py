@@ -0,0 +1,279 @@
+# WebSocket 브로드캐스트(fan-out) 부하 테스트
+# 오프라인 저장소(기본: 인메모리)로 서버를 띄우고, client.py와 같은 x-nickname 헤더로 다수의 가상 클라이언트를 연결한 뒤
+# 정해진 속도로 메시지를 보내 처리량, 종단 간 전달 지연(p50/p99/p999), 서버 CPU/메모리를 측정
+# 결과는 JSON으로 출력 (릴리스 간 비교용)
+#
+# 사용 예:
+#   python bench/fanout_bench.py --clients 500 --senders 10 --rate 50 --duration 20 --output bench_result.json
+#
+# 오프라인, 단일 Linux 머신에서 동작 (서버 CPU/메모리는 /proc에서 읽음)
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import urllib.parse
+from datetime import datetime, timezone
+
+import aiohttp
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+# 벤치마크 메시지 표시: "bench|<보낸 시각 ns>"
+BENCH_PREFIX = "bench|"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="WebSocket fan-out 부하 테스트")
+    parser.add_argument("--clients", type=int, default=200, help="연결할 가상 클라이언트 수")
+    parser.add_argument("--senders", type=int, default=5, help="메시지를 보내는 클라이언트 수 (clients 중 일부)")
+    parser.add_argument("--rate", type=float, default=20.0, help="전체 초당 전송 메시지 수")
+    parser.add_argument("--duration", type=float, default=10.0, help="측정 시간 (초)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="연결 후 측정 전 대기 시간 (초)")
+    parser.add_argument("--codec", choices=("json", "msgpack"), default="json", help="WebSocket 코덱")
+    parser.add_argument("--room", default="", help="접속할 방 (비우면 기본 방)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--store", choices=("memory", "sqlite", "firestore"), default="memory",
+                        help="서버 메시지 저장소 (firestore는 인메모리 Firestore 대체 모듈 사용)")
+    parser.add_argument("--server-url", default="", help="이미 실행 중인 서버 주소 (지정하면 서버를 띄우지 않음)")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="동시에 진행할 연결 수")
+    parser.add_argument("--output", default="", help="결과 JSON 파일 경로 (비우면 표준 출력)")
+    return parser.parse_args()
+
+
+# --- 서버 프로세스 ---
+
+def start_server(port: int, store: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.setdefault("PYTHONUNBUFFERED", "1")
+    return subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "serve.py"), "--port", str(port), "--store", store],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, base_url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f"{base_url}/healthz") as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("서버가 준비되지 않았습니다")
+
+
+def read_process_stats(pid: int) -> dict:
+    """/proc에서 프로세스 CPU 시간(초)과 메모리(KB) 읽기"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    # utime, stime은 comm 이후 12, 13번째 필드
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / ticks
+    memory = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                memory[key] = int(value.split()[0])
+    return {"cpu_seconds": cpu_seconds, "rss_kb": memory.get("VmRSS", 0), "peak_rss_kb": memory.get("VmHWM", 0)}
+
+
+# --- 가상 클라이언트 ---
+
+class BenchClient:
+    def __init__(self, index: int, codec: str):
+        self.nickname = f"bench-{index}"
+        self.codec = codec
+        self.ws = None
+        self.latencies: list[float] = []
+        self.received = 0
+        self.recording = False
+
+    async def connect(self, session: aiohttp.ClientSession, ws_url: str, room: str):
+        headers = {"x-nickname": urllib.parse.quote(self.nickname)}
+        if room:
+            headers["x-room"] = urllib.parse.quote(room)
+        protocols = ("chat.msgpack",) if self.codec == "msgpack" else ("chat.json",)
+        self.ws = await session.ws_connect(ws_url, headers=headers, protocols=protocols, max_msg_size=0)
+
+    async def send(self, content: str):
+        message = {"nickname": self.nickname, "content": content}
+        if self.ws.protocol == "chat.msgpack":
+            await self.ws.send_bytes(msgpack.packb(message, use_bin_type=True))
+        else:
+            await self.ws.send_str(json.dumps(message))
+
+    async def listen(self):
+        async for msg in self.ws:
+            received_at = time.monotonic_ns()
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                data = msgpack.unpackb(msg.data, raw=False)
+            elif msg.type == aiohttp.WSMsgType.TEXT:
+                data = json.loads(msg.data)
+            else:
+                break
+            content = data.get("content")
+            if not self.recording or not isinstance(content, str) or not content.startswith(BENCH_PREFIX):
+                continue
+            self.received += 1
+            self.latencies.append((received_at - int(content[len(BENCH_PREFIX):])) / 1e9)
+
+
+async def sender_loop(client: BenchClient, interval: float, stop_at: float, counter: list):
+    next_send = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            return
+        if next_send > now:
+            await asyncio.sleep(next_send - now)
+        await client.send(f"{BENCH_PREFIX}{time.monotonic_ns()}")
+        counter[0] += 1
+        next_send += interval
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+# --- 실행 ---
+
+async def run(args) -> dict:
+    if args.codec == "msgpack" and msgpack is None:
+        raise SystemExit("msgpack이 설치되어 있지 않습니다")
+
+    server = None
+    base_url = args.server_url.rstrip("/") or f"http://127.0.0.1:{args.port}"
+    ws_url = base_url.replace("http://", "ws://").replace("https://", "wss://") + "/ws"
+    if not args.server_url:
+        server = start_server(args.port, args.store)
+
+    connector = aiohttp.TCPConnector(limit=0)
+    try:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_until_ready(session, base_url)
+
+            clients = [BenchClient(i, args.codec) for i in range(args.clients)]
+            semaphore = asyncio.Semaphore(args.connect_concurrency)
+
+            async def connect(client):
+                async with semaphore:
+                    await client.connect(session, ws_url, args.room)
+
+            connect_started = time.monotonic()
+            await asyncio.gather(*(connect(c) for c in clients))
+            connect_seconds = time.monotonic() - connect_started
+            listeners = [asyncio.create_task(c.listen()) for c in clients]
+
+            # 입장 알림 등이 모두 전달될 때까지 대기한 뒤 측정 시작
+            await asyncio.sleep(args.warmup)
+            for c in clients:
+                c.recording = True
+
+            stats_before = read_process_stats(server.pid) if server else None
+            senders = clients[:max(1, min(args.senders, len(clients)))]
+            interval = len(senders) / args.rate
+            sent = [0]
+            started = time.monotonic()
+            stop_at = started + args.duration
+            await asyncio.gather(*(sender_loop(c, interval, stop_at, sent) for c in senders))
+            # 마지막 메시지가 전달될 시간을 잠시 기다림
+            await asyncio.sleep(1.0)
+            elapsed = time.monotonic() - started
+            stats_after = read_process_stats(server.pid) if server else None
+
+            for c in clients:
+                c.recording = False
+            for c in clients:
+                await c.ws.close()
+            for task in listeners:
+                task.cancel()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    latencies = sorted(l for c in clients for l in c.latencies)
+    delivered = sum(c.received for c in clients)
+    expected = sent[0] * len(clients)
+    result = {
+        "benchmark": "ws_fanout",
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "config": {
+            "clients": args.clients,
+            "senders": len(senders),
+            "rate": args.rate,
+            "duration": args.duration,
+            "codec": args.codec,
+            "room": args.room,
+            "store": args.store,
+        },
+        "connect_seconds": round(connect_seconds, 3),
+        "messages_sent": sent[0],
+        "deliveries": delivered,
+        "deliveries_expected": expected,
+        "delivery_ratio": round(delivered / expected, 4) if expected else 0.0,
+        "throughput": {
+            "sent_per_second": round(sent[0] / args.duration, 2),
+            "delivered_per_second": round(delivered / elapsed, 2),
+        },
+        "latency_seconds": {
+            "p50": percentile(latencies, 0.50),
+            "p99": percentile(latencies, 0.99),
+            "p999": percentile(latencies, 0.999),
+            "max": latencies[-1] if latencies else 0.0,
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        },
+    }
+    if stats_before and stats_after:
+        cpu = stats_after["cpu_seconds"] - stats_before["cpu_seconds"]
+        result["server"] = {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(100 * cpu / elapsed, 1),
+            "rss_kb": stats_after["rss_kb"],
+            "peak_rss_kb": stats_after["peak_rss_kb"],
+        }
+    return result
+
+
+def raise_fd_limit():
+    # 수천 개의 연결을 열 수 있도록 파일 디스크립터 한도를 최대로 올림 (서버 프로세스에도 상속됨)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def main():
+    args = parse_args()
+    raise_fd_limit()
+    result = asyncio.run(run(args))
+    output = json.dumps(result, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
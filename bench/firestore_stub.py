@@ -0,0 +1,165 @@
+# 벤치마크용 인메모리 Firestore 대체 구현
+# firebase_admin 패키지 대신 sys.modules에 등록하여 server.py가 네트워크 없이 동작하도록 함
+# (server.py가 사용하는 API만 구현: collection/document/set/batch/order_by/where/limit/limit_to_last/count)
+import sys
+import threading
+import types
+import uuid
+from datetime import datetime, timezone
+
+SERVER_TIMESTAMP = object()
+
+_lock = threading.Lock()
+# 컬렉션 경로: {문서 ID: 데이터}
+_collections: dict[str, dict[str, dict]] = {}
+
+
+class _Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, path, filters=(), order=None, direction="ASCENDING", limit=None, limit_to_last=None):
+        self._path = path
+        self._filters = tuple(filters)
+        self._order = order
+        self._direction = direction
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, order=self._order, direction=self._direction,
+                     limit=self._limit, limit_to_last=self._limit_to_last)
+        state.update(changes)
+        return _Query(self._path, **state)
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=field, direction=direction)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def limit_to_last(self, count):
+        return self._copy(limit_to_last=count)
+
+    def count(self):
+        return _CountQuery(self)
+
+    def get(self):
+        with _lock:
+            docs = [_Snapshot(self._path, doc_id, dict(data)) for doc_id, data in _collections.get(self._path, {}).items()]
+        for field, op, value in self._filters:
+            if op == ">":
+                docs = [d for d in docs if d._data.get(field) is not None and d._data[field] > value]
+            elif op == "<":
+                docs = [d for d in docs if d._data.get(field) is not None and d._data[field] < value]
+            elif op == "==":
+                docs = [d for d in docs if d._data.get(field) == value]
+        if self._order:
+            docs.sort(key=lambda d: d._data.get(self._order), reverse=self._direction == self.DESCENDING)
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        if self._limit_to_last is not None:
+            docs = docs[-self._limit_to_last:]
+        return docs
+
+    stream = get
+
+
+class _CountResult:
+    def __init__(self, value):
+        self.value = value
+
+
+class _CountQuery:
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        return [[_CountResult(len(self._query.get()))]]
+
+
+class _Snapshot:
+    def __init__(self, path, doc_id, data):
+        self.id = doc_id
+        self._data = data
+        self.reference = _DocumentReference(path, doc_id)
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _DocumentReference:
+    def __init__(self, path, doc_id):
+        self._path = path
+        self.id = doc_id
+
+    def set(self, data):
+        data = {k: (datetime.now(timezone.utc) if v is SERVER_TIMESTAMP else v) for k, v in data.items()}
+        with _lock:
+            _collections.setdefault(self._path, {})[self.id] = data
+
+    def delete(self):
+        with _lock:
+            _collections.get(self._path, {}).pop(self.id, None)
+
+    def collection(self, name):
+        return _CollectionReference(f"{self._path}/{self.id}/{name}")
+
+
+class _CollectionReference(_Query):
+    def __init__(self, path):
+        super().__init__(path)
+
+    def document(self, doc_id=None):
+        return _DocumentReference(self._path, doc_id or uuid.uuid4().hex[:20])
+
+
+class _WriteBatch:
+    # Firestore와 같은 배치 한도
+    MAX_OPERATIONS = 500
+
+    def __init__(self):
+        self._ops = []
+
+    def set(self, ref, data):
+        self._ops.append((ref.set, data))
+
+    def delete(self, ref):
+        self._ops.append((lambda _: ref.delete(), None))
+
+    def commit(self):
+        if len(self._ops) > self.MAX_OPERATIONS:
+            raise ValueError(f"batch too large: {len(self._ops)}")
+        for op, data in self._ops:
+            op(data)
+
+
+class _Client:
+    def collection(self, name):
+        return _CollectionReference(name)
+
+    def batch(self):
+        return _WriteBatch()
+
+
+def install():
+    """firebase_admin, firebase_admin.credentials, firebase_admin.firestore를 대체 모듈로 등록"""
+    firebase_admin = types.ModuleType("firebase_admin")
+    firebase_admin.initialize_app = lambda cred=None, options=None: None
+
+    credentials = types.ModuleType("firebase_admin.credentials")
+    credentials.Certificate = lambda key: key
+
+    firestore = types.ModuleType("firebase_admin.firestore")
+    firestore.SERVER_TIMESTAMP = SERVER_TIMESTAMP
+    firestore.Query = _Query
+    firestore.client = lambda app=None: _Client()
+
+    firebase_admin.credentials = credentials
+    firebase_admin.firestore = firestore
+    sys.modules["firebase_admin"] = firebase_admin
+    sys.modules["firebase_admin.credentials"] = credentials
+    sys.modules["firebase_admin.firestore"] = firestore
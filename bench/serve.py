@@ -0,0 +1,46 @@
+# 벤치마크용 서버 실행: Firebase 키 없이 오프라인으로 server.app을 띄움
+# 사용법: python bench/serve.py --port 8765 [--store memory|sqlite|firestore]
+#   memory    - 인메모리 저장소 (기본값)
+#   sqlite    - 임시 디렉터리의 SQLite 파일
+#   firestore - Firestore 저장소 경로를 인메모리 Firestore 대체 모듈로 실행
+import argparse
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="오프라인 저장소로 채팅 서버 실행")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--store", choices=("memory", "sqlite", "firestore"),
+                        default=os.getenv("CHAT_STORE", "memory"))
+    args = parser.parse_args()
+
+    os.environ["CHAT_STORE"] = args.store
+    # 가상 클라이언트가 정해진 속도로 계속 보내므로 전송 속도 제한은 기본적으로 끔
+    os.environ.setdefault("RATE_LIMIT_NICKNAME_RATE", "0")
+    os.environ.setdefault("RATE_LIMIT_CONNECTION_RATE", "0")
+    # 보관소의 세그먼트 쓰기(fsync)가 측정에 섞이지 않고 저장소 폴더에 파일이 남지 않도록 보관소도 끔
+    os.environ.setdefault("CHAT_ARCHIVE_DIR", "")
+    if args.store == "sqlite":
+        os.environ.setdefault("CHAT_SQLITE_PATH", os.path.join(tempfile.mkdtemp(prefix="chat-bench-"), "chat.db"))
+    elif args.store == "firestore":
+        import firestore_stub
+        firestore_stub.install()
+        # init_firebase()가 키를 찾을 수 있도록 더미 키 설정 (실제로는 사용되지 않음)
+        os.environ.setdefault("FIREBASE_KEY_PATH", "/nonexistent")
+        os.environ.setdefault("FIREBASE_KEY_JSON", "{}")
+
+    import uvicorn
+    import server
+
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
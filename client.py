@@ -6,8 +6,18 @@ import os
 import webbrowser
 import urllib.parse
 import random
+import uuid
+import sqlite3
+from collections import OrderedDict, deque
 from datetime import datetime, timezone, timedelta
 
+from message_cache import MessageCache
+
+try:
+    import msgpack
+except ImportError:  # msgpack이 없으면 JSON 텍스트 프레임만 사용
+    msgpack = None
+
 # uv run flet pack client.py --name "BambooForest" --icon "assets/icons/bamboo.ico" --add-data "assets;assets"
 
 # --- 서버 URL 설정 ---
@@ -21,6 +31,125 @@ elif SERVER_URL.startswith("http://"):
 else:
     WS_URL = f"ws://{SERVER_URL}/ws"
 
+# 접속할 채팅방 (비워두면 서버의 기본 방)
+CHAT_ROOM = os.getenv("CHAT_ROOM", "")
+
+# --- WebSocket 코덱 (서브프로토콜) ---
+# 선호 순서대로 요청하고 서버가 선택한 코덱으로 송수신 (MessagePack: 바이너리, JSON: 텍스트)
+CODEC_JSON = "chat.json"
+CODEC_MSGPACK = "chat.msgpack"
+WS_PROTOCOLS = (CODEC_MSGPACK, CODEC_JSON) if msgpack else (CODEC_JSON,)
+
+# --- 화면 갱신 ---
+# 메시지를 받을 때마다 page.update()를 호출하지 않고, 최대 CHAT_RENDER_FPS번/초로 모아서 한 번에 갱신
+RENDER_INTERVAL = 1 / max(float(os.getenv("CHAT_RENDER_FPS", "30")), 1.0)
+
+# 한국 시간(KST, UTC+9)
+KST = timezone(timedelta(hours=9))
+
+# 다른 사람 말풍선 색상 (닉네임마다 고정)
+# 라이트 모드용 팔레트
+LIGHT_PALETTE = (
+    ft.Colors.INDIGO_400, ft.Colors.PINK_400, ft.Colors.PURPLE_400,
+    ft.Colors.DEEP_PURPLE_400, ft.Colors.INDIGO_400, ft.Colors.CYAN_400,
+    ft.Colors.TEAL_400, ft.Colors.GREEN_400, ft.Colors.LIME_400,
+    ft.Colors.AMBER_400, ft.Colors.ORANGE_400, ft.Colors.BROWN_400,
+    ft.Colors.BLUE_GREY_400,
+)
+# 다크 모드용 팔레트 (톤 다운된 색상)
+DARK_PALETTE = (
+    ft.Colors.INDIGO_700, ft.Colors.PINK_900, ft.Colors.PURPLE_900,
+    ft.Colors.DEEP_PURPLE_900, ft.Colors.INDIGO_900, ft.Colors.CYAN_900,
+    ft.Colors.TEAL_900, ft.Colors.GREEN_900, ft.Colors.LIME_900,
+    ft.Colors.AMBER_900, ft.Colors.ORANGE_900, ft.Colors.BROWN_900,
+    ft.Colors.BLUE_GREY_900,
+)
+
+# --- 메시지 목록 크기 제한 ---
+# 화면에는 최근 CHAT_MAX_RENDERED_MESSAGES개만 그리고, 그보다 오래된 메시지는 말풍선을 지워 메모리에만 보관
+# (최대 CHAT_EVICTED_BUFFER_SIZE개, 위로 끝까지 스크롤하면 RELOAD_PAGE_SIZE개씩 다시 그림)
+MAX_RENDERED_MESSAGES = int(os.getenv("CHAT_MAX_RENDERED_MESSAGES", "200"))
+EVICTED_BUFFER_SIZE = int(os.getenv("CHAT_EVICTED_BUFFER_SIZE", "1000"))
+RELOAD_PAGE_SIZE = 50
+# 화면에서 내린 메시지를 모두 다시 그린 뒤에는 서버의 /history에서 이 개수씩 더 오래된 메시지를 받아옴
+HISTORY_PAGE_SIZE = 50
+# 이전 메시지를 읽는 동안에도 이 수를 넘으면 오래된 말풍선을 지움
+MAX_RENDERED_HARD_LIMIT = MAX_RENDERED_MESSAGES * 3
+# 중복 표시 방지용으로 기억하는 메시지 ID 수
+SEEN_IDS_LIMIT = int(os.getenv("CHAT_SEEN_IDS_LIMIT", "2000"))
+
+
+class RecentIds:
+    """최근 본 메시지 ID 집합 (최대 limit개, 가장 오래전에 본 ID부터 잊음)"""
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._ids = OrderedDict()
+
+    def __contains__(self, msg_id) -> bool:
+        return msg_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, msg_id):
+        self._ids[msg_id] = None
+        self._ids.move_to_end(msg_id)
+        if len(self._ids) > self.limit:
+            self._ids.popitem(last=False)
+
+    def clear(self):
+        self._ids.clear()
+
+
+# --- 로컬 메시지 캐시 ---
+# 서버 주소 + 닉네임 + 방마다 받은 메시지를 CHAT_CACHE_DIR의 SQLite 파일에 저장 (비워두면 캐시 사용 안 함)
+# 로그인하면 저장된 최근 CHAT_CACHE_RENDER_LIMIT개를 바로 그리고, 서버에서는 그 이후 메시지만 /messages(after)로 받아옴
+CACHE_DIR = os.getenv("CHAT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".bamboo_forest", "cache"))
+CACHE_SIZE = int(os.getenv("CHAT_CACHE_SIZE", "1000"))  # 파일에 보관하는 최대 메시지 수
+CACHE_RENDER_LIMIT = int(os.getenv("CHAT_CACHE_RENDER_LIMIT", "100"))
+SYNC_PAGE_SIZE = 30  # 서버 /messages가 한 번에 반환하는 최대 메시지 수
+SYNC_MAX_PAGES = 10  # 누락분을 받아올 때 요청하는 최대 페이지 수 (나머지는 접속 시 catchup으로 받음)
+
+# --- 전송 대기열 ---
+# 보내는 메시지마다 고유한 client_id(멱등성 키)를 붙이고, 서버의 ack를 받을 때까지 대기열에 보관
+# 연결이 끊긴 동안 보낸 메시지도 대기열에 쌓였다가 재연결하면 순서대로 다시 전송 (서버가 client_id로 중복을 걸러냄)
+# 대기열은 한 번에 하나씩 보내고 서버 응답(ack/에러)을 받은 뒤 다음 메시지를 보냄 (속도 제한에 걸리면 그 자리에서 멈춤)
+OUTBOX_LIMIT = int(os.getenv("CHAT_OUTBOX_LIMIT", "100"))
+OUTBOX_REPLY_TIMEOUT = float(os.getenv("CHAT_OUTBOX_REPLY_TIMEOUT", "10"))  # 응답을 기다리는 최대 시간 (초)
+# 서버가 받는 메시지 최대 길이 (서버의 MAX_CONTENT_LENGTH와 같게, 서버가 알려주면 그 값으로 갱신)
+# 넘는 메시지는 대기열에 넣지 않음 (서버가 어떤 메시지인지 알 수 없는 오류로 거부하므로 대기열에 계속 남게 됨)
+MAX_MESSAGE_LENGTH = int(os.getenv("CHAT_MAX_MESSAGE_LENGTH", "2000"))
+
+
+# --- 입력 중 표시 ---
+# 입력하는 동안 TYPING_SEND_INTERVAL초에 한 번만 서버에 알림 (서버는 약 5초 동안 아무 알림이 없으면 입력 중 표시를 지움)
+TYPING_SEND_INTERVAL = 2.0
+
+
+# --- 재연결 ---
+# 연결이 끊어지면 지수 백오프 + full jitter로 재연결 (대기 시간: 0 ~ min(최대, 기본 * 2^(시도-1)) 사이 무작위)
+# CHAT_RECONNECT_MAX_ATTEMPTS번 연속 실패하면 로그아웃 (0이면 계속 시도)
+RECONNECT_BASE_DELAY = float(os.getenv("CHAT_RECONNECT_BASE_DELAY", "1"))
+RECONNECT_MAX_DELAY = float(os.getenv("CHAT_RECONNECT_MAX_DELAY", "30"))
+RECONNECT_MAX_ATTEMPTS = int(os.getenv("CHAT_RECONNECT_MAX_ATTEMPTS", "0"))
+CONNECT_TIMEOUT = float(os.getenv("CHAT_CONNECT_TIMEOUT", "15"))  # 서버 연결(핸드셰이크 포함) 제한 시간 (초)
+HTTP_CONNECTION_LIMIT = 4  # 공유 HTTP 세션의 최대 동시 연결 수
+
+# --- 하트비트 ---
+# HEARTBEAT_INTERVAL초 동안 받은 프레임이 없으면 서버에 ping을 보내고,
+# HEARTBEAT_TIMEOUT초 동안 아무것도 받지 못하면 (pong 포함) 연결이 끊긴 것으로 보고 재연결
+HEARTBEAT_INTERVAL = float(os.getenv("CHAT_HEARTBEAT_INTERVAL", "15"))
+HEARTBEAT_TIMEOUT = float(os.getenv("CHAT_HEARTBEAT_TIMEOUT", "45"))
+
+
+async def send_frame(ws, message: dict):
+    """협상된 코덱으로 메시지를 인코딩하여 전송"""
+    if ws.protocol == CODEC_MSGPACK:
+        await ws.send_bytes(msgpack.packb(message, use_bin_type=True))
+    else:
+        # 한글을 \uXXXX로 늘리지 않음 (서버는 프레임 길이를 먼저 검사하므로 최대 길이 안의 메시지가 프레임 단계에서 거부되지 않도록)
+        await ws.send_str(json.dumps(message, ensure_ascii=False))
+
 
 async def main(page: ft.Page):
     page.title = "Bamboo Forest"
@@ -41,13 +170,55 @@ async def main(page: ft.Page):
     # --- 상태 관리 ---
     # WebSocket 연결, 리스너 태스크, 닉네임 등을 관리
     ws_connection = [None]
+    # 로그인 동안 공유하는 HTTP 세션 (WebSocket과 HTTP 요청이 함께 사용)
+    http_session = [None]
     ws_listener_task = [None]
     inactivity_task = [None]
     user_nickname = [None]
     last_active_time = [datetime.now()]
     
     # 이미 표시된 메시지 ID (중복 방지)
-    seen_message_ids = set()
+    seen_message_ids = RecentIds(SEEN_IDS_LIMIT)
+    # 마지막으로 받은 메시지의 시퀀스 번호 (재연결 시 누락분 요청 및 누락 감지에 사용)
+    last_seq = [0]
+    # 서버의 전송 속도 제한: 이 시각(루프 시간)까지는 전송하지 않음
+    send_blocked_until = [0.0]
+    # 서버가 아직 수락(ack)하지 않은 내 메시지 (client_id -> 내용, 보낸 순서)와 속도 제한이 풀린 뒤 다시 보내는 태스크
+    outbox = OrderedDict()
+    outbox_retry_task = [None]
+    # 대기열을 순서대로 보내는 태스크와 응답을 기다리는 메시지 (client_id -> Future)
+    outbox_flush_task = [None]
+    outbox_replies = {}
+    # 속도 제한에 걸린 재동기화 요청: 다시 요청할 시퀀스 번호와 예약된 태스크
+    resync_from = [None]
+    resync_task = [None]
+    # 서버가 받는 메시지 최대 길이 (message_too_large 오류에 담긴 값으로 갱신)
+    max_message_length = [MAX_MESSAGE_LENGTH]
+    # 서버가 종료하면서 알려준 재접속 대기 시간 (초, None이면 지수 백오프 사용)
+    reconnect_hint = [None]
+
+    # 화면 갱신 대기열: 아직 그리지 않은 메시지, 예약된 갱신 태스크, 마지막 갱신 시각(루프 시간)
+    pending_messages = []
+    render_task = [None]
+    last_render_time = [0.0]
+    # 닉네임별 말풍선 스타일 캐시 (캐시를 만든 테마가 바뀌면 비움)
+    style_cache = {}
+    style_cache_theme = [None]
+    # 화면에 그려진 메시지 데이터 (chat_list.controls와 같은 순서)와 화면에서 내린 오래된 메시지 (오른쪽이 최신)
+    rendered_items = deque()
+    evicted_items = deque(maxlen=EVICTED_BUFFER_SIZE)
+    # 사용자가 목록 맨 아래를 보고 있는지 (위로 스크롤해서 읽는 중에는 자동 스크롤/말풍선 정리를 멈춤)
+    at_bottom = [True]
+    # 로컬 메시지 캐시와 아직 캐시에 쓰지 않은 메시지 (화면 갱신과 함께 한 트랜잭션으로 저장)
+    message_cache = [None]
+    pending_cache_writes = []
+    # 현재 방의 접속자 (서버의 roster/presence 프레임으로 갱신)
+    online_users = set()
+    # 마지막으로 입력 중 알림을 보낸 시각 (루프 시간, 0이면 입력 중이 아님)
+    typing_sent_at = [0.0]
+    # 서버에서 이전 메시지를 받아오는 태스크와, 더 받을 메시지가 없는지 여부
+    history_task = [None]
+    history_exhausted = [False]
 
     # --- 활동 감지 ---
     def update_activity(e=None):
@@ -62,72 +233,190 @@ async def main(page: ft.Page):
     # --- UI 요소 ---
     chat_list = ft.ListView(expand=True, spacing=10, auto_scroll=True)
     message_input = ft.TextField(label="메시지 입력", expand=True)
+    # 연결 상태 표시 (재연결 중일 때만 보임)
+    connection_status = ft.Text("", size=12, color=ft.Colors.ORANGE_400)
+    # 접속자 수 표시 (마우스를 올리면 닉네임 목록)
+    online_count = ft.Text("", size=12, color=ft.Colors.GREY_500)
+    # 다른 사람의 입력 중 표시 (메시지 목록에 말풍선을 추가하지 않고 입력창 위 한 줄만 갱신)
+    typing_indicator = ft.Text("", size=12, italic=True, color=ft.Colors.GREY_500)
 
     # --- 함수 정의 ---
 
     def display_message(msg_id: str, nickname: str, content: str, timestamp: str = None, msg_type: str = "user"):
-        """채팅 메시지를 화면에 표시하는 함수"""
+        """채팅 메시지를 화면 갱신 대기열에 추가 (실제 그리기는 flush_messages에서 한 프레임에 모아서 처리)"""
         if msg_id and msg_id in seen_message_ids:
             return
         if msg_id:
             seen_message_ids.add(msg_id)
 
-        # 시스템 메시지 처리
-        if msg_type == "system":
-            chat_list.controls.append(
-                ft.Row(
-                    [
-                        ft.Container(
-                            content=ft.Text(content, size=14, color=ft.Colors.WHITE),
-                            bgcolor=ft.Colors.GREY_900,
-                            padding=ft.Padding(10, 4, 10, 4),
-                            border_radius=10,
-                        )
-                    ],
-                    alignment=ft.MainAxisAlignment.CENTER,
-                )
-            )
-            page.update()
+        pending_messages.append((nickname, content, timestamp, msg_type))
+        if render_task[0] is None:
+            render_task[0] = asyncio.create_task(flush_messages())
+
+    async def flush_messages():
+        """마지막 갱신 후 한 프레임 간격이 지나면 그동안 쌓인 메시지를 모두 그리고 page.update()는 한 번만 호출"""
+        loop = asyncio.get_running_loop()
+        delay = last_render_time[0] + RENDER_INTERVAL - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        render_task[0] = None
+        if not pending_messages:
             return
 
-        is_me = nickname == user_nickname[0]
-        
-        # 현재 테마 모드 감지
+        is_dark_mode = current_dark_mode()
+        batch = pending_messages[:]
+        pending_messages.clear()
+        chat_list.controls.extend(build_message_control(*item, is_dark_mode) for item in batch)
+        rendered_items.extend(batch)
+        trim_rendered()
+        last_render_time[0] = loop.time()
+        page.update()
+        save_pending_to_cache()
+
+    def save_pending_to_cache():
+        """서버에서 받은 메시지를 로컬 캐시에 한 번에 저장"""
+        if not pending_cache_writes:
+            return
+        batch = pending_cache_writes[:]
+        pending_cache_writes.clear()
+        if message_cache[0] is None:
+            return
+        try:
+            message_cache[0].add_many(batch)
+        except sqlite3.Error as err:
+            print(f"메시지 캐시 저장 에러: {err}")
+
+    def current_dark_mode() -> bool:
+        """현재 다크 모드인지 확인 (테마가 바뀌었을 때만 닉네임별 스타일을 다시 계산하도록 캐시를 비움)"""
         is_dark_mode = page.theme_mode == ft.ThemeMode.DARK or (
             page.theme_mode == ft.ThemeMode.SYSTEM and page.platform_brightness == ft.Brightness.DARK
         )
+        if style_cache_theme[0] != is_dark_mode:
+            style_cache.clear()
+            style_cache_theme[0] = is_dark_mode
+        return is_dark_mode
 
+    def trim_rendered():
+        """화면에 그린 말풍선이 제한을 넘으면 가장 오래된 것부터 지우고 데이터만 보관"""
+        limit = MAX_RENDERED_MESSAGES if at_bottom[0] else MAX_RENDERED_HARD_LIMIT
+        excess = len(chat_list.controls) - limit
+        if excess <= 0:
+            return
+        del chat_list.controls[:excess]
+        for _ in range(excess):
+            evicted_items.append(rendered_items.popleft())
+
+    def load_older_messages():
+        """화면에서 내린 이전 메시지를 RELOAD_PAGE_SIZE개씩 목록 위쪽에 다시 그림"""
+        count = min(RELOAD_PAGE_SIZE, len(evicted_items))
+        if count == 0:
+            return
+        items = [evicted_items.pop() for _ in range(count)]
+        items.reverse()
+        is_dark_mode = current_dark_mode()
+        chat_list.controls[0:0] = [build_message_control(*item, is_dark_mode) for item in items]
+        rendered_items.extendleft(reversed(items))
+        page.update()
+
+    async def fetch_older_history():
+        """화면 맨 위 메시지보다 오래된 메시지를 서버의 /history에서 받아 목록 위쪽에 그림"""
+        before = next((item[2] for item in rendered_items if item[3] == "user" and item[2]), None)
+        payload = {"nickname": user_nickname[0], "limit": HISTORY_PAGE_SIZE}
+        if CHAT_ROOM:
+            payload["room"] = CHAT_ROOM
+        if before:
+            payload["before"] = before
+        try:
+            session = await get_http_session()
+            async with session.post(f"{SERVER_URL}/history", json=payload) as resp:
+                if resp.status != 200:
+                    print(f"이전 메시지 조회 실패. Status: {resp.status}")
+                    return
+                data = await resp.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            print(f"이전 메시지 조회 에러: {err}")
+            return
+        finally:
+            history_task[0] = None
+        # 받아오는 동안 로그아웃한 경우
+        if user_nickname[0] is None:
+            return
+        if not data.get("has_more"):
+            history_exhausted[0] = True
+        items = []
+        for item in data.get("messages", []):
+            msg_id = item.get("id")
+            if msg_id and msg_id in seen_message_ids:
+                continue
+            if msg_id:
+                seen_message_ids.add(msg_id)
+            items.append((item.get("nickname", "알 수 없음"), item.get("content", ""), item.get("timestamp"), "user"))
+        if not items:
+            return
+        is_dark_mode = current_dark_mode()
+        chat_list.controls[0:0] = [build_message_control(*item, is_dark_mode) for item in items]
+        rendered_items.extendleft(reversed(items))
+        page.update()
+
+    def on_chat_scroll(e):
+        """맨 위에 닿으면 이전 메시지를 다시 그리고, 맨 아래로 돌아오면 자동 스크롤과 말풍선 정리를 재개"""
+        update_activity()
+        bottom = e.pixels >= e.max_scroll_extent - 20
+        if bottom != at_bottom[0]:
+            at_bottom[0] = bottom
+            chat_list.auto_scroll = bottom
+            if bottom:
+                trim_rendered()
+            page.update()
+        if e.pixels <= e.min_scroll_extent:
+            if evicted_items:
+                load_older_messages()
+            elif not history_exhausted[0] and history_task[0] is None and user_nickname[0]:
+                history_task[0] = asyncio.create_task(fetch_older_history())
+
+    chat_list.on_scroll = on_chat_scroll
+    chat_list.scroll_interval = 100
+
+    def nickname_style(nickname: str, is_dark_mode: bool) -> dict:
+        """닉네임별 말풍선 스타일 (현재 테마 기준으로 캐시)"""
+        style = style_cache.get(nickname)
+        if style is not None:
+            return style
+
+        is_me = nickname == user_nickname[0]
         if is_me:
             # 내 메시지: 다크모드면 조금 더 어두운 파란색
             bg_color = ft.Colors.BLUE_800 if is_dark_mode else ft.Colors.BLUE_400
         else:
-            # 라이트 모드용 팔레트 (기존)
-            light_palette = [
-                ft.Colors.INDIGO_400, ft.Colors.PINK_400, ft.Colors.PURPLE_400,
-                ft.Colors.DEEP_PURPLE_400, ft.Colors.INDIGO_400, ft.Colors.CYAN_400,
-                ft.Colors.TEAL_400, ft.Colors.GREEN_400, ft.Colors.LIME_400,
-                ft.Colors.AMBER_400, ft.Colors.ORANGE_400, ft.Colors.BROWN_400,
-                ft.Colors.BLUE_GREY_400,
-            ]
-            
-            
-            # 다크 모드용 팔레트 (톤 다운된 색상)
-            dark_palette = [
-                ft.Colors.INDIGO_700, ft.Colors.PINK_900, ft.Colors.PURPLE_900,
-                ft.Colors.DEEP_PURPLE_900, ft.Colors.INDIGO_900, ft.Colors.CYAN_900,
-                ft.Colors.TEAL_900, ft.Colors.GREEN_900, ft.Colors.LIME_900,
-                ft.Colors.AMBER_900, ft.Colors.ORANGE_900, ft.Colors.BROWN_900,
-                ft.Colors.BLUE_GREY_900,
-            ]
-
-            current_palette = dark_palette if is_dark_mode else light_palette
-            
+            current_palette = DARK_PALETTE if is_dark_mode else LIGHT_PALETTE
             color_index = sum(ord(c) for c in nickname) % len(current_palette)
             bg_color = current_palette[color_index]
 
-        text_color = ft.Colors.WHITE
-        # 테마 모드에 따른 닉네임 색상 설정 (다크: 밝게, 라이트: 어둡게)
-        nickname_color = ft.Colors.WHITE if is_dark_mode else ft.Colors.BLACK
+        style = style_cache[nickname] = {
+            "bg_color": bg_color,
+            # 테마 모드에 따른 닉네임 색상 설정 (다크: 밝게, 라이트: 어둡게)
+            "nickname_color": ft.Colors.WHITE if is_dark_mode else ft.Colors.BLACK,
+            "alignment": ft.MainAxisAlignment.END if is_me else ft.MainAxisAlignment.START,
+        }
+        return style
+
+    def build_message_control(nickname: str, content: str, timestamp: str, msg_type: str, is_dark_mode: bool):
+        """메시지 하나의 말풍선 컨트롤 생성"""
+        # 시스템 메시지 처리
+        if msg_type == "system":
+            return ft.Row(
+                [
+                    ft.Container(
+                        content=ft.Text(content, size=14, color=ft.Colors.WHITE),
+                        bgcolor=ft.Colors.GREY_900,
+                        padding=ft.Padding(10, 4, 10, 4),
+                        border_radius=10,
+                    )
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+            )
+
+        style = nickname_style(nickname, is_dark_mode)
 
         # 시간 포맷팅
         time_str = ""
@@ -135,25 +424,21 @@ async def main(page: ft.Page):
             try:
                 # ISO 문자열을 datetime 객체로 변환
                 dt = datetime.fromisoformat(timestamp)
-                
+
                 # 만약 타임존 정보가 없다면 UTC로 가정
                 if dt.tzinfo is None:
                     dt = dt.replace(tzinfo=timezone.utc)
-                
+
                 # 한국 시간(KST, UTC+9)으로 변환
-                kst_timezone = timezone(timedelta(hours=9))
-                dt_kst = dt.astimezone(kst_timezone)
-                
-                time_str = dt_kst.strftime("%H:%M:%S")
+                time_str = dt.astimezone(KST).strftime("%H:%M:%S")
             except ValueError:
                 time_str = ""
 
-
         header_controls = [
             ft.Text(
                 nickname, 
                 size=15, 
-                color=nickname_color, 
+                color=style["nickname_color"], 
                 weight=ft.FontWeight.NORMAL, 
                 selectable=True,
                 
@@ -162,120 +447,418 @@ async def main(page: ft.Page):
         if time_str:
             header_controls.append(ft.Text(time_str, size=12, color=ft.Colors.BLACK_45, selectable=True))
 
-        chat_list.controls.append(
-            ft.Row(
-                [
-                    ft.Container(
-                        content=ft.Column(
-                            [
-                                ft.Row(header_controls, spacing=5),
-                                ft.Text(content, color=text_color, size=16, selectable=True),
-                            ],
-                            spacing=2,
-                        ),
-                        bgcolor=bg_color,
-                        padding=10,
-                        border_radius=10,
-                    )
-                ],
-                alignment=ft.MainAxisAlignment.END if is_me else ft.MainAxisAlignment.START,
-            )
+        return ft.Row(
+            [
+                ft.Container(
+                    content=ft.Column(
+                        [
+                            ft.Row(header_controls, spacing=5),
+                            ft.Text(content, color=ft.Colors.WHITE, size=16, selectable=True),
+                        ],
+                        spacing=2,
+                    ),
+                    bgcolor=style["bg_color"],
+                    padding=10,
+                    border_radius=10,
+                )
+            ],
+            alignment=style["alignment"],
         )
-        page.update()
 
-    # async def load_initial_messages():
-    #     """서버에서 초기 메시지를 로드하는 함수"""
-    #     try:
-    #         # 닉네임을 JSON Body로 전달하여 화이트리스트 검증 수행 (POST)
-    #         payload = {"nickname": user_nickname[0]}
-    #         async with aiohttp.ClientSession() as session:
-    #             async with session.post(f"{SERVER_URL}/messages", json=payload) as resp:
-    #                 if resp.status == 200:
-    #                     messages = await resp.json()
-    #                     for msg in messages:
-    #                         display_message(
-    #                             msg.get("id", ""),
-    #                             msg.get("nickname", "알 수 없음"),
-    #                             msg.get("content", "..."),
-    #                             msg.get("timestamp"),
-    #                             msg.get("type", "user"),
-    #                         )
-    #                 elif resp.status == 403:
-    #                      print("접근 권한이 없습니다 (화이트리스트 제한).")
-    #                      await perform_logout("등록되지 않은 닉네임입니다.")
-    #                      return
-    #                 else:
-    #                     print(f"메시지 로드 실패. Status: {resp.status}")
-    #                 page.update()
-
-    #     except Exception as e:
-    #         print(f"초기 메시지 로드 에러: {e}")
+    def show_message(message_data: dict):
+        """서버 메시지 딕셔너리를 화면에 표시 (사용자 메시지는 로컬 캐시에도 저장)"""
+        if message_data.get("type", "user") == "user" and message_data.get("id") and message_data["id"] not in seen_message_ids:
+            pending_cache_writes.append(message_data)
+        display_message(
+            message_data.get("id", ""),
+            message_data.get("nickname", "알 수 없음"),
+            message_data.get("content", "..."),
+            message_data.get("timestamp"),
+            message_data.get("type", "user"), # 타입 전달
+        )
+
+    def handle_error_frame(message_data: dict):
+        """서버가 메시지를 거부한 경우 처리 (속도 제한이면 retry_after 동안 기다렸다가 대기열의 메시지를 다시 전송)"""
+        client_id = message_data.get("client_id")
+        settle_outbox_reply(client_id)
+        if message_data.get("request") == "resync":
+            # 재동기화 요청이 제한에 걸림: 메시지 전송과는 별개이므로 안내 없이 기다렸다가 같은 시퀀스부터 다시 요청
+            if isinstance(message_data.get("last_seq"), int):
+                schedule_resync(message_data["last_seq"], float(message_data.get("retry_after") or 1.0))
+            return
+        if message_data.get("code") == "rate_limited":
+            retry_after = float(message_data.get("retry_after") or 1.0)
+            send_blocked_until[0] = asyncio.get_running_loop().time() + retry_after
+            if client_id in outbox:
+                schedule_outbox_retry()
+            display_message(None, "", f"메시지를 너무 빠르게 보내고 있습니다. {retry_after:.1f}초 후 다시 보냅니다.", msg_type="system")
+            return
+        if message_data.get("code") == "message_too_large" and isinstance(message_data.get("max_length"), int):
+            max_message_length[0] = message_data["max_length"]
+            # 디코딩 전에 거부된 프레임에는 client_id가 없음: 최대 길이를 넘는 대기 메시지를 모두 뺌
+            if client_id is None:
+                too_long = [cid for cid, content in outbox.items() if len(content) > max_message_length[0]]
+                client_id = too_long[0] if too_long else None
+                for cid in too_long:
+                    settle_outbox_reply(cid)
+                for cid in too_long[1:]:
+                    outbox.pop(cid, None)
+        # 다시 보내도 거부될 메시지는 대기열에서 빼고 입력창에 되돌림
+        content = outbox.pop(client_id, None)
+        if content and not message_input.value:
+            message_input.value = content
+        display_message(None, "", message_data.get("error", "메시지를 보낼 수 없습니다."), msg_type="system")
+
+    async def send_outbox_entry(client_id: str, content: str):
+        await send_frame(ws_connection[0], {"nickname": user_nickname[0], "content": content, "client_id": client_id})
+
+    def settle_outbox_reply(client_id):
+        """보낸 메시지에 대한 서버 응답을 받음 (대기열 전송이 다음 메시지로 넘어감)"""
+        reply = outbox_replies.get(client_id)
+        if reply is not None and not reply.done():
+            reply.set_result(None)
+
+    def start_outbox_flush():
+        """대기열 전송 시작 (이미 보내는 중이면 그 태스크가 새로 쌓인 메시지까지 이어서 보냄)"""
+        if outbox_flush_task[0] is None or outbox_flush_task[0].done():
+            outbox_flush_task[0] = asyncio.create_task(flush_outbox())
+
+    async def flush_outbox():
+        """수락받지 못한 메시지를 보낸 순서대로 하나씩 다시 전송 (이미 게시된 메시지는 서버가 ack만 다시 보냄)"""
+        # 응답을 받은 뒤 다음 메시지를 보내므로 속도 제한에 걸리면 첫 거부에서 멈추고 (안내도 한 번만 표시)
+        # 남은 메시지는 제한이 풀린 뒤 retry_outbox가 이어서 보냄
+        sent = set()
+        while True:
+            if ws_connection[0] is None or ws_connection[0].closed:
+                return
+            if send_blocked_until[0] > asyncio.get_running_loop().time():
+                schedule_outbox_retry()
+                return
+            client_id = next((cid for cid in outbox if cid not in sent), None)
+            if client_id is None:
+                return
+            sent.add(client_id)
+            reply = outbox_replies[client_id] = asyncio.get_running_loop().create_future()
+            try:
+                await send_outbox_entry(client_id, outbox[client_id])
+                await asyncio.wait_for(reply, OUTBOX_REPLY_TIMEOUT)
+            except asyncio.TimeoutError:
+                # 응답이 없으면 남은 메시지는 다음 전송이나 재연결 때 다시 보냄
+                print("메시지 응답 대기 시간 초과")
+                return
+            except Exception as err:
+                # 연결이 끊어졌으면 재연결 후 다시 전송됨
+                print(f"메시지 재전송 에러: {err}")
+                return
+            finally:
+                outbox_replies.pop(client_id, None)
+
+    def schedule_outbox_retry():
+        """속도 제한이 풀리는 시각에 대기열의 메시지를 다시 전송하도록 예약"""
+        if outbox_retry_task[0] is None:
+            outbox_retry_task[0] = asyncio.create_task(retry_outbox())
+
+    async def retry_outbox():
+        await asyncio.sleep(max(0.0, send_blocked_until[0] - asyncio.get_running_loop().time()))
+        outbox_retry_task[0] = None
+        start_outbox_flush()
+
+    def schedule_resync(from_seq: int, delay: float):
+        """delay초 뒤 재동기화 요청 (그사이 다른 요청도 제한되면 가장 이른 시퀀스부터 한 번만)"""
+        resync_from[0] = from_seq if resync_from[0] is None else min(resync_from[0], from_seq)
+        if resync_task[0] is None:
+            resync_task[0] = asyncio.create_task(retry_resync(delay))
+
+    async def retry_resync(delay: float):
+        await asyncio.sleep(delay)
+        from_seq = resync_from[0]
+        resync_from[0] = None
+        resync_task[0] = None
+        if ws_connection[0] and not ws_connection[0].closed:
+            await send_frame(ws_connection[0], {"type": "resync", "last_seq": from_seq})
+
+    def update_online_count():
+        online_count.value = f"{len(online_users)}명 접속 중" if online_users else ""
+        online_count.tooltip = ", ".join(sorted(online_users)) or None
+
+    def format_nicknames(nicknames: list) -> str:
+        """입장/퇴장 알림용 닉네임 나열 (많으면 일부만)"""
+        if len(nicknames) <= 3:
+            return ", ".join(nicknames)
+        return f"{', '.join(nicknames[:3])} 외 {len(nicknames) - 3}명"
+
+    def handle_presence(message_data: dict):
+        """접속자 변경분 반영 (서버가 모아서 보내므로 여러 명의 입장/퇴장을 한 줄로 표시)"""
+        joined = [n for n in message_data.get("joined", []) if n not in online_users]
+        left = [n for n in message_data.get("left", []) if n in online_users]
+        online_users.update(joined)
+        online_users.difference_update(left)
+        update_online_count()
+        joined = [n for n in joined if n != user_nickname[0]]
+        if joined:
+            display_message(None, "", f"{format_nicknames(joined)}님이 입장하셨습니다.", msg_type="system")
+        if left:
+            display_message(None, "", f"{format_nicknames(left)}님이 퇴장하셨습니다.", msg_type="system")
+        if not joined and not left:
+            page.update()
+
+    def show_typing(nicknames: list):
+        """입력 중인 닉네임 표시 (나는 제외)"""
+        others = [n for n in nicknames if n != user_nickname[0]]
+        if not others:
+            text = ""
+        elif len(others) > 3:
+            text = "여러 명이 입력 중..."
+        else:
+            text = f"{', '.join(others)}님이 입력 중..."
+        if typing_indicator.value != text:
+            typing_indicator.value = text
+            page.update()
+
+    async def send_typing(active: bool):
+        """입력 중 상태를 서버에 알림 (저장되지 않는 일시적 이벤트)"""
+        if not ws_connection[0] or ws_connection[0].closed:
+            return
+        try:
+            await send_frame(ws_connection[0], {"type": "typing", "active": active})
+        except Exception as err:
+            print(f"입력 중 알림 전송 에러: {err}")
+
+    async def on_input_change(e):
+        """입력하는 동안 TYPING_SEND_INTERVAL초마다 입력 중 알림, 입력창을 비우면 해제"""
+        now = asyncio.get_running_loop().time()
+        if message_input.value:
+            if now - typing_sent_at[0] >= TYPING_SEND_INTERVAL:
+                typing_sent_at[0] = now
+                await send_typing(True)
+        elif typing_sent_at[0]:
+            typing_sent_at[0] = 0.0
+            await send_typing(False)
+
+    message_input.on_change = on_input_change
+
+    async def handle_server_message(message_data: dict):
+        """서버에서 받은 프레임을 종류에 따라 처리"""
+        msg_type = message_data.get("type", "user")
+
+        if msg_type == "error":
+            handle_error_frame(message_data)
+            return
+
+        # 서버 하트비트: 받은 ts를 그대로 돌려주면 서버가 왕복 시간을 측정
+        if msg_type == "ping":
+            await send_frame(ws_connection[0], {"type": "pong", "ts": message_data.get("ts")})
+            return
+        if msg_type == "pong":
+            return
+
+        # 접속 직후 현재 접속자 전체, 이후에는 변경분
+        if msg_type == "roster":
+            online_users.clear()
+            online_users.update(message_data.get("nicknames", []))
+            update_online_count()
+            page.update()
+            return
+        if msg_type == "presence":
+            handle_presence(message_data)
+            return
+        if msg_type == "typing":
+            show_typing(message_data.get("nicknames", []))
+            return
+
+        # 서버 종료(배포) 예고: 연결이 끊기면 서버가 정해준 시간만큼 기다렸다가 재접속 (클라이언트마다 달라 재접속이 분산됨)
+        if msg_type == "reconnect":
+            reconnect_hint[0] = max(0.0, float(message_data.get("after_ms") or 0) / 1000)
+            return
+
+        # 서버가 내 메시지를 수락함: 대기열에서 제거 (메시지 자체는 브로드캐스트로 따로 받음)
+        if msg_type == "ack":
+            outbox.pop(message_data.get("client_id"), None)
+            settle_outbox_reply(message_data.get("client_id"))
+            return
+
+        # 접속 직후 또는 재동기화 요청에 대한 누락 메시지 묶음
+        if msg_type == "catchup":
+            for item in message_data.get("messages", []):
+                show_message(item)
+            last_seq[0] = message_data.get("last_seq", last_seq[0])
+            return
+
+        # 시퀀스 번호가 건너뛰면 중간 메시지가 빠진 것이므로 서버에 재동기화 요청
+        seq = message_data.get("seq")
+        if msg_type == "user" and isinstance(seq, int):
+            if seq > last_seq[0] + 1 and ws_connection[0] and not ws_connection[0].closed:
+                print(f"메시지 누락 감지 (마지막: {last_seq[0]}, 수신: {seq}). 재동기화 요청")
+                await send_frame(ws_connection[0], {"type": "resync", "last_seq": last_seq[0]})
+            last_seq[0] = max(last_seq[0], seq)
+
+        show_message(message_data)
+
+    async def get_http_session() -> aiohttp.ClientSession:
+        """로그인 동안 공유하는 HTTP 세션 (재연결할 때마다 새로 만들지 않고 커넥션을 재사용)"""
+        if http_session[0] is None or http_session[0].closed:
+            http_session[0] = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=HTTP_CONNECTION_LIMIT),
+                timeout=aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT),
+            )
+        return http_session[0]
+
+    async def open_message_cache():
+        """로컬 캐시를 열고 저장된 최근 메시지를 바로 화면에 표시"""
+        if not CACHE_DIR:
+            return
+        try:
+            cache = await asyncio.to_thread(
+                MessageCache.open_for, CACHE_DIR, SERVER_URL, user_nickname[0], CHAT_ROOM, CACHE_SIZE
+            )
+            cached = await asyncio.to_thread(cache.recent, CACHE_RENDER_LIMIT)
+            cached_seq = await asyncio.to_thread(cache.last_seq)
+        except (OSError, sqlite3.Error) as err:
+            print(f"메시지 캐시 열기 실패: {err}")
+            return
+        # 캐시를 여는 동안 로그아웃한 경우
+        if user_nickname[0] is None:
+            cache.close()
+            return
+        message_cache[0] = cache
+        # 재연결 시 누락분 요청 기준 (화면에 표시하는 최근 메시지뿐 아니라 캐시 전체의 마지막 시퀀스 번호)
+        last_seq[0] = max(last_seq[0], cached_seq)
+        # 이미 캐시에 있는 메시지이므로 show_message 대신 display_message로 화면에만 추가
+        for item in cached:
+            display_message(item["id"], item["nickname"], item["content"], item["timestamp"])
+        print(f"캐시된 메시지 {len(cached)}개 표시")
+
+    async def fetch_missed_messages() -> bool:
+        """캐시의 마지막 메시지 이후 메시지만 /messages(after)로 받아옴 (서버에 연결할 수 없으면 False)"""
+        after = message_cache[0].last_timestamp() if message_cache[0] else None
+        try:
+            session = await get_http_session()
+            for _ in range(SYNC_MAX_PAGES):
+                payload = {"nickname": user_nickname[0]}
+                if CHAT_ROOM:
+                    payload["room"] = CHAT_ROOM
+                if after:
+                    payload["after"] = after
+                async with session.post(f"{SERVER_URL}/messages", json=payload) as resp:
+                    if resp.status == 403:
+                        print("접근 권한이 없습니다 (화이트리스트 제한).")
+                        await perform_logout("등록되지 않은 닉네임입니다.")
+                        return False
+                    if resp.status != 200:
+                        print(f"메시지 동기화 실패. Status: {resp.status}")
+                        return False
+                    messages = await resp.json()
+                for item in messages:
+                    await handle_server_message(item)
+                # 캐시가 없으면 최신 메시지 한 페이지만 받음
+                if not after or len(messages) < SYNC_PAGE_SIZE:
+                    break
+                after = messages[-1].get("timestamp")
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+            print(f"메시지 동기화 에러: {err}")
+            return False
+
+    def set_connection_status(text: str):
+        """채팅 화면 상단의 연결 상태 표시 갱신 (빈 문자열이면 숨김)"""
+        if connection_status.value != text:
+            connection_status.value = text
+            page.update()
 
     async def websocket_listener():
         """WebSocket 연결 및 메시지 수신을 처리하는 리스너"""
+        first_connect = True
+        # 연속으로 실패한 재연결 시도 횟수 (연결되면 0으로 초기화)
+        reconnect_attempt = 0
+        # WebSocket 연결 전에 캐시 이후의 메시지만 HTTP로 받아옴 (실패하면 캐시된 메시지만 보여주는 읽기 전용 상태)
+        if not await fetch_missed_messages():
+            if user_nickname[0] is None:
+                return
+            set_connection_status("오프라인")
         while True:
-            # 연결이 끊어지면 2초 후 재연결 시도
             if ws_connection[0] is None or ws_connection[0].closed:
+                # 연결이 끊어지면 지수 백오프 + full jitter로 대기한 뒤 재연결
+                # (서버가 재시작되어도 모든 클라이언트가 같은 순간에 다시 접속하지 않도록 대기 시간을 무작위로 분산)
+                if not first_connect:
+                    reconnect_attempt += 1
+                    if RECONNECT_MAX_ATTEMPTS and reconnect_attempt > RECONNECT_MAX_ATTEMPTS:
+                        await perform_logout("서버에 연결할 수 없습니다. 인터넷 연결을 확인해주세요.")
+                        return
+                    delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (reconnect_attempt - 1)))
+                    if reconnect_hint[0] is not None:
+                        # 서버 재시작: 첫 재접속은 서버가 알려준 시간에 시도
+                        delay = reconnect_hint[0]
+                        reconnect_hint[0] = None
+                    set_connection_status(f"재연결 중... ({reconnect_attempt}번째 시도)")
+                    show_typing([])
+                    print(f"{delay:.1f}초 후 재연결 시도 ({reconnect_attempt}번째)")
+                    await asyncio.sleep(delay)
+                first_connect = False
                 try:
-                    session = aiohttp.ClientSession()
+                    session = await get_http_session()
                     
                     # 닉네임을 헤더에 추가 (URL 인코딩하여 전송)
                     # 한글 닉네임 등을 안전하게 전송하기 위함
                     encoded_nickname = urllib.parse.quote(user_nickname[0])
                     headers = {"x-nickname": encoded_nickname}
+                    if CHAT_ROOM:
+                        headers["x-room"] = urllib.parse.quote(CHAT_ROOM)
+                    # 마지막으로 받은 시퀀스 번호를 보내면 서버가 누락 메시지를 한 번에 보내줌
+                    # (첫 접속은 0이므로 최근 메시지가 초기 메시지로 로드됨)
+                    headers["x-last-seq"] = str(last_seq[0])
+                    # 서버 ping에 pong으로 응답하는 클라이언트임을 알림 (응답이 없으면 서버가 연결을 정리)
+                    headers["x-heartbeat"] = "1"
                     
-                    ws = await session.ws_connect(WS_URL, headers=headers)
+                    ws = await session.ws_connect(WS_URL, headers=headers, protocols=WS_PROTOCOLS)
                     ws_connection[0] = ws
+                    last_received = asyncio.get_running_loop().time()
+                    reconnect_attempt = 0
+                    set_connection_status("")
                     print("WebSocket 연결됨")
                     
-                    # 연결 후 초기 메시지 로드 (비활성화)
-                    # await load_initial_messages()
-                    # 초기 메시지 로드 중 로그아웃(화이트리스트 거부 등)되면 리스너 종료
-                    if user_nickname[0] is None:
-                        return
+                    # 연결이 끊긴 동안 쌓였거나 ack를 받지 못한 메시지 재전송 (응답은 이 수신 루프가 받으므로 별도 태스크)
+                    start_outbox_flush()
 
                 except aiohttp.WSServerHandshakeError as e:
                     if e.status == 403:
                          print("접근 권한이 없습니다 (화이트리스트 제한 - WebSocket).")
-                         await session.close()
                          ws_connection[0] = None
                          await perform_logout("등록되지 않은 닉네임입니다.")
                          return
                     print(f"WebSocket 핸드쉐이크 에러: {e}")
-                    await session.close()
                     ws_connection[0] = None
-                    await asyncio.sleep(2)
                     continue
 
-                except aiohttp.ClientConnectorError as e:
-                    print(f"서버 연결 실패: {e}")
-                    await session.close()
-                    ws_connection[0] = None
-                    await perform_logout("서버에 연결할 수 없습니다. 인터넷 연결을 확인해주세요.")
-                    return
-
                 except Exception as e:
+                    # 서버 연결 실패(ClientConnectorError) 등: 로그아웃하지 않고 재연결 상태로 계속 시도
                     print(f"WebSocket 연결 에러: {e}")
-                    await session.close() # 세션 정리
                     ws_connection[0] = None
-                    await asyncio.sleep(2)
                     continue
 
             # 메시지 수신 대기
             try:
-                msg = await ws_connection[0].receive()
-                if msg.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    msg = await ws_connection[0].receive(timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    # 한동안 받은 프레임이 없음: ping을 보내고, 응답 없는 시간이 길어지면 receive() 실패를 기다리지 않고 재연결
+                    if asyncio.get_running_loop().time() - last_received > HEARTBEAT_TIMEOUT:
+                        print("서버 응답 없음 (하트비트 시간 초과). 재연결합니다")
+                        await ws_connection[0].close()
+                        ws_connection[0] = None
+                    else:
+                        await send_frame(ws_connection[0], {"type": "ping"})
+                    continue
+                last_received = asyncio.get_running_loop().time()
+                if msg.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
                     try:
-                        message_data = json.loads(msg.data)
-                        display_message(
-                            message_data.get("id", ""),
-                            message_data.get("nickname", "알 수 없음"),
-                            message_data.get("content", "..."),
-                            message_data.get("timestamp"),
-                            message_data.get("type", "user"), # 타입 전달
-                        )
-                    except json.JSONDecodeError:
-                        print(f"JSON 파싱 에러: {msg.data}")
+                        # 텍스트 프레임은 JSON, 바이너리 프레임은 MessagePack
+                        if msg.type == aiohttp.WSMsgType.BINARY:
+                            message_data = msgpack.unpackb(msg.data, raw=False)
+                        else:
+                            message_data = json.loads(msg.data)
+                        await handle_server_message(message_data)
+                    except (ValueError, AttributeError) as err:
+                        print(f"메시지 파싱 에러: {err}")
                 elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
                     # 화이트리스트 거부 (4003) 확인
                     if ws_connection[0].close_code == 4003:
@@ -296,18 +879,34 @@ async def main(page: ft.Page):
         if not message_input.value:
             return
 
+        # 서버가 거부할 긴 메시지는 보내지 않고 입력한 내용을 그대로 둠
+        if len(message_input.value) > max_message_length[0]:
+            display_message(None, "", f"메시지는 {max_message_length[0]}자를 넘을 수 없습니다.", msg_type="system")
+            return
+
+        # 대기열이 가득 차면 보내지 않고 입력한 내용을 그대로 둠
+        if len(outbox) >= OUTBOX_LIMIT:
+            display_message(None, "", "전송을 기다리는 메시지가 너무 많습니다. 잠시 후 다시 보내주세요.", msg_type="system")
+            return
+
         msg_content = message_input.value
         message_input.value = ""
+        # 메시지를 받은 서버가 입력 중 표시를 해제함
+        typing_sent_at[0] = 0.0
         await message_input.focus()
 
-        # WebSocket으로 메시지 전송
-        if ws_connection[0] and not ws_connection[0].closed:
-            try:
-                await ws_connection[0].send_str(
-                    json.dumps({"nickname": user_nickname[0], "content": msg_content})
-                )
-            except Exception as err:
-                print(f"메시지 전송 에러: {err}")
+        # ack를 받을 때까지 대기열에 보관 (연결이 끊겨 있거나 속도 제한 중이면 나중에 자동으로 전송)
+        client_id = uuid.uuid4().hex
+        outbox[client_id] = msg_content
+        remaining = send_blocked_until[0] - asyncio.get_running_loop().time()
+        if not ws_connection[0] or ws_connection[0].closed:
+            display_message(None, "", "서버에 연결되어 있지 않습니다. 연결되면 자동으로 전송됩니다.", msg_type="system")
+        elif remaining > 0:
+            display_message(None, "", f"{remaining:.1f}초 후 자동으로 전송됩니다.", msg_type="system")
+            schedule_outbox_retry()
+        else:
+            # 앞서 보낸 메시지의 응답을 기다리는 중이면 그 다음에 보냄
+            start_outbox_flush()
         page.update()
 
     message_input.on_submit = send_click
@@ -332,6 +931,21 @@ async def main(page: ft.Page):
             ws_listener_task[0].cancel()
         ws_listener_task[0] = None
 
+        if outbox_retry_task[0]:
+            outbox_retry_task[0].cancel()
+        outbox_retry_task[0] = None
+        if outbox_flush_task[0]:
+            outbox_flush_task[0].cancel()
+        outbox_flush_task[0] = None
+        outbox_replies.clear()
+        if resync_task[0]:
+            resync_task[0].cancel()
+        resync_task[0] = None
+        resync_from[0] = None
+        if outbox:
+            print(f"전송하지 못한 메시지 {len(outbox)}개를 버립니다")
+        outbox.clear()
+
         # 활동 모니터링 태스크 중지
         if inactivity_task[0]:
             inactivity_task[0].cancel()
@@ -342,10 +956,35 @@ async def main(page: ft.Page):
             await ws_connection[0].close()
             ws_connection[0] = None
             print("WebSocket 연결 종료됨")
+        if http_session[0]:
+            await http_session[0].close()
+            http_session[0] = None
+        connection_status.value = ""
+        if message_cache[0]:
+            message_cache[0].close()
+            message_cache[0] = None
 
         # 상태 초기화
         user_nickname[0] = None
         seen_message_ids.clear()
+        pending_messages.clear()
+        pending_cache_writes.clear()
+        rendered_items.clear()
+        evicted_items.clear()
+        if history_task[0]:
+            history_task[0].cancel()
+            history_task[0] = None
+        history_exhausted[0] = False
+        at_bottom[0] = True
+        chat_list.auto_scroll = True
+        style_cache.clear()
+        online_users.clear()
+        update_online_count()
+        typing_indicator.value = ""
+        typing_sent_at[0] = 0.0
+        last_seq[0] = 0
+        send_blocked_until[0] = 0.0
+        reconnect_hint[0] = None
         chat_list.controls.clear()
         
         page.clean()
@@ -403,6 +1042,8 @@ async def main(page: ft.Page):
         user_nickname[0] = nickname
         page.clean()  # 페이지의 모든 컨트롤 제거
         await build_chat_view()  # 채팅 화면 구성
+        # 로컬 캐시에 저장된 최근 메시지를 서버 응답을 기다리지 않고 바로 표시
+        await open_message_cache()
         
         # WebSocket 리스너 시작
         if ws_listener_task[0] is None:
@@ -496,6 +1137,8 @@ async def main(page: ft.Page):
                                 ),
                                 margin=ft.Margin(10,0,0,0)
                             ),
+                            ft.Container(online_count, margin=ft.Margin(10,0,0,0)),
+                            ft.Container(connection_status, margin=ft.Margin(10,0,0,0)),
                         ],
                         vertical_alignment=ft.CrossAxisAlignment.CENTER,
                         spacing=0,
@@ -510,6 +1153,7 @@ async def main(page: ft.Page):
             ),
             ft.Divider(),
             chat_list,
+            typing_indicator,
             ft.Divider(),
             ft.Row(
                 [
@@ -0,0 +1,108 @@
+# 일시적인 이벤트 (입력 중 표시 등)
+# 채팅 메시지와 달리 저장/기록/정리 대상이 아니며, 방별로 "지금 이 이벤트 상태인 닉네임" 집합만 메모리에 유지
+# - 같은 닉네임이 이벤트를 여러 번 보내도 만료 시각만 연장 (상태가 바뀐 경우만 전송 대상)
+# - 전송은 flush_interval초마다 바뀐 방에만 현재 집합 전체를 프레임 하나로 보냄 (방별 초당 프레임 수 상한)
+# - 다른 서버 프로세스의 상태는 백플레인으로 받아 합침
+import asyncio
+import time
+from typing import Callable, Optional
+
+from remote_state import RemoteState
+
+# 메시지 형식
+# 클라이언트 -> 서버: {"type": 이벤트, "active": true/false}        (active를 생략하면 true)
+# 서버 -> 클라이언트: {"type": 이벤트, "room": 방, "nicknames": [...]}
+# 백플레인:           {"type": 이벤트 + "_state", "origin": 프로세스 ID, "nicknames": [...]}
+
+
+class EphemeralChannel:
+    """방별 일시적 이벤트 상태 (닉네임 -> 만료 시각)"""
+    def __init__(self, event: str, origin: str, deliver: Callable[[str, dict], None],
+                 publish: Callable[[str, dict], None], ttl: float = 5.0, flush_interval: float = 0.5):
+        self.event = event
+        self.state_type = f"{event}_state"
+        self.origin = origin
+        self.deliver = deliver
+        self.publish = publish
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        # 방 -> 닉네임 -> 만료 시각
+        self.local: dict[str, dict[str, float]] = {}
+        # 다른 프로세스의 방별 상태 (ttl/2마다 다시 오므로 ttl 동안 오지 않으면 만료)
+        self.remote = RemoteState(origin, ttl)
+        # 클라이언트에 보낼 방 / 다른 프로세스에 알릴 방
+        self.dirty: set = set()
+        self.local_dirty: set = set()
+        # 전송한 프레임 수 (메트릭용)
+        self.sent = 0
+        self._synced = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def update(self, room: str, nickname: str, active: bool = True):
+        """닉네임의 이벤트 상태 갱신 (시작/연장 또는 종료)"""
+        states = self.local.get(room)
+        if active:
+            if states is None:
+                states = self.local[room] = {}
+            if nickname not in states:
+                self._mark(room)
+            states[nickname] = time.monotonic() + self.ttl
+        elif states is not None and states.pop(nickname, None) is not None:
+            if not states:
+                del self.local[room]
+            self._mark(room)
+
+    def nicknames(self, room: str) -> list:
+        return sorted(set(self.local.get(room, ())) | self.remote.nicknames(room))
+
+    def apply_remote(self, room: str, message: dict):
+        """다른 서버 프로세스의 상태 반영 (백플레인 수신)"""
+        changed = self.remote.apply(room, message)
+        if changed is not None and changed[0] != changed[1]:
+            self.dirty.add(room)
+
+    def tick(self, now: float):
+        """만료된 상태를 정리하고 바뀐 방에 현재 상태 전송"""
+        for room, states in list(self.local.items()):
+            expired = [n for n, expires_at in states.items() if expires_at <= now]
+            for nickname in expired:
+                del states[nickname]
+            if expired:
+                self._mark(room)
+            if not states:
+                del self.local[room]
+        for room, _ in self.remote.expire(now):
+            self.dirty.add(room)
+
+        for room in self.dirty:
+            self.deliver(room, {"type": self.event, "room": room, "nicknames": self.nicknames(room)})
+            self.sent += 1
+        self.dirty = set()
+        # 다른 프로세스는 ttl이 지나면 상태를 잊으므로, 이벤트가 이어지는 방은 ttl/2마다 다시 알림
+        if now - self._synced >= self.ttl / 2:
+            self._synced = now
+            self.local_dirty |= set(self.local)
+        for room in self.local_dirty:
+            self.publish(room, {"type": self.state_type, "origin": self.origin,
+                                "nicknames": sorted(self.local.get(room, ()))})
+        self.local_dirty = set()
+
+    def _mark(self, room: str):
+        self.dirty.add(room)
+        self.local_dirty.add(room)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.tick(time.monotonic())
+            except Exception as e:
+                print(f"{self.event} 이벤트 전송 에러: {e}")
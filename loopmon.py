@@ -0,0 +1,179 @@
+# 이벤트 루프 상태 모니터 (선택 기능, CHAT_LOOPMON=1)
+# 동기 저장소 호출 등으로 이벤트 루프가 멈추는 구간을 print 출력으로 짐작하지 않고 직접 측정
+# - 지연(lag): interval초마다 깨어나는 작업이 예정보다 얼마나 늦게 깨어났는지 기록
+# - 멈춤(stall): 감시 스레드가 루프의 마지막 깨어난 시각을 확인하다가 threshold초 넘게 멈춰 있으면
+#   그 순간 루프 스레드의 호출 스택을 sys._current_frames()로 잡아 둠 (루프가 멈춘 원인 코드)
+# - 단계(phase): 핸들러 안의 구간별 소요 시간 (threshold를 넘으면 느린 단계로 기록)
+# 멈춤/느린 단계는 JSON 한 줄 로그로 출력하고 최근 것만 보관 (관리자 엔드포인트에서 조회)
+# 평소 비용은 interval초마다 깨어나는 작업 하나와 감시 스레드 하나, 단계마다 perf_counter 두 번
+import asyncio
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Callable, Optional
+
+# 멈춤 스택에 남기는 최대 프레임 수 (가장 안쪽부터)
+STACK_LIMIT = 20
+# 지연 백분위 계산에 쓰는 최근 측정값 수
+LAG_SAMPLES = 600
+
+_NULL_PHASE = nullcontext()
+
+
+def log_json(event: dict):
+    """구조화 로그 한 줄 출력"""
+    record = {"ts": datetime.now(timezone.utc).isoformat(), **event}
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
+
+
+class _Phase:
+    __slots__ = ("monitor", "name", "started")
+
+    def __init__(self, monitor: "LoopMonitor", name: str):
+        self.monitor = monitor
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.monitor.record_phase(self.name, time.perf_counter() - self.started)
+        return False
+
+
+class LoopMonitor:
+    """이벤트 루프 지연/멈춤과 핸들러 단계별 소요 시간 측정"""
+    def __init__(self, enabled: bool, interval: float = 0.5, threshold: float = 0.1, keep_events: int = 100,
+                 on_lag: Optional[Callable[[float], None]] = None,
+                 on_phase: Optional[Callable[[str, float], None]] = None,
+                 log: Callable[[dict], None] = log_json):
+        self.enabled = enabled
+        self.interval = interval
+        self.threshold = threshold
+        # 측정값을 메트릭에도 반영하는 콜백
+        self.on_lag = on_lag
+        self.on_phase = on_phase
+        self.log = log
+        self.lags: deque = deque(maxlen=LAG_SAMPLES)
+        self.max_lag = 0.0
+        self.stalls = 0
+        # 최근 멈춤/느린 단계 (오래된 것부터)
+        self.events: deque = deque(maxlen=keep_events)
+        # 단계 이름 -> [횟수, 합계, 최대, 느린 횟수]
+        self.phases: dict[str, list] = {}
+        # 루프가 마지막으로 깨어난 시각 (감시 스레드가 읽음)
+        self._beat = time.monotonic()
+        # 감시 스레드가 잡은 멈춤: (멈춘 구간의 _beat, 스택)
+        self._captured: Optional[tuple[float, list]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self.task = asyncio.create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loopmon-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self._watchdog:
+            self._stop.set()
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    def phase(self, name: str):
+        """with 블록의 소요 시간을 단계 name으로 기록 (비활성화 상태면 아무것도 하지 않음)"""
+        return _Phase(self, name) if self.enabled else _NULL_PHASE
+
+    def record_phase(self, name: str, elapsed: float):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = [0, 0.0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+        if self.on_phase:
+            self.on_phase(name, elapsed)
+        if elapsed >= self.threshold:
+            stats[3] += 1
+            self._event({"event": "slow_phase", "phase": name, "seconds": round(elapsed, 6)})
+
+    def snapshot(self) -> dict:
+        """관리자 엔드포인트 응답"""
+        lags = sorted(self.lags)
+
+        def percentile(p: float) -> Optional[float]:
+            return round(lags[min(len(lags) - 1, int(len(lags) * p))], 6) if lags else None
+
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "lag": {
+                "last": round(self.lags[-1], 6) if self.lags else None,
+                "p50": percentile(0.5),
+                "p99": percentile(0.99),
+                "max": round(self.max_lag, 6),
+                "samples": len(lags),
+            },
+            "stalls": self.stalls,
+            "phases": {
+                name: {"count": count, "avg": round(total / count, 6), "max": round(peak, 6), "slow": slow}
+                for name, (count, total, peak, slow) in self.phases.items()
+            },
+            "events": list(self.events),
+        }
+
+    def _event(self, event: dict):
+        event = {"ts": datetime.now(timezone.utc).isoformat(), **event}
+        self.events.append(event)
+        self.log(event)
+
+    async def _run(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            stalled_beat = self._beat
+            self._beat = now
+            self.lags.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if self.on_lag:
+                self.on_lag(lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                captured = self._captured
+                stack = captured[1] if captured and captured[0] == stalled_beat else None
+                self._event({"event": "loop_stall", "seconds": round(lag, 6), "stack": stack})
+
+    def _watch(self):
+        # 루프가 threshold 넘게 깨어나지 않으면 멈춘 구간마다 한 번 스택을 잡음
+        check_interval = max(min(self.threshold / 2, self.interval), 0.01)
+        while not self._stop.wait(check_interval):
+            beat = self._beat
+            if time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            if self._captured and self._captured[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = [line.rstrip() for line in traceback.format_stack(frame)[-STACK_LIMIT:]]
+            self._captured = (beat, stack)
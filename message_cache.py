@@ -0,0 +1,84 @@
+# 클라이언트 로컬 메시지 캐시 (SQLite)
+# 서버 주소 + 닉네임 + 방마다 파일 하나를 사용
+# 로그인하면 저장된 마지막 메시지를 바로 그리고, 서버에서는 그 이후의 메시지만 가져옴 (서버에 연결할 수 없으면 읽기 전용)
+import hashlib
+import os
+import sqlite3
+from typing import Optional
+
+# 캐시 파일을 정리할 때 남기는 메시지 수의 여유분 (매번 정리하지 않도록 keep의 10%를 넘으면 정리)
+TRIM_SLACK = 0.1
+
+
+class MessageCache:
+    """서버에서 받은 사용자 메시지를 시간순으로 보관하는 로컬 캐시"""
+    def __init__(self, path: str, keep: int):
+        self.path = path
+        self.keep = keep
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id TEXT PRIMARY KEY,"
+            " seq INTEGER,"
+            " nickname TEXT,"
+            " content TEXT,"
+            " timestamp TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp)")
+        self._conn.commit()
+        self.trim()
+
+    @classmethod
+    def open_for(cls, directory: str, server_url: str, nickname: str, room: str, keep: int) -> "MessageCache":
+        """서버/닉네임/방에 해당하는 캐시 파일 열기 (파일 이름은 해시로 만들어 특수 문자를 피함)"""
+        os.makedirs(directory, exist_ok=True)
+        key = hashlib.sha1(f"{server_url}|{nickname}|{room}".encode("utf-8")).hexdigest()[:16]
+        return cls(os.path.join(directory, f"messages-{key}.db"), keep)
+
+    def recent(self, limit: int) -> list:
+        """가장 최근 메시지 limit개 (과거 -> 현재 순)"""
+        rows = self._conn.execute(
+            "SELECT id, seq, nickname, content, timestamp FROM messages ORDER BY timestamp DESC, rowid DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [
+            {"type": "user", "id": msg_id, "seq": seq, "nickname": nickname, "content": content, "timestamp": timestamp}
+            for msg_id, seq, nickname, content, timestamp in reversed(rows)
+        ]
+
+    def add_many(self, messages: list):
+        """메시지 여러 개를 한 트랜잭션으로 저장 (이미 있는 ID는 무시)"""
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO messages (id, seq, nickname, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [(m["id"], m.get("seq"), m.get("nickname"), m.get("content"), m.get("timestamp")) for m in messages],
+        )
+        self._conn.commit()
+        if self.count() > self.keep * (1 + TRIM_SLACK):
+            self.trim()
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def last_timestamp(self) -> Optional[str]:
+        """가장 최근 메시지의 시각 (서버의 /messages after 파라미터로 사용)"""
+        row = self._conn.execute("SELECT MAX(timestamp) FROM messages").fetchone()
+        return row[0]
+
+    def last_seq(self) -> int:
+        """가장 큰 시퀀스 번호 (재연결 시 서버에 보내는 x-last-seq, 없으면 0)"""
+        row = self._conn.execute("SELECT MAX(seq) FROM messages").fetchone()
+        return row[0] or 0
+
+    def trim(self):
+        """가장 최근 keep개만 남기고 삭제"""
+        self._conn.execute(
+            "DELETE FROM messages WHERE id NOT IN ("
+            " SELECT id FROM messages ORDER BY timestamp DESC, rowid DESC LIMIT ?)",
+            (self.keep,),
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,202 @@
+# Prometheus 텍스트 형식 메트릭 (외부 의존성 없는 최소 구현)
+# 카운터/게이지/히스토그램을 등록해 두고 /metrics 요청 시 한 번에 렌더링
+import bisect
+import math
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Optional
+
+# 지연 시간 히스토그램 기본 버킷 (초)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(str(value))}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    """메트릭 공통 부분 (이름, 설명, 레이블)"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """증가만 하는 누적 값"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> list:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """현재 값. 값을 직접 설정하거나, 렌더링 시 호출할 함수를 지정"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (),
+                 callback: Optional[Callable[[], Iterable]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple, float] = {}
+        # callback은 레이블이 없으면 숫자, 있으면 (레이블 값 튜플, 값) 목록을 반환
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self) -> list:
+        if self.callback is None:
+            items = self._values.items()
+        elif self.labelnames:
+            items = self.callback()
+        else:
+            items = [((), self.callback())]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in items]
+
+
+class Histogram(Metric):
+    """값의 분포 (누적 버킷, 합계, 개수)"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 레이블 값 튜플: [버킷별 개수..., 합계, 전체 개수]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [0] * (len(self.buckets) + 2)
+        # 버킷별로 따로 세고 렌더링할 때 누적 (가장 큰 버킷보다 크면 +Inf에만 포함)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            state[index] += 1
+        state[-2] += value
+        state[-1] += 1
+
+    def time(self, **labels) -> "_Timer":
+        """with 블록의 실행 시간을 기록"""
+        return _Timer(self, labels)
+
+    def _samples(self) -> list:
+        lines = []
+        for key, state in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {state[-1]}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class RateMeter:
+    """최근 window초 동안의 초당 발생 횟수 (1초 단위 슬롯 링)"""
+    def __init__(self, window: int = 10):
+        self.window = window
+        self._slots = [0] * window
+        self._slot_times = [0] * window
+
+    def mark(self, n: int = 1):
+        now = int(time.monotonic())
+        index = now % self.window
+        if self._slot_times[index] != now:
+            self._slot_times[index] = now
+            self._slots[index] = 0
+        self._slots[index] += n
+
+    def rate(self) -> float:
+        now = int(time.monotonic())
+        total = sum(count for count, t in zip(self._slots, self._slot_times) if now - t < self.window)
+        return total / self.window
+
+
+class Registry:
+    """등록된 메트릭 목록"""
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name: str, help_text: str, labelnames: tuple = (), callback=None) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labelnames, callback))
+
+
+def histogram(name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
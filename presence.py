@@ -0,0 +1,151 @@
+# 접속자 목록 (presence)
+# 연결마다 입장/퇴장 시스템 메시지를 브로드캐스트하지 않고, 닉네임별 연결 수를 세어 실제 온라인 상태가 바뀐 경우만 알림
+# - 같은 닉네임의 여러 연결(여러 창, 기기)은 하나로 취급
+# - 마지막 연결이 끊겨도 leave_grace초 안에 다시 접속하면 (재연결, 네트워크 끊김) 퇴장으로 보지 않음
+# - 변경 사항은 방별로 모아 flush_interval초마다 presence 프레임 하나로 전송
+# - 다른 서버 프로세스의 접속자는 백플레인으로 받는 상태(presence_state)를 합쳐서 계산
+import asyncio
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from remote_state import RemoteState
+
+# 메시지 형식
+# 클라이언트: {"type": "roster", "room": 방, "nicknames": [...]}           접속 직후 현재 접속자 전체
+#            {"type": "presence", "room": 방, "joined": [...], "left": [...]}  변경분
+# 백플레인:   {"type": "presence_state", "origin": 프로세스 ID, "nicknames": [...]}  해당 프로세스의 방 접속자 전체
+
+
+class PresenceTracker:
+    """방별 접속자(닉네임) 추적"""
+    def __init__(self, origin: str, deliver: Callable[[str, dict], None], publish: Callable[[str, dict], None],
+                 leave_grace: float = 10.0, flush_interval: float = 1.0, sync_interval: float = 30.0):
+        # origin: 이 프로세스의 백플레인 ID, deliver: 이 프로세스의 방 연결들에 전달, publish: 다른 프로세스에 전달
+        self.origin = origin
+        self.deliver = deliver
+        self.publish = publish
+        self.leave_grace = leave_grace
+        self.flush_interval = flush_interval
+        self.sync_interval = sync_interval
+        # 방 -> 닉네임 -> 이 프로세스의 연결 수
+        self.connections: dict[str, Counter] = {}
+        # 방 -> 닉네임 -> 퇴장 확정 시각 (연결 수가 0이 된 뒤 유예 중, 그동안은 접속 중으로 취급)
+        self.pending_leaves: dict[str, dict[str, float]] = {}
+        # 다른 프로세스의 방별 접속자 (상태는 sync_interval마다 다시 오므로, 몇 번 연속으로 오지 않으면 만료)
+        self.remote = RemoteState(origin, sync_interval * 3)
+        # 방 -> 클라이언트에 알린 접속자 집합
+        self.announced: dict[str, set] = {}
+        # 방 -> 온라인 상태가 바뀌었을 수 있는 닉네임 (다음 flush에서 확인)
+        self.dirty: dict[str, set] = {}
+        # 이 프로세스의 접속자가 바뀌어 다른 프로세스에 바로 알려야 하는 방
+        self.local_dirty: set = set()
+        self._synced = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def join(self, room: str, nickname: str):
+        """연결 하나가 방에 들어옴"""
+        counts = self.connections.setdefault(room, Counter())
+        counts[nickname] += 1
+        if counts[nickname] > 1:
+            return
+        pending = self.pending_leaves.get(room)
+        if pending is not None and pending.pop(nickname, None) is not None:
+            # 유예 중에 다시 접속: 퇴장/입장 모두 알리지 않음
+            if not pending:
+                del self.pending_leaves[room]
+            return
+        self._mark(room, nickname)
+
+    def leave(self, room: str, nickname: str):
+        """연결 하나가 방에서 나감 (마지막 연결이면 유예 시간 뒤 퇴장 처리)"""
+        counts = self.connections.get(room)
+        if not counts or counts[nickname] <= 0:
+            return
+        counts[nickname] -= 1
+        if counts[nickname] > 0:
+            return
+        del counts[nickname]
+        if not counts:
+            del self.connections[room]
+        self.pending_leaves.setdefault(room, {})[nickname] = time.monotonic() + self.leave_grace
+
+    def local_nicknames(self, room: str) -> set:
+        return set(self.connections.get(room, ())) | set(self.pending_leaves.get(room, ()))
+
+    def roster(self, room: str) -> list:
+        """방의 현재 접속자 (모든 서버 프로세스, 이름순)"""
+        return sorted(self.local_nicknames(room) | self.remote.nicknames(room))
+
+    def rooms(self) -> set:
+        return set(self.connections) | set(self.pending_leaves) | set(self.remote.rooms)
+
+    def snapshot(self, room: str) -> dict:
+        """접속 직후 보내는 접속자 목록 프레임"""
+        return {"type": "roster", "room": room, "nicknames": self.roster(room)}
+
+    def apply_remote(self, room: str, message: dict):
+        """다른 서버 프로세스의 접속자 상태 반영 (백플레인 수신)"""
+        changed = self.remote.apply(room, message)
+        if changed is not None and changed[0] != changed[1]:
+            self.dirty.setdefault(room, set()).update(changed[0] ^ changed[1])
+
+    def tick(self, now: float):
+        """유예/만료 처리 후 변경분을 클라이언트와 다른 프로세스에 전송"""
+        for room, pending in list(self.pending_leaves.items()):
+            expired = [n for n, deadline in pending.items() if deadline <= now]
+            for nickname in expired:
+                del pending[nickname]
+                self._mark(room, nickname)
+            if not pending:
+                del self.pending_leaves[room]
+        for room, nicknames in self.remote.expire(now):
+            self.dirty.setdefault(room, set()).update(nicknames)
+
+        self._flush()
+
+        # 다른 프로세스에 이 프로세스의 접속자 전체를 알림 (바뀐 방은 바로, 나머지는 sync_interval마다)
+        rooms = self.local_dirty
+        if now - self._synced >= self.sync_interval:
+            self._synced = now
+            rooms = rooms | set(self.connections) | set(self.pending_leaves)
+        for room in rooms:
+            self.publish(room, {"type": "presence_state", "origin": self.origin,
+                                "nicknames": sorted(self.local_nicknames(room))})
+        self.local_dirty = set()
+
+    def _mark(self, room: str, nickname: str):
+        self.dirty.setdefault(room, set()).add(nickname)
+        self.local_dirty.add(room)
+
+    def _flush(self):
+        # 마지막으로 알린 뒤 실제로 온라인 상태가 바뀐 닉네임만 방별 프레임 하나로 전송
+        # (한 주기 안에 들어왔다 나간 닉네임은 알리지 않음)
+        for room, nicknames in self.dirty.items():
+            online = set(self.roster(room))
+            announced = self.announced.setdefault(room, set())
+            joined = sorted(n for n in nicknames if n in online and n not in announced)
+            left = sorted(n for n in nicknames if n not in online and n in announced)
+            announced.update(joined)
+            announced.difference_update(left)
+            if not announced:
+                del self.announced[room]
+            if joined or left:
+                self.deliver(room, {"type": "presence", "room": room, "joined": joined, "left": left})
+        self.dirty.clear()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.tick(time.monotonic())
+            except Exception as e:
+                print(f"접속자 목록 갱신 에러: {e}")
@@ -0,0 +1,54 @@
+# 다른 서버 프로세스의 방별 닉네임 상태 (백플레인 동기화)
+# 각 프로세스는 자신의 방 상태 전체(닉네임 목록)를 주기적으로 백플레인에 알리고, 받는 쪽은 origin별로 보관
+# - 빈 목록을 받으면 해당 origin의 상태를 지움
+# - ttl초 안에 다시 알리지 않으면 비정상 종료된 프로세스로 보고 만료
+# presence(접속자)와 ephemeral(입력 중 표시)이 같은 방식으로 사용
+import time
+from typing import Optional
+
+# 백플레인 상태 메시지 형식: {"type": ..., "origin": 프로세스 ID, "nicknames": [...]}
+
+
+class RemoteState:
+    """방 -> 다른 프로세스 origin -> (닉네임 집합, 만료 시각)"""
+    def __init__(self, origin: str, ttl: float):
+        # origin: 이 프로세스의 백플레인 ID (자신이 보낸 상태는 무시)
+        self.origin = origin
+        self.ttl = ttl
+        self.rooms: dict[str, dict[str, tuple[frozenset, float]]] = {}
+
+    def apply(self, room: str, message: dict) -> Optional[tuple[frozenset, frozenset]]:
+        """상태 메시지 반영 후 (이전 집합, 새 집합) 반환 (잘못된 메시지나 자신이 보낸 메시지는 None)"""
+        origin = message.get("origin")
+        nicknames = message.get("nicknames")
+        if not origin or origin == self.origin or not isinstance(nicknames, list):
+            return None
+        new = frozenset(n for n in nicknames if isinstance(n, str))
+        peers = self.rooms.setdefault(room, {})
+        old, _ = peers.get(origin, (frozenset(), 0.0))
+        if new:
+            peers[origin] = (new, time.monotonic() + self.ttl)
+        else:
+            peers.pop(origin, None)
+        if not peers:
+            del self.rooms[room]
+        return old, new
+
+    def expire(self, now: float) -> list:
+        """만료된 상태를 지우고 (방, 만료된 닉네임 집합) 목록 반환"""
+        expired = []
+        for room, peers in list(self.rooms.items()):
+            for origin, (nicknames, expires_at) in list(peers.items()):
+                if expires_at <= now:
+                    del peers[origin]
+                    expired.append((room, nicknames))
+            if not peers:
+                del self.rooms[room]
+        return expired
+
+    def nicknames(self, room: str) -> set:
+        """방의 모든 다른 프로세스 닉네임 합집합"""
+        names = set()
+        for nicknames, _ in self.rooms.get(room, {}).values():
+            names |= nicknames
+        return names
@@ -0,0 +1,163 @@
+# 채팅 기록 전문 검색 (메모리 역색인)
+# 띄어쓰기 없이 쓰는 한국어도 부분 문자열로 찾을 수 있도록 단어(공백 기준) 안의 글자 1-gram과 2-gram을 색인
+# - 검색어의 n-gram을 모두 포함하는 메시지만 후보로 고르고, 실제로 검색어가 들어 있는지 확인한 뒤 순위 계산
+# - 순위: n-gram별 빈도 x 희소성(idf) 합, 점수가 같으면 최신 메시지 우선
+# - 방별로 색인하고, 오래된 메시지부터 지울 수 있도록 메시지는 들어온 순서대로 보관
+import math
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# 메시지 하나에서 색인하는 최대 글자 수 (긴 메시지가 색인 크기를 키우지 않도록)
+MAX_INDEXED_CHARS = 2000
+
+
+def normalize(text: str) -> str:
+    """검색용 정규화 (호환 문자 통합, 대소문자 무시)"""
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def ngrams(text: str) -> dict:
+    """정규화된 텍스트의 n-gram -> 등장 횟수 (단어 안의 1-gram과 2-gram)"""
+    counts: dict[str, int] = {}
+    for token in text.split():
+        for i, ch in enumerate(token):
+            counts[ch] = counts.get(ch, 0) + 1
+            if i + 1 < len(token):
+                gram = token[i:i + 2]
+                counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def query_grams(tokens: list) -> set:
+    """검색어의 n-gram (두 글자 이상인 단어는 2-gram만, 한 글자 단어는 1-gram)"""
+    grams = set()
+    for token in tokens:
+        if len(token) == 1:
+            grams.add(token)
+        else:
+            grams.update(token[i:i + 2] for i in range(len(token) - 1))
+    return grams
+
+
+class _RoomIndex:
+    __slots__ = ("docs", "postings")
+
+    def __init__(self):
+        # 메시지 ID -> (정규화된 텍스트, 메시지), 오래된 것부터
+        self.docs: "OrderedDict[str, tuple[str, dict]]" = OrderedDict()
+        # n-gram -> 메시지 ID -> 등장 횟수
+        self.postings: dict[str, dict[str, int]] = {}
+
+
+class SearchIndex:
+    """방별 메시지 역색인 (닉네임과 본문)"""
+    def __init__(self, max_docs_per_room: int = 10000, max_rooms: int = 100):
+        self.max_docs_per_room = max_docs_per_room
+        self.max_rooms = max_rooms
+        # 오래 쓰지 않은 방부터
+        self.rooms: "OrderedDict[str, _RoomIndex]" = OrderedDict()
+
+    def has_room(self, room: str) -> bool:
+        return room in self.rooms
+
+    def build(self, room: str, messages: list):
+        """방의 색인을 새로 만듦 (messages: 과거 -> 현재 순)"""
+        self.rooms[room] = _RoomIndex()
+        for message in messages:
+            self.add(room, message)
+
+    def add(self, room: str, message: dict):
+        """메시지 하나를 색인 (색인하지 않는 방이거나 이미 색인된 메시지는 무시)"""
+        index = self.rooms.get(room)
+        message_id = message.get("id")
+        if index is None or not message_id or message_id in index.docs:
+            return
+        self.rooms.move_to_end(room)
+        text = normalize(f"{message.get('nickname', '')} {message.get('content', '')}"[:MAX_INDEXED_CHARS])
+        index.docs[message_id] = (text, message)
+        for gram, count in ngrams(text).items():
+            index.postings.setdefault(gram, {})[message_id] = count
+        if len(index.docs) > self.max_docs_per_room:
+            self.trim(room, self.max_docs_per_room)
+
+    def trim(self, room: str, keep: int):
+        """가장 최근 keep개만 남기고 오래된 메시지를 색인에서 제거 (방별 색인 크기 상한)"""
+        index = self.rooms.get(room)
+        if index is None:
+            return
+        while len(index.docs) > max(keep, 0):
+            message_id, (text, _) = index.docs.popitem(last=False)
+            self._unindex(index, message_id, text)
+
+    def remove(self, room: str, ids: list):
+        """지정한 메시지를 색인에서 제거 (보존 개수 정리로 저장소에서 삭제된 메시지)"""
+        index = self.rooms.get(room)
+        if index is None:
+            return
+        for message_id in ids:
+            doc = index.docs.pop(message_id, None)
+            if doc is not None:
+                self._unindex(index, message_id, doc[0])
+
+    @staticmethod
+    def _unindex(index: _RoomIndex, message_id: str, text: str):
+        for gram in ngrams(text):
+            postings = index.postings.get(gram)
+            if postings is None:
+                continue
+            postings.pop(message_id, None)
+            if not postings:
+                del index.postings[gram]
+
+    def evict(self, in_use: Callable[[str], bool]):
+        """방 수가 max_rooms를 넘으면 in_use가 아닌 방의 색인을 오래 쓰지 않은 순서대로 제거 (다시 검색하면 새로 만듦)"""
+        excess = len(self.rooms) - self.max_rooms
+        for room in list(self.rooms):
+            if excess <= 0:
+                break
+            if not in_use(room):
+                del self.rooms[room]
+                excess -= 1
+
+    def size(self, room: Optional[str] = None) -> int:
+        if room is not None:
+            index = self.rooms.get(room)
+            return len(index.docs) if index else 0
+        return sum(len(index.docs) for index in self.rooms.values())
+
+    def search(self, room: str, query: str, offset: int = 0, limit: int = 20) -> tuple[int, list]:
+        """검색어의 모든 단어가 들어 있는 메시지를 순위대로 반환 ((전체 결과 수, 결과 목록))"""
+        index = self.rooms.get(room)
+        tokens = normalize(query).split()
+        if index is None or not tokens:
+            return 0, []
+        self.rooms.move_to_end(room)
+        grams = query_grams(tokens)
+        postings = [index.postings.get(gram) for gram in grams]
+        if not all(postings):
+            return 0, []
+
+        # 가장 짧은 목록부터 교집합
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for p in postings[1:]:
+            candidates.intersection_update(p)
+            if not candidates:
+                return 0, []
+
+        total_docs = len(index.docs)
+        idf = {gram: math.log(1 + total_docs / len(index.postings[gram])) for gram in grams}
+        scored = []
+        for message_id in candidates:
+            text, message = index.docs[message_id]
+            # n-gram이 흩어져 있는 경우를 걸러냄 (검색어 단어가 실제로 들어 있어야 함)
+            if not all(token in text for token in tokens):
+                continue
+            score = sum(index.postings[gram][message_id] * idf[gram] for gram in grams)
+            # 점수가 같으면 최신 메시지 우선 (시퀀스 번호, 없으면 시각)
+            scored.append((score, (message.get("seq") or 0, message.get("timestamp") or ""), message))
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        return len(scored), [
+            dict(message, score=round(score, 3)) for score, _, message in scored[offset:offset + limit]
+        ]
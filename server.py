@@ -1,58 +1,36 @@
 # ... imports
-import firebase_admin
-from firebase_admin import credentials, firestore
-from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect, BackgroundTasks, HTTPException
+from fastapi import FastAPI, Header, Query, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 import uvicorn
+import asyncio
 import json
-import urllib.parse
-from typing import Set, Optional
-
-# 1. Firebase 초기화 (보안 키 로드)
-# ... (Firebase init code remains same) ...
+import math
+import random
 import os
+import urllib.parse
+import bisect
+import re
+import time
+import itertools
+import hmac
+from collections import Counter, OrderedDict
+from typing import Awaitable, Callable, Set, Optional
+from backplane import Backplane, create_backplane
+from presence import PresenceTracker
+from ephemeral import EphemeralChannel
+from storage import MessageStore, create_store
+from archive import MessageArchive
+from search_index import SearchIndex
+from loopmon import LoopMonitor, log_json
+import metrics
 
-def init_firebase():
-    # ... (existing init_firebase code) ...
-    # 1. Render Secret Files에서 로드 시도 (우선순위 1)
-    firebase_key_path = os.getenv("FIREBASE_KEY_PATH", "/etc/secrets/firebase-key.json")
-    if os.path.exists(firebase_key_path):
-        cred = credentials.Certificate(firebase_key_path)
-        firebase_admin.initialize_app(cred)
-        print(f"Firebase 초기화 완료 (Secret Files에서 로드: {firebase_key_path})")
-        return
-    
-    # 2. 환경 변수에서 JSON 문자열로 로드 시도 (우선순위 2)
-    firebase_key_json = os.getenv("FIREBASE_KEY_JSON")
-    if firebase_key_json:
-        try:
-            key_dict = json.loads(firebase_key_json)
-            cred = credentials.Certificate(key_dict)
-            firebase_admin.initialize_app(cred)
-            print("Firebase 초기화 완료 (환경 변수에서 로드)")
-            return
-        except json.JSONDecodeError as e:
-            print(f"환경 변수 FIREBASE_KEY_JSON 파싱 실패: {e}")
-            raise
-    
-    # 3. 로컬 개발 환경: 파일에서 로드 (우선순위 3)
-    if os.path.exists("secureKey.json"):
-        cred = credentials.Certificate("secureKey.json")
-        firebase_admin.initialize_app(cred)
-        print("Firebase 초기화 완료 (로컬 파일에서 로드)")
-        return
-    
-    # 모든 방법 실패
-    raise FileNotFoundError(
-        "Firebase 키를 찾을 수 없습니다. 다음 중 하나를 설정하세요:\n"
-        "1. Render Secret Files: /etc/secrets/firebase-key.json\n"
-        "2. 환경 변수: FIREBASE_KEY_JSON (JSON 문자열)\n"
-        "3. 로컬 파일: secureKey.json"
-    )
-
-init_firebase()
-db = firestore.client()
+try:
+    import msgpack
+except ImportError:  # msgpack이 없으면 JSON 코덱만 제공
+    msgpack = None
 
 # --- 화이트리스트 설정 ---
 # 환경 변수 CHAT_WHITELIST가 설정되어 있으면 해당 닉네임만 허용
@@ -66,133 +44,1316 @@ def is_nickname_allowed(nickname: str) -> bool:
         return True # 화이트리스트 설정이 없으면 모두 허용
     return nickname in CHAT_WHITELIST
 
+# --- 채팅방(room) 설정 ---
+# 클라이언트는 접속 시 x-room 헤더 또는 room 쿼리 파라미터로 방을 선택 (없으면 기본 방)
+# Firestore 저장소에서 기본 방은 기존 "messages" 컬렉션을 그대로 사용하고, 다른 방은 rooms/{방 이름}/messages 서브컬렉션에 저장
+DEFAULT_ROOM = os.getenv("DEFAULT_ROOM", "main")
+ROOM_NAME_PATTERN = re.compile(r"^[\w-]{1,32}$")
+
+def resolve_room(room: Optional[str]) -> Optional[str]:
+    """방 이름 확인 (비어 있으면 기본 방, 형식이 잘못되면 None)"""
+    if not room:
+        return DEFAULT_ROOM
+    return room if ROOM_NAME_PATTERN.match(room) else None
+
+# 1. 메시지 저장소 선택
+# CHAT_STORE: firestore (기본값, Firebase 키 필요) / sqlite (로컬 파일, WAL 모드) / memory (프로세스 메모리)
+# sqlite는 CHAT_SQLITE_PATH 경로의 파일을 사용 (여러 워커가 같은 파일을 공유할 수 있음)
+# 저장소 생성(Firebase 초기화 등)은 무거우므로 import 시점이 아니라 서버가 요청을 받기 시작한 뒤 백그라운드에서 수행
+# (init_storage 참고, 준비되기 전의 요청은 거부하지 않고 store_ready를 기다림)
+CHAT_STORE = os.getenv("CHAT_STORE", "firestore")
+CHAT_SQLITE_PATH = os.getenv("CHAT_SQLITE_PATH", "chat.db")
+STORE_INIT_RETRY_MAX = 30.0  # 저장소 초기화 실패 시 최대 재시도 간격 (초)
+STORE_WAIT_TIMEOUT = float(os.getenv("STORE_WAIT_TIMEOUT", "30"))  # HTTP 요청이 저장소 준비를 기다리는 최대 시간 (초)
+store: Optional[MessageStore] = None
+store_ready = asyncio.Event()
+
+# 시작 시간 측정 기준 (이 모듈이 로드된 시각)
+STARTED_AT = time.monotonic()
+
+# --- 메트릭 ---
+# /metrics에서 Prometheus 텍스트 형식으로 노출 (연결 수 등 현재 값은 아래 ConnectionManager 이후에 등록)
+MESSAGES_TOTAL = metrics.counter("chat_messages_total", "수락된 채팅 메시지 수")
+MESSAGE_RATE = metrics.RateMeter(window=10)
+metrics.gauge("chat_messages_per_second", "최근 10초 평균 초당 메시지 수", callback=MESSAGE_RATE.rate)
+BROADCAST_SECONDS = metrics.histogram("chat_broadcast_seconds", "브로드캐스트 1회의 인코딩 및 송신 큐 삽입 시간")
+SEND_DELAY_SECONDS = metrics.histogram("chat_send_delay_seconds", "송신 큐에 들어간 뒤 소켓에 쓰기까지 걸린 시간")
+SEND_DROPPED_TOTAL = metrics.counter("chat_send_queue_dropped_total", "송신 큐 초과로 버려진 메시지 수", ("policy",))
+STORE_SECONDS = metrics.histogram("chat_store_seconds", "메시지 저장소 작업 지연 시간", ("op",))
+STORE_ERRORS_TOTAL = metrics.counter("chat_store_errors_total", "메시지 저장소 작업 실패 수", ("op",))
+RETENTION_SECONDS = metrics.histogram("chat_retention_trim_seconds", "오래된 메시지 정리 1회 소요 시간")
+THROTTLED_TOTAL = metrics.counter("chat_throttled_total", "전송 속도 제한으로 거부된 메시지 수", ("scope",))
+OVERSIZED_TOTAL = metrics.counter("chat_oversized_messages_total", "최대 길이를 넘어 거부된 메시지 수")
+SEARCH_SECONDS = metrics.histogram("chat_search_seconds", "검색 1회 소요 시간 (색인 조회와 순위 계산)")
+TYPING_EVENTS_TOTAL = metrics.counter("chat_typing_events_total", "클라이언트에서 받은 입력 중 이벤트 수")
+PERSIST_DROPPED_TOTAL = metrics.counter("chat_persist_dropped_total", "종료 시까지 저장하지 못하고 버린 메시지 수")
+ARCHIVED_MESSAGES_TOTAL = metrics.counter("chat_archived_messages_total", "보존 개수 정리로 보관소에 옮긴 메시지 수")
+DUPLICATE_MESSAGES_TOTAL = metrics.counter("chat_duplicate_messages_total", "멱등성 키가 같아 다시 게시하지 않은 재전송 메시지 수")
+HEARTBEAT_EVICTED_TOTAL = metrics.counter("chat_heartbeat_evicted_total", "하트비트 시간 초과로 정리된 연결 수")
+HEARTBEAT_RTT_SECONDS = metrics.histogram("chat_heartbeat_rtt_seconds", "서버 ping에 대한 클라이언트 pong 왕복 시간")
+STARTUP_SECONDS = metrics.gauge("chat_startup_seconds", "서버 모듈 로드부터 각 시작 단계까지 걸린 시간", ("phase",))
+LOOP_LAG_SECONDS = metrics.histogram("chat_loop_lag_seconds", "이벤트 루프 지연 (예정보다 늦게 깨어난 시간)")
+WS_PHASE_SECONDS = metrics.histogram("chat_ws_phase_seconds", "메시지 처리 단계별 소요 시간 (parse/validate는 WebSocket만)", ("phase",))
+
+# --- 이벤트 루프 모니터 (선택 기능) ---
+# CHAT_LOOPMON=1이면 루프 지연/멈춤과 WebSocket 메시지 처리 단계(parse, validate, broadcast, enqueue)별 시간을 측정
+# 멈춤/느린 단계는 JSON 한 줄 로그로 출력하고 /admin/loop에서 조회 (loopmon.py 참고)
+# 관리자 엔드포인트는 CHAT_ADMIN_TOKEN을 설정하고 x-admin-token 헤더가 일치해야 응답 (설정하지 않으면 404)
+LOOPMON_ENABLED = os.getenv("CHAT_LOOPMON", "0") == "1"
+LOOPMON_INTERVAL = float(os.getenv("CHAT_LOOPMON_INTERVAL", "0.5"))  # 지연 측정 간격 (초)
+LOOPMON_THRESHOLD = float(os.getenv("CHAT_LOOPMON_THRESHOLD", "0.1"))  # 멈춤/느린 단계로 기록하는 기준 (초)
+ADMIN_TOKEN = os.getenv("CHAT_ADMIN_TOKEN")
+
+loop_monitor = LoopMonitor(
+    LOOPMON_ENABLED, LOOPMON_INTERVAL, LOOPMON_THRESHOLD,
+    on_lag=LOOP_LAG_SECONDS.observe,
+    on_phase=lambda name, elapsed: WS_PHASE_SECONDS.observe(elapsed, phase=name),
+)
+
+# 준비 상태 (저장소 워밍업이 끝나면 True, 종료가 시작되면 False) - /healthz에서 사용
+app_ready = False
+_startup_phases: Set[str] = set()
+
+
+def mark_startup(phase: str):
+    """시작 단계(listening, storage_ready, first_connection)까지 걸린 시간을 한 번만 기록"""
+    if phase in _startup_phases:
+        return
+    _startup_phases.add(phase)
+    elapsed = time.monotonic() - STARTED_AT
+    STARTUP_SECONDS.set(elapsed, phase=phase)
+    print(f"시작 단계 완료: {phase} ({elapsed:.3f}초)")
+
+
+async def init_storage():
+    """저장소를 만들고 워밍업 쿼리를 보낸 뒤 백그라운드 저장/정리 작업 시작 (실패하면 간격을 늘려 재시도)"""
+    global store, app_ready
+    delay = 1.0
+    while store is None:
+        try:
+            with STORE_SECONDS.time(op="init"):
+                store = await asyncio.to_thread(create_store, CHAT_STORE, DEFAULT_ROOM, CHAT_SQLITE_PATH)
+        except Exception as e:
+            STORE_ERRORS_TOTAL.inc(op="init")
+            print(f"저장소 초기화 실패, {delay:.0f}초 후 재시도: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STORE_INIT_RETRY_MAX)
+    # 이제부터 기다리던 요청이 처리됨 (최근 메시지 로드는 아래 워밍업과 공유)
+    store_ready.set()
+    persister.start()
+    # 워밍업 쿼리: 기본 방의 최근 메시지와 메시지 수를 읽어 두어 첫 요청이 연결 수립 비용을 치르지 않도록 함
+    await history.get(DEFAULT_ROOM)
+    await ensure_search_index(DEFAULT_ROOM)
+    await asyncio.to_thread(retention.load)
+    retention.start()
+    app_ready = True
+    mark_startup("storage_ready")
+
+
 # 2. FastAPI 앱 생성
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 시작: 저장소 준비를 기다리지 않고 바로 요청을 받기 시작 (저장소 초기화/워밍업은 백그라운드 작업)
+    # 종료: 대기 중인 메시지를 모두 저장한 뒤 종료
+    await manager.backplane.start(on_remote_message)
+    manager.start_heartbeat()
+    manager.presence.start()
+    manager.typing.start()
+    loop_monitor.start()
+    storage_task = asyncio.create_task(init_storage())
+    mark_startup("listening")
+    yield
+    # ChatServer로 실행하지 않은 경우 (uvicorn server:app, 멀티 워커) 여기서 연결 정리
+    # (이때는 uvicorn이 이미 모든 연결을 1012로 끊었으므로 남은 연결만 정리됨)
+    await drain_connections()
+    storage_task.cancel()
+    manager.stop_heartbeat()
+    manager.presence.stop()
+    manager.typing.stop()
+    loop_monitor.stop()
+    await persister.stop()
+    await retention.stop()
+    if store is not None:
+        await asyncio.to_thread(store.close)
+    if archive is not None:
+        archive.close()
+    await manager.backplane.close()
+
+app = FastAPI(lifespan=lifespan)
+
+# --- 오래된 메시지 정리 (보존 개수 관리) ---
+# 메시지 수는 로컬에서 추적하고, 주기적으로 또는 상한(high-water mark)을 넘었을 때 한꺼번에 정리
+# (메시지마다 count() 집계 쿼리를 보내지 않음)
+RETENTION_KEEP = int(os.getenv("RETENTION_KEEP", "50"))  # 정리 후 남길 메시지 수
+RETENTION_HIGH_WATER = int(os.getenv("RETENTION_HIGH_WATER", "100"))  # 이 수를 넘으면 즉시 정리
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", "300"))  # 주기적 정리 간격 (초)
+RETENTION_STOP_TIMEOUT = 10.0  # 종료 시 진행 중인 정리를 기다리는 최대 시간 (초)
+# 정리된 메시지를 삭제하지 않고 옮겨 둘 로컬 보관소 디렉터리 (비어 있으면 보관하지 않고 삭제)
+# 보관된 메시지는 /history로 페이지 단위 조회 가능 (archive.py 참고)
+ARCHIVE_DIR = os.getenv("CHAT_ARCHIVE_DIR", "archive")
+
+archive: Optional[MessageArchive] = MessageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+
+
+class RetentionScheduler:
+    """저장된 메시지 수를 추적하며 보존 개수를 넘는 오래된 메시지를 배치로 삭제"""
+    def __init__(self, keep: int = RETENTION_KEEP, high_water: int = RETENTION_HIGH_WATER,
+                 interval: float = RETENTION_INTERVAL):
+        self.keep = keep
+        self.high_water = max(high_water, keep)
+        self.interval = interval
+        # 방별 저장 완료된 메시지 수 (방마다 한 번 집계한 뒤 로컬에서 갱신, None이면 아직 집계 전)
+        self.counts: dict[str, Optional[int]] = {}
+        self._wakeup = asyncio.Event()
+        # 정리 작업 중이 아니면 set (종료 시 진행 중인 정리를 기다리는 데 사용)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.task: Optional[asyncio.Task] = None
+
+    def load(self):
+        """시작 시 기본 방의 문서 개수를 한 번만 집계"""
+        try:
+            self.counts[DEFAULT_ROOM] = store.count(DEFAULT_ROOM)
+        except Exception as e:
+            print(f"메시지 개수 집계 실패: {e}")
+
+    def note_added(self, room: str, n: int = 1):
+        """새로 저장된 메시지 수 반영 (상한을 넘으면 정리 작업을 깨움)"""
+        count = self.counts.get(room)
+        if count is None:
+            # 처음 보는 방: 정리 작업에서 한 번 집계 (방금 저장된 문서도 집계에 포함됨)
+            self.counts[room] = None
+            self._wakeup.set()
+            return
+        self.counts[room] = count + n
+        if self.counts[room] > self.high_water:
+            self._wakeup.set()
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = RETENTION_STOP_TIMEOUT):
+        """진행 중인 정리가 있으면 (삭제가 중간에 끊기지 않도록) 끝날 때까지 기다린 뒤 중지"""
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print("종료: 진행 중인 메시지 정리를 기다리지 못했습니다")
+        self.task.cancel()
+        self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.trim()
+
+    async def trim(self):
+        self._idle.clear()
+        try:
+            await self._trim()
+        finally:
+            self._idle.set()
+
+    async def _trim(self):
+        with RETENTION_SECONDS.time():
+            for room in list(self.counts):
+                op = "count"
+                try:
+                    if self.counts[room] is None:
+                        with STORE_SECONDS.time(op=op):
+                            self.counts[room] = await asyncio.to_thread(store.count, room)
+                    excess = self.counts[room] - self.keep
+                    if excess <= 0:
+                        continue
+                    op = "archive" if archive is not None else "delete"
+                    with STORE_SECONDS.time(op=op):
+                        if archive is not None:
+                            deleted = await asyncio.to_thread(self._archive_oldest, room, excess)
+                        else:
+                            deleted = await asyncio.to_thread(self._delete_oldest, room, excess)
+                except Exception as e:
+                    STORE_ERRORS_TOTAL.inc(op=op)
+                    print(f"백그라운드 메시지 정리 중 에러 발생 ({room}): {e}")
+                    continue
+                self.counts[room] -= len(deleted)
+                # 실제로 삭제된 메시지만 검색 색인에서 제거 (보관소로 옮긴 메시지는 계속 검색되고, 색인 크기는 SEARCH_INDEX_SIZE로 제한)
+                # 색인에는 아직 저장 대기 중인 최신 메시지도 있으므로 개수로 자르지 않음
+                if archive is None:
+                    search_index.remove(room, deleted)
+
+    @staticmethod
+    def _delete_oldest(room: str, num_to_delete: int) -> list:
+        print(f"메시지 정리 ({room}): {num_to_delete}개의 오래된 메시지를 삭제합니다.")
+        deleted = store.delete_oldest(room, num_to_delete)
+        print(f"메시지 정리 완료 ({len(deleted)}개 삭제).")
+        return deleted
+
+    @staticmethod
+    def _archive_oldest(room: str, num_to_archive: int) -> list:
+        # 보관소에 먼저 쓰고 저장소에서 삭제 (중간에 종료되면 다음 정리에서 다시 처리, 보관소가 중복을 걸러냄)
+        # append는 늦게 저장된 메시지도 보관하므로 반환 후에는 읽은 메시지가 모두 보관소에 있음
+        records = store.oldest(room, num_to_archive)
+        archived = archive.append(room, [record_to_message(r) for r in records])
+        deleted = [r["id"] for r in records]
+        store.delete(room, deleted)
+        ARCHIVED_MESSAGES_TOTAL.inc(archived)
+        print(f"메시지 정리 완료 ({room}): {len(deleted)}개를 보관소로 이동 (새로 보관 {archived}개).")
+        return deleted
+
+
+retention = RetentionScheduler()
+
+
+# --- 쓰기 지연(write-behind) 저장 ---
+# 메시지는 즉시 브로드캐스트하고, 저장은 백그라운드 작업이 배치로 모아서 커밋
+# (동기 저장소 호출이 이벤트 루프를 막지 않도록 별도 스레드에서 실행)
+PERSIST_BATCH_SIZE = min(int(os.getenv("PERSIST_BATCH_SIZE", "100")), 500)  # Firestore 배치 한도: 500
+PERSIST_BATCH_WINDOW = float(os.getenv("PERSIST_BATCH_WINDOW", "0.2"))  # 배치를 모으는 최대 시간 (초)
+PERSIST_RETRY_BASE = float(os.getenv("PERSIST_RETRY_BASE", "0.5"))  # 재시도 대기 시간 (초, 지수 증가)
+PERSIST_RETRY_MAX = float(os.getenv("PERSIST_RETRY_MAX", "30"))  # 재시도 대기 시간 상한 (초)
+PERSIST_FLUSH_TIMEOUT = float(os.getenv("PERSIST_FLUSH_TIMEOUT", "10"))  # 종료 시 남은 메시지 저장 대기 시간 (초)
+
+
+class WriteBehindQueue:
+    """저장 대기 메시지를 모아 저장소에 한 번에 기록하는 백그라운드 작업"""
+    def __init__(self, batch_size: int = PERSIST_BATCH_SIZE, batch_window: float = PERSIST_BATCH_WINDOW,
+                 retry_base: float = PERSIST_RETRY_BASE, retry_max: float = PERSIST_RETRY_MAX):
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # 저장 중인 배치 (종료 시 저장하지 못한 수를 셀 때 사용)
+        self.inflight: list = []
+        # 방별 아직 저장되지 않은 메시지 수 (저장 전에는 방의 최근 메시지 캐시를 메모리에서 내리지 않음)
+        self.pending: Counter = Counter()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def put(self, room: str, message_id: str, data: dict):
+        """저장할 메시지를 대기열에 추가 (즉시 반환)"""
+        self.pending[room] += 1
+        self.queue.put_nowait((room, message_id, data))
+
+    async def stop(self, timeout: float = PERSIST_FLUSH_TIMEOUT):
+        """대기 중인 문서를 모두 저장한 뒤 작업 종료"""
+        if self.task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            # 이미 수락(ack)된 메시지를 잃는 유일한 경우: 저장소 장애가 종료 시점까지 이어짐
+            dropped = self.queue.qsize() + len(self.inflight)
+            PERSIST_DROPPED_TOTAL.inc(dropped)
+            log_json({"event": "persist_dropped", "level": "error", "messages": dropped,
+                      "reason": "shutdown_timeout"})
+        self.task.cancel()
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 첫 문서가 들어오면 배치 크기 또는 시간 창이 찰 때까지 모음
+            items = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(items) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            self.inflight = items
+            await self._commit(items)
+            self.inflight = []
+            for _ in items:
+                self.queue.task_done()
+
+    async def _commit(self, items: list):
+        # 이미 브로드캐스트/ack한 메시지이므로 포기하지 않고 저장될 때까지 재시도 (대기 시간은 retry_max까지 증가)
+        # 그동안 새 메시지는 대기열에 쌓이고, 저장소가 복구되면 순서대로 저장됨
+        attempt = 0
+        while True:
+            try:
+                with STORE_SECONDS.time(op="write"):
+                    await asyncio.to_thread(store.add_many, items)
+                for room, n in Counter(room for room, _, _ in items).items():
+                    retention.note_added(room, n)
+                    self.pending[room] -= n
+                    if self.pending[room] <= 0:
+                        del self.pending[room]
+                return
+            except Exception as e:
+                STORE_ERRORS_TOTAL.inc(op="write")
+                delay = min(self.retry_base * (2 ** attempt), self.retry_max)
+                attempt = min(attempt + 1, 16)
+                print(f"메시지 저장 실패 ({len(items)}개, 대기 {self.queue.qsize()}개), {delay:.1f}초 후 재시도: {e}")
+                await asyncio.sleep(delay)
+
+
+persister = WriteBehindQueue()
+
+
+# --- 최근 메시지 캐시 (링 버퍼) ---
+# 시작 시 저장소에서 한 번만 로드하고, 이후에는 새 메시지마다 갱신
+# /messages 조회는 저장소 쿼리 없이 메모리에서 처리 (timestamp 기준 이진 탐색)
+HISTORY_SIZE = int(os.getenv("HISTORY_SIZE", "50"))
+HISTORY_PAGE_SIZE = 30  # /messages 한 번에 반환하는 최대 메시지 수 (/history 기본값)
+HISTORY_MAX_PAGE_SIZE = 100  # /history 한 번에 반환하는 최대 메시지 수
+CATCHUP_LIMIT = int(os.getenv("CATCHUP_LIMIT", "100"))  # 재연결 시 한 번에 보내는 누락 메시지 최대 수
+# 메모리에 유지하는 최대 방 수 (최근 메시지 캐시와 검색 색인 각각)
+# 넘으면 사용 중이 아닌 방(기본 방이 아니고, 접속자도 저장 대기 메시지도 없는 방)을 오래 쓰지 않은 순서대로 내림
+# (임의의 방 이름으로 조회를 반복해도 메모리가 계속 늘지 않도록, 내린 방은 다시 사용할 때 저장소에서 로드)
+HISTORY_MAX_ROOMS = int(os.getenv("HISTORY_MAX_ROOMS", "100"))
+
+
+def room_in_use(room: str) -> bool:
+    """메모리에서 내리면 안 되는 방인지 확인"""
+    return room == DEFAULT_ROOM or bool(manager.rooms.get(room)) or persister.pending.get(room, 0) > 0
 
-# --- 백그라운드 작업 ---
-def cleanup_old_messages():
-    # ... (existing cleanup_old_messages code) ...
+
+def record_to_message(record: dict) -> dict:
+    """저장소 레코드를 응답용 메시지 딕셔너리로 변환"""
+    data = dict(record)
+    data['type'] = "user"
+    # datetime 객체를 ISO 형식 문자열로 변환
+    if isinstance(data.get('timestamp'), datetime):
+        data['timestamp'] = data['timestamp'].isoformat()
+    else:
+        data['timestamp'] = str(data.get('timestamp', ''))
+    return data
+
+
+def parse_timestamp(value: str) -> datetime:
+    """ISO 형식 문자열을 datetime으로 변환 (타임존 정보가 없으면 UTC로 간주)"""
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+class MessageRing:
+    """최근 메시지를 시간순으로 보관하는 고정 크기 링 버퍼 (방의 시퀀스 번호도 관리)"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        # (정렬 키 timestamp, 정렬 키 seq, 메시지) 튜플을 보관
+        self._items: list = [None] * capacity
+        self._start = 0
+        self._len = 0
+        # 이 방에서 지금까지 본 가장 큰 시퀀스 번호
+        self.last_seq = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError(index)
+        return self._items[(self._start + index) % self.capacity]
+
+    def next_seq(self) -> int:
+        """새 메시지에 부여할 시퀀스 번호 (방마다 단조 증가)"""
+        self.last_seq += 1
+        return self.last_seq
+
+    def append(self, timestamp: datetime, message: dict):
+        seq = message.get("seq") or 0
+        # 다른 서버 프로세스의 메시지도 반영하여 이후 번호가 항상 더 크도록 유지
+        self.last_seq = max(self.last_seq, seq)
+        # 워커가 여러 개면 번호가 더 작은 메시지가 늦게 도착할 수 있음: 시퀀스 순서 위치에 끼워 넣음
+        if seq and self._len and seq < self[-1][1]:
+            self._insert(timestamp, seq, message)
+            return
+        # 시계가 뒤로 가거나 원격 메시지가 늦게 도착해도 이진 탐색이 가능하도록 정렬 키는 단조 증가하게 유지
+        if self._len:
+            last_timestamp, last_seq, _ = self[-1]
+            timestamp = max(timestamp, last_timestamp)
+            seq = max(seq, last_seq)
+        if self._len < self.capacity:
+            self._items[(self._start + self._len) % self.capacity] = (timestamp, seq, message)
+            self._len += 1
+        else:
+            # 가득 차면 가장 오래된 메시지 위치를 덮어씀
+            self._items[self._start] = (timestamp, seq, message)
+            self._start = (self._start + 1) % self.capacity
+
+    def _insert(self, timestamp: datetime, seq: int, message: dict):
+        items = [self[i] for i in range(self._len)]
+        index = bisect.bisect_right(items, seq, key=lambda item: item[1])
+        if index == 0 and self._len == self.capacity:
+            # 버퍼에 남은 어떤 메시지보다 오래된 메시지 (저장소에서 조회됨)
+            return
+        # 정렬 키는 앞뒤 메시지 사이 값으로 맞춤 (timestamp 이진 탐색 유지)
+        if index > 0:
+            timestamp = max(timestamp, items[index - 1][0])
+        timestamp = min(timestamp, items[index][0])
+        items.insert(index, (timestamp, seq, message))
+        if len(items) > self.capacity:
+            items.pop(0)
+        self._items = items + [None] * (self.capacity - len(items))
+        self._start = 0
+        self._len = len(items)
+
+    def latest(self, limit: int) -> list:
+        """가장 최근 메시지 limit개 (과거 -> 현재 순)"""
+        return [self[i][2] for i in range(max(0, self._len - limit), self._len)]
+
+    def before(self, timestamp: datetime, limit: int) -> list:
+        """timestamp 이전의 메시지 중 가장 최근 것 최대 limit개 (과거 -> 현재 순)"""
+        end = bisect.bisect_left(self, timestamp, key=lambda item: item[0])
+        return [self[i][2] for i in range(max(0, end - limit), end)]
+
+    def oldest_timestamp(self) -> Optional[datetime]:
+        return self[0][0] if self._len else None
+
+    def after(self, timestamp: datetime, limit: int) -> list:
+        """timestamp 이후의 메시지 최대 limit개 (과거 -> 현재 순)"""
+        start = bisect.bisect_right(self, timestamp, key=lambda item: item[0])
+        return [self[i][2] for i in range(start, min(start + limit, self._len))]
+
+    def after_seq(self, seq: int, limit: int) -> list:
+        """시퀀스 번호 seq 이후의 메시지 최대 limit개 (과거 -> 현재 순)"""
+        start = self._seq_index(seq)
+        return [self[i][2] for i in range(start, min(start + limit, self._len))]
+
+    def _seq_index(self, seq: int) -> int:
+        # seq 0은 "처음부터"를 뜻함 (시퀀스 번호가 없는 기존 메시지도 포함)
+        if seq <= 0:
+            return 0
+        return bisect.bisect_right(self, seq, key=lambda item: item[1])
+
+    def catchup(self, last_seq: int, limit: int = CATCHUP_LIMIT) -> dict:
+        """클라이언트가 마지막으로 받은 시퀀스 이후의 누락 메시지를 한 프레임으로 구성"""
+        start = self._seq_index(last_seq)
+        # 누락분이 limit보다 많으면 가장 최근 limit개만 전송
+        start = max(start, self._len - limit)
+        messages = [self[i][2] for i in range(start, self._len)]
+        # 버퍼에 남아 있지 않은 메시지가 있으면 truncated로 표시 (클라이언트는 일부 누락을 알 수 있음)
+        first_seq = self[start][1] if start < self._len else self.last_seq + 1
+        return {
+            "type": "catchup",
+            "messages": messages,
+            "last_seq": self.last_seq,
+            "truncated": first_seq > last_seq + 1,
+        }
+
+
+class HistoryCache:
+    """방별 최근 메시지 링 버퍼 (방을 처음 사용할 때 저장소에서 한 번만 로드)"""
+    def __init__(self, capacity: int, max_rooms: int = HISTORY_MAX_ROOMS):
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        # 오래 쓰지 않은 방부터
+        self.rings: OrderedDict[str, MessageRing] = OrderedDict()
+        self._loading: dict[str, asyncio.Task] = {}
+        # 메모리에서 내린 방의 마지막 시퀀스 번호 (다시 로드할 때 번호가 되돌아가지 않도록, 메시지가 있던 방만)
+        self.evicted_seqs: dict[str, int] = {}
+
+    async def get(self, room: str) -> MessageRing:
+        ring = self.rings.get(room)
+        if ring is not None:
+            self.rings.move_to_end(room)
+            return ring
+        # 시작 직후 저장소가 아직 준비되지 않았으면 준비될 때까지 대기 (요청을 거부하지 않음)
+        await store_ready.wait()
+        # 같은 방을 동시에 여러 번 로드하지 않도록 로드 작업을 공유
+        task = self._loading.get(room)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._load, room))
+            self._loading[room] = task
+        started = time.perf_counter()
+        try:
+            ring = await asyncio.shield(task)
+            STORE_SECONDS.observe(time.perf_counter() - started, op="read")
+        except Exception as e:
+            # 로드에 실패하면 빈 버퍼로 시작 (이후 새 메시지부터 채워짐)
+            if self._loading.get(room) is task:
+                STORE_ERRORS_TOTAL.inc(op="read")
+                print(f"최근 메시지 로드 실패 ({room}): {e}")
+            ring = MessageRing(self.capacity)
+        if self._loading.get(room) is task:
+            del self._loading[room]
+        if room not in self.rings:
+            ring.last_seq = max(ring.last_seq, self.evicted_seqs.pop(room, 0))
+            self.rings[room] = ring
+            self.evict()
+        return self.rings[room]
+
+    def append(self, room: str, timestamp: datetime, message: dict):
+        # 아직 로드되지 않은 방은 처음 사용할 때 저장소에서 읽으므로 무시
+        ring = self.rings.get(room)
+        if ring is not None:
+            ring.append(timestamp, message)
+            self.rings.move_to_end(room)
+
+    def evict(self):
+        """방 수가 max_rooms를 넘으면 사용 중이 아닌 방을 오래 쓰지 않은 순서대로 내림"""
+        excess = len(self.rings) - self.max_rooms
+        for room in list(self.rings):
+            if excess <= 0:
+                break
+            if room_in_use(room):
+                continue
+            ring = self.rings.pop(room)
+            if ring.last_seq:
+                self.evicted_seqs[room] = ring.last_seq
+            excess -= 1
+
+    def _load(self, room: str) -> MessageRing:
+        ring = MessageRing(self.capacity)
+        for record in store.recent(room, self.capacity):
+            ring.append(record["timestamp"], record_to_message(record))
+        print(f"최근 메시지 {len(ring)}개 로드 완료 ({room})")
+        return ring
+
+
+history = HistoryCache(HISTORY_SIZE)
+
+
+# --- 전문 검색 (메모리 역색인) ---
+# 방마다 시작 워밍업 또는 첫 검색 때 최근 SEARCH_INDEX_SIZE개(저장소, 모자라면 보관소)와 최근 메시지 캐시로 한 번만 색인하고,
+# 이후에는 수락된 메시지를 바로 색인 (검색할 때 저장소를 조회하지 않음)
+# 보존 개수 정리로 삭제된 메시지는 색인에서도 제거 (보관소로 옮긴 메시지는 SEARCH_INDEX_SIZE 안에서 계속 검색됨)
+SEARCH_INDEX_SIZE = int(os.getenv("SEARCH_INDEX_SIZE", "10000"))  # 방별 최대 색인 메시지 수
+SEARCH_PAGE_SIZE = 20  # /search 기본 결과 수
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_MAX_QUERY_LENGTH = 100
+
+search_index = SearchIndex(SEARCH_INDEX_SIZE, HISTORY_MAX_ROOMS)
+_search_loading: dict[str, asyncio.Task] = {}
+
+
+async def ensure_search_index(room: str):
+    """방의 검색 색인 준비 (같은 방을 동시에 여러 번 색인하지 않도록 작업을 공유)"""
+    if search_index.has_room(room):
+        return
+    await store_ready.wait()
+    task = _search_loading.get(room)
+    if task is None:
+        task = _search_loading[room] = asyncio.ensure_future(_build_search_index(room))
     try:
-        messages_ref = db.collection("messages")
-        
-        # 1. 문서 개수를 효율적으로 확인 (Aggregation Query 사용)
-        # 전체 문서를 읽지 않고 개수만 가져옵니다 (비용 절감)
-        count_query = messages_ref.count()
-        count_snapshot = count_query.get()
-        docs_count = count_snapshot[0][0].value
-
-        if docs_count > 50:
-            # 삭제할 문서 수 계산
-            num_to_delete = docs_count - 50
-            
-            # 삭제할 문서만 가져옴 (오래된 순)
-            docs_to_delete = messages_ref.order_by("timestamp", direction=firestore.Query.ASCENDING).limit(num_to_delete).get()
-            
-            print(f"메시지 정리: {len(docs_to_delete)}개의 오래된 메시지를 삭제합니다.")
+        await asyncio.shield(task)
+    finally:
+        if task.done() and _search_loading.get(room) is task:
+            del _search_loading[room]
 
-            # 배치(batch) 삭제
-            batch = db.batch()
-            for doc in docs_to_delete:
-                batch.delete(doc.reference)
-            batch.commit()
-            print("메시지 정리 완료.")
 
+async def _build_search_index(room: str):
+    op = "read"
+    try:
+        with STORE_SECONDS.time(op=op):
+            messages = [record_to_message(r) for r in await asyncio.to_thread(store.recent, room, SEARCH_INDEX_SIZE)]
+        if archive is not None and len(messages) < SEARCH_INDEX_SIZE:
+            # 저장소에 남은 것보다 오래된 메시지는 보관소에서 채움
+            op = "archive_read"
+            with STORE_SECONDS.time(op=op):
+                messages[:0] = await asyncio.to_thread(
+                    archive.before, room, None, SEARCH_INDEX_SIZE - len(messages)
+                )
     except Exception as e:
-        print(f"백그라운드 메시지 정리 중 에러 발생: {e}")
+        # 읽기에 실패하면 읽은 메시지, 최근 메시지 캐시와 이후 새 메시지만 색인
+        STORE_ERRORS_TOTAL.inc(op=op)
+        print(f"검색 색인용 메시지 로드 실패 ({room}): {e}")
+        if op == "read":
+            messages = []
+    # 보관소 + 저장소 기록 + 아직 저장되지 않았을 수 있는 최근 메시지 (중복은 ID로 걸러짐)
+    ring = await history.get(room)
+    search_index.build(room, messages + ring.latest(len(ring)))
+    print(f"검색 색인 완료 ({room}): 메시지 {search_index.size(room)}개")
+    search_index.evict(room_in_use)
 
 
 # 3. WebSocket 연결 관리
+# --- 송신 큐 설정 ---
+# 연결마다 전용 송신 큐와 송신 태스크를 두어 느린 클라이언트가 다른 클라이언트의 전송을 막지 않도록 함
+# SEND_QUEUE_POLICY: 큐가 가득 찼을 때의 처리 방식
+#   drop_oldest - 가장 오래된 대기 메시지를 버리고 새 메시지를 넣음 (기본값)
+#   drop_client - 해당 클라이언트 연결을 끊음
+#   close       - 1013 (Try Again Later) 코드로 연결을 종료
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "256"))
+SEND_QUEUE_POLICY = os.getenv("SEND_QUEUE_POLICY", "drop_oldest")
+SEND_QUEUE_POLICIES = ("drop_oldest", "drop_client", "close")
+if SEND_QUEUE_POLICY not in SEND_QUEUE_POLICIES:
+    raise ValueError(f"SEND_QUEUE_POLICY는 {', '.join(SEND_QUEUE_POLICIES)} 중 하나여야 합니다: {SEND_QUEUE_POLICY}")
+
+# 연결 종료(close 프레임 전송)를 기다리는 최대 시간 (초)
+CLOSE_TIMEOUT = 5.0
+
+# --- 하트비트 (애플리케이션 수준 ping/pong) ---
+# 서버는 HEARTBEAT_INTERVAL초마다 최근에 아무 프레임도 보내지 않은 연결에 {"type": "ping"}을 보내고,
+# HEARTBEAT_TIMEOUT초 동안 아무 프레임(pong 포함)도 받지 못한 연결은 응답 없는 연결(반쯤 열린 TCP 등)로 보고 정리
+# HEARTBEAT_INTERVAL=0이면 하트비트를 끔
+# ping/pong을 지원하는 클라이언트만 대상 (연결 시 x-heartbeat: 1 헤더 또는 heartbeat=1 쿼리 파라미터로 알림)
+# 이전 클라이언트는 ping을 받지도, 응답이 없다고 정리되지도 않음 (받은 프레임은 모두 살아 있다는 신호로만 사용)
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "20"))
+HEARTBEAT_TIMEOUT = float(os.getenv("HEARTBEAT_TIMEOUT", "60"))
+
+# --- 종료 시 연결 정리 ---
+# 종료 신호를 받으면 새 WebSocket 연결을 받지 않고, 클라이언트마다 다른 재접속 대기 시간(0 ~ SHUTDOWN_RECONNECT_SPREAD초)을
+# {"type": "reconnect", "after_ms": ...}로 알린 뒤 1012(Service Restart)로 닫음 (배포 직후 새 서버에 재접속이 한꺼번에 몰리지 않도록)
+# 그다음 저장 대기 중인 메시지를 모두 저장하고 종료
+SHUTDOWN_RECONNECT_SPREAD = float(os.getenv("SHUTDOWN_RECONNECT_SPREAD", "10"))
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "5"))  # 안내 프레임 전송을 기다리는 최대 시간 (초)
+
+# --- 접속자 목록 (presence) ---
+# 입장/퇴장은 닉네임의 첫 연결/마지막 연결 기준으로 PRESENCE_FLUSH_INTERVAL초마다 방별로 모아서 알림
+# 마지막 연결이 끊긴 뒤 PRESENCE_LEAVE_GRACE초 안에 다시 접속하면 퇴장으로 보지 않음
+# 다른 서버 프로세스와는 PRESENCE_SYNC_INTERVAL초마다 (또는 바뀌었을 때) 접속자 목록을 주고받음
+PRESENCE_LEAVE_GRACE = float(os.getenv("PRESENCE_LEAVE_GRACE", "10"))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", "1"))
+PRESENCE_SYNC_INTERVAL = float(os.getenv("PRESENCE_SYNC_INTERVAL", "30"))
+
+# --- 입력 중 표시 (일시적 이벤트) ---
+# 저장/기록/속도 제한/정리 대상이 아닌 이벤트. 닉네임별로 TYPING_TTL초 동안 유지되고,
+# 방별로 최대 1/TYPING_FLUSH_INTERVAL번/초만 현재 입력 중인 닉네임 목록을 전송
+TYPING_TTL = float(os.getenv("TYPING_TTL", "5"))
+TYPING_FLUSH_INTERVAL = float(os.getenv("TYPING_FLUSH_INTERVAL", "0.5"))
+
+# --- 백플레인 설정 ---
+# 여러 서버 프로세스(uvicorn --workers N, 같은 머신의 여러 인스턴스)가 같은 채팅방을 공유하도록 메시지를 중계
+# BACKPLANE: local (단일 프로세스, 기본값) / unix (Unix 도메인 소켓으로 같은 머신의 프로세스 간 중계)
+BACKPLANE = os.getenv("BACKPLANE", "local")
+BACKPLANE_DIR = os.getenv("BACKPLANE_DIR", "/tmp/chat-backplane")
+
+# --- 전송 코덱 (WebSocket 서브프로토콜) ---
+# 클라이언트는 Sec-WebSocket-Protocol 헤더로 코덱을 선택 (선호 순서대로 나열)
+#   chat.msgpack - MessagePack 바이너리 프레임
+#   chat.json    - JSON 텍스트 프레임 (서브프로토콜을 요청하지 않은 기존 클라이언트도 JSON 사용)
+CODEC_JSON = "chat.json"
+CODEC_MSGPACK = "chat.msgpack"
+SUPPORTED_CODECS = (CODEC_MSGPACK, CODEC_JSON) if msgpack else (CODEC_JSON,)
+
+
+def negotiate_codec(websocket: WebSocket) -> Optional[str]:
+    """클라이언트가 요청한 서브프로토콜 중 지원하는 첫 번째 코덱 선택 (없으면 None = JSON)"""
+    requested = websocket.headers.get("sec-websocket-protocol", "")
+    for protocol in (p.strip() for p in requested.split(",")):
+        if protocol in SUPPORTED_CODECS:
+            return protocol
+    return None
+
+
+def encode_frame(codec: Optional[str], message: dict):
+    """메시지를 코덱에 맞는 프레임으로 인코딩 (MessagePack은 bytes, JSON은 str)"""
+    if codec == CODEC_MSGPACK:
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_frame(data) -> dict:
+    """수신한 프레임을 메시지 딕셔너리로 디코딩 (바이너리는 MessagePack, 텍스트는 JSON)"""
+    if isinstance(data, bytes):
+        if msgpack is None:
+            raise ValueError("MessagePack 프레임을 지원하지 않습니다")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+# --- 전송 속도 제한 (토큰 버킷) ---
+# 한 클라이언트가 메시지를 과도하게 보내 브로드캐스트/저장소/대역폭을 독점하지 못하도록 제한
+# 닉네임별 버킷(같은 닉네임의 모든 연결과 /send가 공유)과 연결별 버킷을 모두 통과해야 메시지가 수락됨
+# *_RATE: 초당 보충되는 메시지 수 (0이면 해당 제한을 끔), *_BURST: 쉬지 않고 연속으로 보낼 수 있는 메시지 수
+RATE_LIMIT_NICKNAME_RATE = float(os.getenv("RATE_LIMIT_NICKNAME_RATE", "3"))
+RATE_LIMIT_NICKNAME_BURST = float(os.getenv("RATE_LIMIT_NICKNAME_BURST", "10"))
+RATE_LIMIT_CONNECTION_RATE = float(os.getenv("RATE_LIMIT_CONNECTION_RATE", "2"))
+RATE_LIMIT_CONNECTION_BURST = float(os.getenv("RATE_LIMIT_CONNECTION_BURST", "8"))
+# 메시지 본문 최대 길이 (문자 수). 넘으면 저장/브로드캐스트 전에 거부
+MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", "2000"))
+# 디코딩하기 전에 거부하는 수신 프레임 크기 (UTF-8 최대 4바이트/문자 + 다른 필드 여유분)
+MAX_FRAME_SIZE = MAX_CONTENT_LENGTH * 4 + 1024
+
+
+class TokenBucket:
+    """초당 rate개씩 보충되고 최대 burst개까지 쌓이는 토큰 버킷"""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def retry_after(self, now: float) -> float:
+        """토큰 하나를 쓸 수 있을 때까지 남은 시간 (초, 0이면 바로 사용 가능)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """키(닉네임)별 토큰 버킷 모음 (가득 찬 버킷은 주기적으로 정리하여 메모리 사용을 제한)"""
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: dict[str, TokenBucket] = {}
+        self._swept = time.monotonic()
+
+    def bucket(self, key: str) -> Optional[TokenBucket]:
+        """키의 버킷 (제한이 꺼져 있으면 None)"""
+        if self.rate <= 0:
+            return None
+        now = time.monotonic()
+        if now - self._swept >= self.SWEEP_INTERVAL:
+            self._swept = now
+            self.buckets = {k: b for k, b in self.buckets.items() if not b.is_full(now)}
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+
+nickname_limiter = RateLimiter(RATE_LIMIT_NICKNAME_RATE, RATE_LIMIT_NICKNAME_BURST)
+
+
+def check_rate_limit(nickname: str, conn: Optional["Connection"] = None) -> float:
+    """연결/닉네임 버킷을 확인하고 토큰을 소비 (제한에 걸리면 다시 보낼 수 있을 때까지 남은 시간(초) 반환)"""
+    now = time.monotonic()
+    buckets = [(scope, bucket) for scope, bucket in (
+        ("connection", conn.bucket if conn is not None else None),
+        ("nickname", nickname_limiter.bucket(nickname)),
+    ) if bucket is not None]
+    # 하나라도 막히면 어떤 버킷의 토큰도 소비하지 않음
+    for scope, bucket in buckets:
+        wait = bucket.retry_after(now)
+        if wait > 0:
+            THROTTLED_TOTAL.inc(scope=scope)
+            return wait
+    for _, bucket in buckets:
+        bucket.take()
+    return 0.0
+
+
+def error_frame(code: str, message: str, **extra) -> dict:
+    """클라이언트에 보내는 에러 프레임 (error 키는 기존 클라이언트 호환용)"""
+    return {"type": "error", "code": code, "error": message, **extra}
+
+
+# --- 멱등성 키 ---
+# 클라이언트가 메시지마다 붙이는 client_id로 재전송된 메시지를 걸러냄
+# (같은 닉네임 + client_id는 IDEMPOTENCY_TTL초 동안 한 번만 게시하고, 다시 오면 처음 부여한 ID/시퀀스 번호로 응답)
+IDEMPOTENCY_TTL = float(os.getenv("CHAT_IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("CHAT_IDEMPOTENCY_MAX_KEYS", "10000"))
+MAX_CLIENT_ID_LENGTH = 64
+
+
+class IdempotencyCache:
+    """키 -> 게시 결과 (최대 max_keys개, ttl초가 지나면 잊음)"""
+    def __init__(self, ttl: float, max_keys: int):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        # 키 -> (만료 시각, 게시 결과 future). TTL이 같으므로 삽입 순서가 곧 만료 순서
+        self._entries: "OrderedDict[tuple, tuple[float, asyncio.Future]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def seen(self, key: tuple) -> bool:
+        """이미 게시했거나 게시 중인 키인지 (만료된 키는 처음 보는 것으로 취급)"""
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def _expire(self, now: float):
+        while self._entries:
+            expires_at, _ = next(iter(self._entries.values()))
+            if expires_at > now and len(self._entries) < self.max_keys:
+                break
+            self._entries.popitem(last=False)
+
+    async def run(self, key: tuple, publish: Callable[[], Awaitable[dict]]) -> tuple[dict, bool]:
+        """처음 보는 키면 publish를 실행하고, 이미 본 키면 그 결과를 기다림 ((결과, 중복 여부) 반환)"""
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._entries.get(key)
+        if entry is not None:
+            return await asyncio.shield(entry[1]), True
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (now + self.ttl, future)
+        try:
+            result = await publish()
+        except asyncio.CancelledError:
+            self._entries.pop(key, None)
+            future.cancel()
+            raise
+        except Exception as e:
+            # 게시에 실패한 키는 잊어서 클라이언트가 다시 보낼 수 있게 함
+            self._entries.pop(key, None)
+            future.set_exception(e)
+            future.exception()  # 같은 키를 기다리는 요청이 없어도 경고가 나지 않도록 조회 처리
+            raise
+        future.set_result(result)
+        return result, False
+
+
+idempotency_keys = IdempotencyCache(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS)
+
+
+def parse_client_id(value) -> Optional[str]:
+    """클라이언트가 보낸 멱등성 키 확인 (없거나 잘못된 값이면 None)"""
+    if isinstance(value, str) and 0 < len(value) <= MAX_CLIENT_ID_LENGTH:
+        return value
+    return None
+
+
+async def publish_once(nickname: str, content: str, room: str, client_id: Optional[str]) -> tuple[dict, bool]:
+    """멱등성 키가 있으면 같은 메시지를 한 번만 게시 ((메시지, 중복 여부) 반환)"""
+    if client_id is None:
+        return await publish_message(nickname, content, room), False
+    message, duplicate = await idempotency_keys.run(
+        (nickname, room, client_id), lambda: publish_message(nickname, content, room))
+    if duplicate:
+        DUPLICATE_MESSAGES_TOTAL.inc()
+    return message, duplicate
+
+
+def ack_frame(client_id: str, message: dict) -> dict:
+    """메시지를 수락했음을 보낸 클라이언트에 알리는 프레임 (서버가 부여한 메시지 ID와 시퀀스 번호 포함)"""
+    return {"type": "ack", "client_id": client_id, "id": message["id"], "seq": message["seq"]}
+
+
+_connection_ids = itertools.count(1)
+
+
+class Connection:
+    """WebSocket 연결 하나와 그 연결 전용 송신 큐"""
+    def __init__(self, websocket: WebSocket, nickname: str, room: str, codec: Optional[str], queue_size: int,
+                 heartbeat: bool = False):
+        # 메트릭 레이블용 연결 번호 (닉네임은 노출하지 않음)
+        self.id = next(_connection_ids)
+        self.websocket = websocket
+        self.nickname = nickname
+        self.room = room
+        # 협상된 코덱 (None이면 서브프로토콜 없이 JSON 텍스트)
+        self.codec = codec
+        # 송신 큐에는 이미 인코딩된 프레임(str 또는 bytes)과 큐에 넣은 시각이 들어감
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        # 큐가 가득 차서 버려진 메시지 수
+        self.dropped = 0
+        # 연결별 전송 속도 제한 (None이면 제한 없음)
+        self.bucket = TokenBucket(RATE_LIMIT_CONNECTION_RATE, RATE_LIMIT_CONNECTION_BURST) \
+            if RATE_LIMIT_CONNECTION_RATE > 0 else None
+        # 마지막으로 프레임을 받은 시각 (하트비트 시간 초과 판단 기준)
+        self.last_seen = time.monotonic()
+        # 클라이언트가 ping/pong을 지원하는지 (아니면 ping을 보내지 않고 응답 없음으로 정리하지도 않음)
+        self.heartbeat = heartbeat
+
+
 class ConnectionManager:
-    # ... (existing ConnectionManager code) ...
-    def __init__(self):
-        # 활성 WebSocket 연결 목록 (WebSocket 객체: 닉네임)
-        self.active_connections: dict[WebSocket, str] = {}
+    def __init__(self, queue_size: int = SEND_QUEUE_SIZE, policy: str = SEND_QUEUE_POLICY,
+                 backplane: Optional[Backplane] = None, heartbeat_interval: float = HEARTBEAT_INTERVAL,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT):
+        # 활성 WebSocket 연결 목록 (WebSocket 객체: Connection)
+        self.active_connections: dict[WebSocket, Connection] = {}
+        # 수락했지만 누락 메시지를 기다리느라 아직 등록하지 않은 연결 (종료 시 재접속 안내 대상)
+        self.connecting: set[Connection] = set()
+        # 방별 구독 연결 목록 (브로드캐스트는 해당 방의 연결만 순회)
+        self.rooms: dict[str, set[Connection]] = {}
+        self.queue_size = queue_size
+        self.policy = policy
+        self.backplane = backplane or create_backplane("local", BACKPLANE_DIR)
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_timeout = max(heartbeat_timeout, heartbeat_interval)
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        # 종료 중 (새 연결을 받지 않음)
+        self.draining = False
+        self.presence = PresenceTracker(self.backplane.origin, self.deliver_local, self.backplane.publish,
+                                        PRESENCE_LEAVE_GRACE, PRESENCE_FLUSH_INTERVAL, PRESENCE_SYNC_INTERVAL)
+        self.typing = EphemeralChannel("typing", self.backplane.origin, self.deliver_local, self.backplane.publish,
+                                       TYPING_TTL, TYPING_FLUSH_INTERVAL)
+
+    def start_heartbeat(self):
+        if self.heartbeat_interval > 0:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    def stop_heartbeat(self):
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
     
-    async def connect(self, websocket: WebSocket, nickname: str):
-        await websocket.accept()
-        self.active_connections[websocket] = nickname
-        print(f"클라이언트 연결됨 ({nickname}). 현재 연결 수: {len(self.active_connections)}")
-        
-        # 입장 알림 브로드캐스트 (시스템 메시지)
-        await self.broadcast({
-            "type": "system",
-            "content": f"{nickname}님이 입장하셨습니다."
-        })
+    async def connect(self, websocket: WebSocket, nickname: str, room: str, codec: Optional[str] = None,
+                      catchup: Optional[Callable[[], Awaitable[dict]]] = None, heartbeat: bool = False) -> Connection:
+        await websocket.accept(subprotocol=codec)
+        mark_startup("first_connection")
+        conn = Connection(websocket, nickname, room, codec, self.queue_size, heartbeat)
+        conn.writer_task = asyncio.create_task(self._writer(conn))
+        # 누락 메시지 프레임은 방에 등록하기 직전에 만들어 실시간 메시지보다 먼저 큐에 넣음
+        # (catchup은 저장소가 준비될 때까지 기다릴 수 있지만, 프레임을 만든 뒤 방에 등록할 때까지는 await가 없으므로
+        #  누락분과 실시간 메시지 사이에 빈틈이나 중복이 생기지 않음)
+        if catchup is not None:
+            self.connecting.add(conn)
+            try:
+                frame = await catchup()
+            except BaseException:
+                # 기다리는 중에 취소되거나 실패하면 송신 태스크를 정리하고 호출한 쪽으로 전달
+                conn.writer_task.cancel()
+                raise
+            finally:
+                self.connecting.discard(conn)
+            self.send_personal(conn, frame)
+        self.active_connections[websocket] = conn
+        self.rooms.setdefault(room, set()).add(conn)
+        print(f"클라이언트 연결됨 ({nickname}, 방: {room}). 현재 연결 수: {len(self.active_connections)}")
+
+        # 입장은 접속자 목록에 반영하고 (다른 클라이언트에는 모아서 알림), 새 연결에는 현재 접속자 목록 전송
+        self.presence.join(room, nickname)
+        self.send_personal(conn, self.presence.snapshot(room))
+        return conn
     
-    async def disconnect(self, websocket: WebSocket):
-        nickname = self.active_connections.pop(websocket, "알 수 없음")
-        print(f"클라이언트 연결 해제됨 ({nickname}). 현재 연결 수: {len(self.active_connections)}")
-        
-        # 퇴장 알림 브로드캐스트 (시스템 메시지)
-        await self.broadcast({
-            "type": "system",
-            "content": f"{nickname}님이 퇴장하셨습니다."
-        })
+    async def disconnect(self, conn: Connection):
+        self._remove(conn)
+        print(f"클라이언트 연결 해제됨 ({conn.nickname}, 방: {conn.room}). 현재 연결 수: {len(self.active_connections)}")
+        if conn.dropped:
+            print(f"송신 큐 초과로 버려진 메시지 ({conn.nickname}): {conn.dropped}개")
+        self.presence.leave(conn.room, conn.nickname)
+        self.typing.update(conn.room, conn.nickname, active=False)
     
-    async def broadcast(self, message: dict):
-        # 모든 연결된 클라이언트에 메시지 브로드캐스팅
-        disconnected = []
-        for connection in self.active_connections:
+    async def drain(self, spread: float, timeout: float):
+        """모든 연결에 재접속 대기 시간을 알리고 1012로 닫음 (대기 시간은 0 ~ spread초 사이에 고르게 분산)"""
+        self.draining = True
+        conns = list(self.active_connections.values()) + list(self.connecting)
+        if not conns:
+            return
+        random.shuffle(conns)
+        for i, conn in enumerate(conns):
+            self.send_personal(conn, reconnect_frame(spread * (i + random.random()) / len(conns)))
+        # 안내 프레임과 그 전에 쌓인 프레임이 모두 전송될 때까지 기다린 뒤 닫음
+        try:
+            await asyncio.wait_for(asyncio.gather(*(conn.queue.join() for conn in conns)), timeout=timeout)
+        except asyncio.TimeoutError:
+            print("종료: 일부 연결에 재접속 안내를 보내지 못했습니다")
+        await asyncio.gather(*(self._close(conn, 1012, "Server restarting") for conn in conns))
+        print(f"종료: 연결 {len(conns)}개에 재접속 시간을 안내하고 닫았습니다")
+
+    async def broadcast(self, message: dict, room: str):
+        # 이 프로세스의 같은 방 클라이언트에 전달하고, 백플레인을 통해 다른 서버 프로세스에도 발행
+        self.deliver_local(room, message)
+        self.backplane.publish(room, message)
+
+    def deliver_local(self, room: str, message: dict):
+        # 이 프로세스에서 해당 방에 연결된 클라이언트의 송신 큐에 메시지를 넣음 (실제 전송은 연결별 송신 태스크가 수행)
+        # 메시지는 코덱별로 한 번만 인코딩하고 같은 프레임을 모든 수신자가 공유
+        # 큐 정책에 따라 반복 중 연결이 제거될 수 있으므로 목록을 복사해서 순회
+        with BROADCAST_SECONDS.time():
+            frames = {}
+            for conn in list(self.rooms.get(room, ())):
+                frame = frames.get(conn.codec)
+                if frame is None:
+                    frame = frames[conn.codec] = encode_frame(conn.codec, message)
+                self._enqueue(conn, frame)
+
+    def send_personal(self, conn: Connection, message: dict):
+        """특정 연결에만 메시지 전송 (에러 응답 등)"""
+        self._enqueue(conn, encode_frame(conn.codec, message))
+
+    def _enqueue(self, conn: Connection, frame):
+        item = (frame, time.perf_counter())
+        try:
+            conn.queue.put_nowait(item)
+            return
+        except asyncio.QueueFull:
+            conn.dropped += 1
+            SEND_DROPPED_TOTAL.inc(policy=self.policy)
+
+        if self.policy == "drop_oldest":
+            conn.queue.get_nowait()
+            conn.queue.task_done()
+            conn.queue.put_nowait(item)
+        elif self.policy == "drop_client":
+            print(f"송신 큐 초과로 연결을 끊습니다 ({conn.nickname})")
+            self._evict(conn)
+        else:
+            print(f"송신 큐 초과로 연결을 종료합니다 ({conn.nickname}, 1013)")
+            self._evict(conn, code=1013, reason="Send queue overflow")
+
+    async def _heartbeat(self):
+        # 응답 없는 연결은 브로드캐스트 대상에서 제외하고 닫음 (퇴장 알림은 수신 루프가 끝나면서 처리)
+        # 한동안 조용한 연결에만 ping을 보내 클라이언트가 pong으로 살아 있음을 알리게 함
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            now = time.monotonic()
+            frames = {}
+            for conn in list(self.active_connections.values()):
+                if not conn.heartbeat:
+                    continue
+                idle = now - conn.last_seen
+                if idle > self.heartbeat_timeout:
+                    print(f"하트비트 응답 없음, 연결을 정리합니다 ({conn.nickname}, {idle:.0f}초)")
+                    HEARTBEAT_EVICTED_TOTAL.inc()
+                    self._evict(conn, code=4008, reason="Heartbeat timeout")
+                    continue
+                if idle < self.heartbeat_interval:
+                    continue
+                frame = frames.get(conn.codec)
+                if frame is None:
+                    frame = frames[conn.codec] = encode_frame(conn.codec, {"type": "ping", "ts": time.time()})
+                self._enqueue(conn, frame)
+
+    async def _writer(self, conn: Connection):
+        # 연결 전용 송신 루프: 이 연결이 느려도 다른 연결의 전송에는 영향이 없음
+        while True:
+            frame, enqueued_at = await conn.queue.get()
             try:
-                await connection.send_json(message)
+                if isinstance(frame, bytes):
+                    await conn.websocket.send_bytes(frame)
+                else:
+                    await conn.websocket.send_text(frame)
+                SEND_DELAY_SECONDS.observe(time.perf_counter() - enqueued_at)
             except Exception as e:
-                print(f"메시지 전송 실패: {e}")
-                disconnected.append(connection)
-        
-        # 연결이 끊어진 클라이언트 제거 (반복문 중 딕셔너리 변경 방지 위해 별도 처리)
-        for connection in disconnected:
-            # 재귀 호출 방지를 위해 active_connections에서 직접 제거만 수행
-             if connection in self.active_connections:
-                del self.active_connections[connection]
+                print(f"메시지 전송 실패 ({conn.nickname}): {e}")
+                self._evict(conn)
+                return
+            finally:
+                # 종료 시 큐의 프레임이 모두 전송되었는지 확인하는 데 사용 (Queue.join)
+                conn.queue.task_done()
 
-manager = ConnectionManager()
+    def _remove(self, conn: Connection):
+        # 연결 목록에서 제거하고 송신 태스크 중지
+        if self.active_connections.get(conn.websocket) is conn:
+            del self.active_connections[conn.websocket]
+        members = self.rooms.get(conn.room)
+        if members is not None:
+            members.discard(conn)
+            if not members:
+                del self.rooms[conn.room]
+        if conn.writer_task and conn.writer_task is not asyncio.current_task():
+            conn.writer_task.cancel()
+
+    def _evict(self, conn: Connection, code: int = 1000, reason: str = ""):
+        # 브로드캐스트 대상에서 즉시 제외하고 소켓 종료는 백그라운드에서 수행
+        # (퇴장 알림은 수신 루프가 끝나면서 disconnect에서 처리)
+        self._remove(conn)
+        asyncio.create_task(self._close(conn, code, reason))
+
+    async def _close(self, conn: Connection, code: int, reason: str):
+        try:
+            await asyncio.wait_for(conn.websocket.close(code=code, reason=reason), timeout=CLOSE_TIMEOUT)
+        except Exception:
+            pass
+
+def reconnect_frame(delay: float) -> dict:
+    """서버 종료 시 클라이언트에 재접속 대기 시간을 알리는 프레임"""
+    return {"type": "reconnect", "after_ms": int(delay * 1000)}
+
+
+manager = ConnectionManager(backplane=create_backplane(BACKPLANE, BACKPLANE_DIR))
+
+
+async def drain_connections():
+    """종료 1단계: 준비 상태를 해제하고 새 WebSocket 연결을 받지 않으며, 기존 연결은 재접속 시간을 안내한 뒤 닫음"""
+    global app_ready
+    if manager.draining:
+        return
+    app_ready = False
+    await manager.drain(SHUTDOWN_RECONNECT_SPREAD, SHUTDOWN_DRAIN_TIMEOUT)
+
+
+class ChatServer(uvicorn.Server):
+    """uvicorn이 종료하면서 모든 연결을 한꺼번에 끊기 전에 WebSocket 연결을 먼저 정리하는 서버"""
+    async def shutdown(self, sockets=None):
+        # 리스닝 소켓을 먼저 닫아 새 연결을 받지 않음
+        for server in self.servers:
+            server.close()
+        await drain_connections()
+        await super().shutdown(sockets=sockets)
+
+# 현재 연결 상태 메트릭 (/metrics 요청 시 계산)
+metrics.gauge("chat_connections_active", "활성 WebSocket 연결 수",
+              callback=lambda: len(manager.active_connections))
+metrics.gauge("chat_room_connections", "방별 활성 연결 수", ("room",),
+              callback=lambda: [((room,), len(members)) for room, members in manager.rooms.items()])
+metrics.gauge("chat_send_queue_depth", "연결별 송신 큐에 대기 중인 프레임 수", ("conn", "room"),
+              callback=lambda: [((conn.id, conn.room), conn.queue.qsize()) for conn in manager.active_connections.values()])
+metrics.gauge("chat_connection_dropped_messages", "연결별 송신 큐 초과로 버려진 메시지 수", ("conn", "room"),
+              callback=lambda: [((conn.id, conn.room), conn.dropped) for conn in manager.active_connections.values()])
+metrics.gauge("chat_backplane_dropped", "다른 서버 프로세스로 전달하지 못한 메시지 수",
+              callback=lambda: manager.backplane.dropped)
+metrics.gauge("chat_rate_limit_buckets", "추적 중인 닉네임별 토큰 버킷 수",
+              callback=lambda: len(nickname_limiter.buckets))
+metrics.gauge("chat_presence_online", "방별 접속 중인 닉네임 수 (모든 서버 프로세스)", ("room",),
+              callback=lambda: [((room,), len(manager.presence.roster(room))) for room in manager.presence.rooms()])
+metrics.gauge("chat_search_index_messages", "검색 색인에 들어 있는 메시지 수",
+              callback=lambda: search_index.size())
+metrics.gauge("chat_typing_frames_sent", "방별로 모아서 전송한 입력 중 표시 프레임 수",
+              callback=lambda: manager.typing.sent)
+metrics.gauge("chat_idempotency_keys", "기억 중인 멱등성 키 수",
+              callback=lambda: len(idempotency_keys))
+
+
+def on_remote_message(room: str, message: dict):
+    """다른 서버 프로세스에서 수락된 메시지 처리 (백플레인 수신 콜백)"""
+    if message.get("type") == "presence_state":
+        manager.presence.apply_remote(room, message)
+        return
+    if message.get("type") == manager.typing.state_type:
+        manager.typing.apply_remote(room, message)
+        return
+    if message.get("type") == "user":
+        try:
+            history.append(room, parse_timestamp(message["timestamp"]), message)
+            search_index.add(room, message)
+        except (KeyError, ValueError) as e:
+            print(f"원격 메시지 타임스탬프 에러: {e}")
+    manager.deliver_local(room, message)
 
 # 4. 데이터 모델 정의 (채팅 메시지 규격)
 class Message(BaseModel):
     nickname: str
     content: str
+    room: Optional[str] = None
+    client_id: Optional[str] = None
+
+class RosterRequest(BaseModel):
+    nickname: str
+    room: Optional[str] = None
+
+class SearchRequest(BaseModel):
+    nickname: str
+    query: str
+    room: Optional[str] = None
+    offset: int = 0
+    limit: int = SEARCH_PAGE_SIZE
+
+class HistoryRequest(BaseModel):
+    nickname: str
+    room: Optional[str] = None
+    before: Optional[str] = None
+    limit: int = HISTORY_PAGE_SIZE
 
 class FetchMessagesRequest(BaseModel):
     nickname: str
     after: Optional[str] = None
+    after_seq: Optional[int] = None
+    room: Optional[str] = None
+
+async def publish_message(nickname: str, content: str, room: str) -> dict:
+    """메시지를 즉시 같은 방에 브로드캐스트하고 저장 대기열에 추가"""
+    # 방의 최근 메시지 캐시가 준비되어 있어야 새 메시지가 캐시에 반영되고 시퀀스 번호를 이어서 부여할 수 있음
+    ring = await history.get(room)
+    # 메시지 ID는 로컬에서 생성되므로 저장소 왕복 없이 바로 사용 가능
+    message_id = store.new_id()
+    # 서버가 부여하는 방별 단조 증가 시퀀스 번호 (클라이언트의 누락 감지/재동기화 기준)
+    # 저장이 지연되므로 SERVER_TIMESTAMP 대신 수신 시각을 저장 (브로드캐스트 시각과 동일하게 유지)
+    # 워커가 여러 개면 백플레인의 공유 카운터에서 번호와 시각을 함께 받음 (워커 간 번호 중복 방지)
+    try:
+        allocated = manager.backplane.next_sequence(room, ring.last_seq)
+    except OSError as e:
+        print(f"공유 시퀀스 번호 발급 실패 ({room}), 로컬 카운터 사용: {e}")
+        allocated = None
+    if allocated is None:
+        timestamp = datetime.now(timezone.utc)
+        seq = ring.next_seq()
+    else:
+        seq, timestamp = allocated
+        ring.last_seq = max(ring.last_seq, seq)
+    MESSAGES_TOTAL.inc()
+    MESSAGE_RATE.mark()
+
+    message_data = {
+        "type": "user",
+        "id": message_id,
+        "seq": seq,
+        "nickname": nickname,
+        "content": content,
+        "timestamp": timestamp.isoformat(),
+        "room": room
+    }
+    with loop_monitor.phase("broadcast"):
+        await manager.broadcast(message_data, room)
+    # 최근 메시지 캐시/검색 색인 반영과 저장 대기열 추가 (실제 저장은 백그라운드 배치)
+    with loop_monitor.phase("enqueue"):
+        history.append(room, timestamp, message_data)
+        search_index.add(room, message_data)
+        persister.put(room, message_id, {
+            "nickname": nickname,
+            "content": content,
+            "timestamp": timestamp,
+            "seq": seq
+        })
+    return message_data
+
+async def wait_for_storage():
+    """HTTP 요청: 시작 직후라면 저장소가 준비될 때까지 기다리고, 너무 오래 걸리면 503으로 응답"""
+    if store_ready.is_set():
+        return
+    try:
+        await asyncio.wait_for(store_ready.wait(), timeout=STORE_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="저장소를 준비하고 있습니다.", headers={"Retry-After": "5"})
 
 # [API 1] 메시지 전송 (저장) - HTTP 엔드포인트 (하위 호환성 유지)
 @app.post("/send")
-async def send_message(msg: Message, background_tasks: BackgroundTasks):
+async def send_message(msg: Message):
     # ... (existing code) ...
     # 화이트리스트 체크
     if not is_nickname_allowed(msg.nickname):
         print(f"[SECURITY_ALERT] 무단 메시지 전송 시도 - 닉네임: {msg.nickname}")
         raise HTTPException(status_code=403, detail="등록되지 않은 닉네임입니다.")
 
-    doc_ref = db.collection("messages").document()
-    doc_id = doc_ref.id
-    
-    # Firestore에 저장 (서버 타임스탬프 사용)
-    doc_ref.set({
-        "nickname": msg.nickname,
-        "content": msg.content,
-        "timestamp": firestore.SERVER_TIMESTAMP
-    })
-    
-    # WebSocket으로 모든 클라이언트에 브로드캐스팅
-    message_data = {
-        "type": "user",
-        "id": doc_id,
-        "nickname": msg.nickname,
-        "content": msg.content,
-        "timestamp": datetime.now().isoformat()
-    }
-    await manager.broadcast(message_data)
-    
-    # 백그라운드에서 오래된 메시지 정리 작업 추가
-    background_tasks.add_task(cleanup_old_messages)
+    room = resolve_room(msg.room)
+    if room is None:
+        raise HTTPException(status_code=400, detail="잘못된 방 이름입니다.")
+
+    if len(msg.content) > MAX_CONTENT_LENGTH:
+        OVERSIZED_TOTAL.inc()
+        raise HTTPException(status_code=413, detail=f"메시지는 {MAX_CONTENT_LENGTH}자를 넘을 수 없습니다.")
+
+    if msg.client_id is not None and parse_client_id(msg.client_id) is None:
+        raise HTTPException(status_code=400, detail="잘못된 client_id입니다.")
+
+    # 이미 게시된 client_id의 재전송은 속도 제한에 포함하지 않고 처음 결과를 그대로 반환
+    if not idempotency_keys.seen((msg.nickname, room, msg.client_id)):
+        retry_after = check_rate_limit(msg.nickname)
+        if retry_after > 0:
+            raise HTTPException(status_code=429, detail="메시지를 너무 빠르게 보내고 있습니다.",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
+
+    # WebSocket으로 같은 방의 클라이언트에 브로드캐스팅 후 백그라운드 저장
+    await wait_for_storage()
+    message, duplicate = await publish_once(msg.nickname, msg.content, room, msg.client_id)
     
-    return {"status": "success"}
+    return {"status": "success", "id": message["id"], "seq": message["seq"], "duplicate": duplicate}
+
+def parse_last_seq(value) -> Optional[int]:
+    """클라이언트가 보낸 마지막 시퀀스 번호 확인 (없거나 잘못된 값이면 None)"""
+    try:
+        seq = int(value)
+    except (TypeError, ValueError):
+        return None
+    return seq if seq >= 0 else None
 
 # [WebSocket] 실시간 채팅 연결
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    # 종료 중에는 연결을 수락하자마자 재접속 시간을 안내하고 닫음
+    # (수락 전에 닫으면 HTTP 403으로 응답되어 클라이언트가 접근 거부로 처리함)
+    if manager.draining:
+        codec = negotiate_codec(websocket)
+        await websocket.accept(subprotocol=codec)
+        frame = encode_frame(codec, reconnect_frame(random.uniform(0, SHUTDOWN_RECONNECT_SPREAD)))
+        if isinstance(frame, bytes):
+            await websocket.send_bytes(frame)
+        else:
+            await websocket.send_text(frame)
+        await websocket.close(code=1012, reason="Server restarting")
+        return
+
     # 헤더에서 닉네임 추출 (보안 강화)
     nickname_header = websocket.headers.get("x-nickname")
     nickname = None
@@ -204,6 +1365,13 @@ async def websocket_endpoint(websocket: WebSocket):
     if not nickname:
         nickname = websocket.query_params.get("nickname")
 
+    # 방 이름도 헤더 우선, 없으면 쿼리 파라미터 (둘 다 없으면 기본 방)
+    room_header = websocket.headers.get("x-room")
+    room = resolve_room(urllib.parse.unquote(room_header) if room_header else websocket.query_params.get("room"))
+
+    # 클라이언트가 마지막으로 받은 시퀀스 번호 (있으면 접속 직후 누락 메시지를 한 번에 전송)
+    last_seq = parse_last_seq(websocket.headers.get("x-last-seq") or websocket.query_params.get("last_seq"))
+
     # 닉네임 파라미터 확인 및 화이트리스트 체크
     if nickname is None:
         # 닉네임이 없으면 연결 거부 (400 Bad Request)
@@ -215,99 +1383,272 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=4003, reason="Forbidden nickname")
         return
 
-    await manager.connect(websocket, nickname)
+    if room is None:
+        await websocket.close(code=4000, reason="Invalid room")
+        return
+
+    async def catchup() -> dict:
+        ring = await history.get(room)
+        return dict(ring.catchup(last_seq), room=room)
+
+    # 하트비트(ping/pong) 지원 여부 (지원하는 클라이언트만 응답 없음으로 정리)
+    heartbeat = (websocket.headers.get("x-heartbeat") or websocket.query_params.get("heartbeat")) == "1"
+
+    # 연결은 저장소 준비 여부와 관계없이 바로 수락 (누락 메시지 전송만 저장소 준비 후)
+    conn = await manager.connect(websocket, nickname, room, negotiate_codec(websocket),
+                                 catchup if last_seq is not None else None, heartbeat)
     try:
         while True:
-            # 클라이언트로부터 메시지 수신
-            data = await websocket.receive_text()
-            message_dict = json.loads(data)
-            
-            # 메시지 유효성 검사
-            if "nickname" not in message_dict or "content" not in message_dict:
-                await websocket.send_json({"error": "잘못된 메시지 형식"})
+            # 클라이언트로부터 메시지 수신 (텍스트: JSON, 바이너리: MessagePack)
+            frame = await websocket.receive()
+            if frame["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(frame.get("code", 1000))
+            conn.last_seen = time.monotonic()
+            data = frame["text"] if frame.get("text") is not None else frame["bytes"]
+            # 너무 큰 프레임은 디코딩하지 않고 거부
+            if len(data) > MAX_FRAME_SIZE:
+                OVERSIZED_TOTAL.inc()
+                manager.send_personal(conn, error_frame(
+                    "message_too_large", "메시지가 너무 깁니다", max_length=MAX_CONTENT_LENGTH))
                 continue
+            with loop_monitor.phase("parse"):
+                message_dict = decode_frame(data)
 
-            # 메시지 전송 시 닉네임 재검증 (변조 방지)
-            if message_dict["nickname"] != nickname:
-                 await websocket.send_json({"error": "닉네임 불일치"})
-                 continue
-            
-            # Firestore에 저장 (서버 타임스탬프 사용)
-            doc_ref = db.collection("messages").document()
-            doc_id = doc_ref.id
-            
-            doc_ref.set({
-                "nickname": message_dict["nickname"],
-                "content": message_dict["content"],
-                "timestamp": firestore.SERVER_TIMESTAMP
-            })
+            # 하트비트: 서버 ping에 대한 pong은 왕복 시간만 기록하고, 클라이언트 ping에는 pong으로 응답
+            if message_dict.get("type") == "pong":
+                if isinstance(message_dict.get("ts"), (int, float)):
+                    HEARTBEAT_RTT_SECONDS.observe(max(0.0, time.time() - message_dict["ts"]))
+                continue
+            if message_dict.get("type") == "ping":
+                manager.send_personal(conn, {"type": "pong", "ts": message_dict.get("ts")})
+                continue
+
+            # 입력 중 표시: 저장/브로드캐스트하지 않고 상태만 갱신 (전송은 방별로 모아서 일정 간격으로)
+            if message_dict.get("type") == "typing":
+                TYPING_EVENTS_TOTAL.inc()
+                manager.typing.update(room, nickname, message_dict.get("active", True) is not False)
+                continue
+
+            # 누락 감지 시 클라이언트의 재동기화 요청: 마지막으로 받은 시퀀스 이후의 메시지 전송
+            if message_dict.get("type") == "resync":
+                resync_seq = parse_last_seq(message_dict.get("last_seq"))
+                if resync_seq is not None:
+                    # 한 번에 최대 CATCHUP_LIMIT개를 보내므로 연결 버킷의 토큰을 씀 (닉네임 버킷은 메시지 전송에만 사용)
+                    if conn.bucket is not None:
+                        retry_after = conn.bucket.retry_after(time.monotonic())
+                        if retry_after > 0:
+                            THROTTLED_TOTAL.inc(scope="resync")
+                            manager.send_personal(conn, error_frame(
+                                "rate_limited", "재동기화 요청이 너무 잦습니다", retry_after=round(retry_after, 3),
+                                request="resync", last_seq=resync_seq))
+                            continue
+                        conn.bucket.take()
+                    ring = await history.get(room)
+                    manager.send_personal(conn, dict(ring.catchup(resync_seq), room=room))
+                continue
             
-            # 모든 클라이언트에 브로드캐스팅
-            message_data = {
-                "type": "user",
-                "id": doc_id,
-                "nickname": message_dict["nickname"],
-                "content": message_dict["content"],
-                "timestamp": datetime.now().isoformat()
-            }
-            await manager.broadcast(message_data)
-
-            # 백그라운드에서 오래된 메시지 정리 작업 추가
-            background_tasks = BackgroundTasks()
-            background_tasks.add_task(cleanup_old_messages)
+            with loop_monitor.phase("validate"):
+                # 멱등성 키: 에러/ack 프레임에 그대로 돌려주어 클라이언트가 어떤 메시지에 대한 응답인지 알 수 있게 함
+                client_id = parse_client_id(message_dict.get("client_id"))
+                extra = {"client_id": client_id} if client_id else {}
+
+                # 메시지 유효성 검사
+                if "nickname" not in message_dict or not isinstance(message_dict.get("content"), str):
+                    manager.send_personal(conn, error_frame("invalid_message", "잘못된 메시지 형식", **extra))
+                    continue
+
+                # 메시지 전송 시 닉네임 재검증 (변조 방지)
+                if message_dict["nickname"] != nickname:
+                     manager.send_personal(conn, error_frame("nickname_mismatch", "닉네임 불일치", **extra))
+                     continue
+
+                if len(message_dict["content"]) > MAX_CONTENT_LENGTH:
+                    OVERSIZED_TOTAL.inc()
+                    manager.send_personal(conn, error_frame(
+                        "message_too_large", "메시지가 너무 깁니다", max_length=MAX_CONTENT_LENGTH, **extra))
+                    continue
+
+                # 전송 속도 제한: 거부된 메시지는 저장/브로드캐스트하지 않고 다시 보낼 수 있는 시간을 알려줌
+                # (이미 게시된 메시지의 재전송은 토큰을 쓰지 않음)
+                if not (client_id and idempotency_keys.seen((nickname, room, client_id))):
+                    retry_after = check_rate_limit(nickname, conn)
+                    if retry_after > 0:
+                        manager.send_personal(conn, error_frame(
+                            "rate_limited", "메시지를 너무 빠르게 보내고 있습니다", retry_after=round(retry_after, 3), **extra))
+                        continue
+
+            # 같은 방의 클라이언트에 브로드캐스팅 후 백그라운드 저장 (재전송이면 다시 게시하지 않고 ack만 보냄)
+            message, _ = await publish_once(nickname, message_dict["content"], room, client_id)
+            # 메시지를 보냈으면 입력 중 표시 해제
+            manager.typing.update(room, nickname, active=False)
+            if client_id:
+                manager.send_personal(conn, ack_frame(client_id, message))
             
     except WebSocketDisconnect:
-        await manager.disconnect(websocket)
+        await manager.disconnect(conn)
     except Exception as e:
         print(f"WebSocket 에러: {e}")
-        await manager.disconnect(websocket)
+        await manager.disconnect(conn)
 
 # [API 2] 메시지 목록 조회 (최신 30개)
 @app.post("/messages")
-def get_messages(request: FetchMessagesRequest):
+async def get_messages(request: FetchMessagesRequest):
     nickname = request.nickname
     after = request.after
+    room = resolve_room(request.room)
 
     # 화이트리스트 체크
     if not is_nickname_allowed(nickname):
         print(f"[SECURITY_ALERT] 무단 메시지 조회 시도 - 닉네임: {nickname}")
         raise HTTPException(status_code=403, detail="등록되지 않은 닉네임입니다.")
 
+    if room is None:
+        raise HTTPException(status_code=400, detail="잘못된 방 이름입니다.")
+
+    # 저장소 대신 메모리의 최근 메시지 캐시에서 조회 (해당 방의 기록만)
+    await wait_for_storage()
+    ring = await history.get(room)
+
+    # after_seq가 있으면 해당 시퀀스 번호 이후의 메시지 조회 (after보다 우선)
+    if request.after_seq is not None:
+        return ring.after_seq(request.after_seq, HISTORY_PAGE_SIZE)
     # after 파라미터가 있으면 해당 시간 이후의 메시지만 조회
     if after:
         try:
-            # ISO 형식 문자열을 datetime으로 변환
-            after_dt = datetime.fromisoformat(after.replace('Z', '+00:00'))
-            # 시간순 정렬 (과거 -> 현재) 후 필터링
-            query = db.collection("messages").order_by("timestamp").where("timestamp", ">", after_dt).limit(30)
-            docs = query.get()
-        except Exception as e:
+            return ring.after(parse_timestamp(after), HISTORY_PAGE_SIZE)
+        except ValueError as e:
             print(f"타임스탬프 파싱 에러: {e}")
             # 에러 발생 시 최신 30개 반환
-            docs = db.collection("messages").order_by("timestamp").limit_to_last(30).get()
-    else:
-        # after 파라미터가 없으면 최신 30개 반환
-        docs = db.collection("messages").order_by("timestamp").limit_to_last(30).get()
-    
-    results = []
-    for doc in docs:
-        data = doc.to_dict()
-        # 문서 ID 추가 (중복 방지용)
-        data['id'] = doc.id
-        # datetime 객체를 ISO 형식 문자열로 변환
-        if isinstance(data.get('timestamp'), datetime):
-            data['timestamp'] = data['timestamp'].isoformat()
-        else:
-            data['timestamp'] = str(data.get('timestamp', ''))
-        results.append(data)
-    
-    return results
 
-# 서버 실행
-# ...
+    # after 파라미터가 없으면 최신 30개 반환
+    return ring.latest(HISTORY_PAGE_SIZE)
+
+# [API 5] 과거 메시지 페이지 조회 (before 이전의 메시지, 과거 -> 현재 순)
+# 최근 메시지 캐시 -> 저장소 -> 보관소 순서로 이어서 읽음 (각각 앞의 것보다 오래된 메시지만 가지고 있음)
+# 응답의 next_before를 다음 요청의 before로 보내면 이어지는 이전 페이지를 받음 (null이면 더 이상 없음)
+@app.post("/history")
+async def get_history(request: HistoryRequest):
+    if not is_nickname_allowed(request.nickname):
+        print(f"[SECURITY_ALERT] 무단 기록 조회 시도 - 닉네임: {request.nickname}")
+        raise HTTPException(status_code=403, detail="등록되지 않은 닉네임입니다.")
+
+    room = resolve_room(request.room)
+    if room is None:
+        raise HTTPException(status_code=400, detail="잘못된 방 이름입니다.")
+    try:
+        before = parse_timestamp(request.before) if request.before else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="잘못된 before 시각입니다.")
+    limit = min(max(request.limit, 1), HISTORY_MAX_PAGE_SIZE)
+
+    await wait_for_storage()
+    ring = await history.get(room)
+    cursor = before or datetime.now(timezone.utc) + timedelta(days=1)
+    messages = ring.before(cursor, limit)
+    seen = {m.get("id") for m in messages}
+    oldest = ring.oldest_timestamp()
+    if messages:
+        cursor = min(cursor, parse_timestamp(messages[0]["timestamp"]))
+    elif oldest is not None:
+        cursor = min(cursor, oldest)
+
+    sources = [("read", lambda ts, n: [record_to_message(r) for r in store.before(room, ts, n)])]
+    if archive is not None:
+        sources.append(("archive_read", lambda ts, n: archive.before(room, ts, n)))
+    for op, read in sources:
+        if len(messages) >= limit:
+            break
+        try:
+            with STORE_SECONDS.time(op=op):
+                older = await asyncio.to_thread(read, cursor, limit - len(messages))
+        except Exception as e:
+            STORE_ERRORS_TOTAL.inc(op=op)
+            print(f"과거 메시지 조회 실패 ({room}): {e}")
+            raise HTTPException(status_code=503, detail="과거 메시지를 불러오지 못했습니다.")
+        older = [m for m in older if m.get("id") not in seen]
+        seen.update(m.get("id") for m in older)
+        messages[:0] = older
+        if older:
+            cursor = min(cursor, parse_timestamp(older[0]["timestamp"]))
+
+    has_more = len(messages) >= limit
+    return {
+        "room": room,
+        "messages": messages,
+        "has_more": has_more,
+        "next_before": messages[0]["timestamp"] if has_more else None,
+    }
+
+# [API 3] 방의 현재 접속자 목록
+@app.post("/roster")
+async def get_roster(request: RosterRequest):
+    if not is_nickname_allowed(request.nickname):
+        print(f"[SECURITY_ALERT] 무단 접속자 목록 조회 시도 - 닉네임: {request.nickname}")
+        raise HTTPException(status_code=403, detail="등록되지 않은 닉네임입니다.")
+
+    room = resolve_room(request.room)
+    if room is None:
+        raise HTTPException(status_code=400, detail="잘못된 방 이름입니다.")
+
+    nicknames = manager.presence.roster(room)
+    return {"room": room, "nicknames": nicknames, "count": len(nicknames)}
+
+# [API 4] 메시지 검색 (닉네임/본문, 점수 순)
+@app.post("/search")
+async def search_messages(request: SearchRequest):
+    if not is_nickname_allowed(request.nickname):
+        print(f"[SECURITY_ALERT] 무단 검색 시도 - 닉네임: {request.nickname}")
+        raise HTTPException(status_code=403, detail="등록되지 않은 닉네임입니다.")
+
+    room = resolve_room(request.room)
+    if room is None:
+        raise HTTPException(status_code=400, detail="잘못된 방 이름입니다.")
+
+    query = request.query.strip()
+    if not query or len(query) > SEARCH_MAX_QUERY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"검색어는 1~{SEARCH_MAX_QUERY_LENGTH}자여야 합니다.")
+    offset = max(request.offset, 0)
+    limit = min(max(request.limit, 1), SEARCH_MAX_PAGE_SIZE)
+
+    await wait_for_storage()
+    await ensure_search_index(room)
+    with SEARCH_SECONDS.time():
+        total, results = search_index.search(room, query, offset, limit)
+    return {"room": room, "query": query, "total": total, "offset": offset, "limit": limit, "results": results}
+
+# [운영] 준비 상태 확인 (저장소를 조회하지 않음, 저장소 워밍업이 끝나야 준비 완료)
+@app.get("/healthz")
+async def healthz():
+    if not app_ready:
+        raise HTTPException(status_code=503, detail="not ready" if store_ready.is_set() else "storage warming up")
+    return {"status": "ok", "connections": len(manager.active_connections)}
+
+# [운영] 이벤트 루프 모니터 결과 (지연 통계, 단계별 시간, 최근 멈춤/느린 단계와 스택)
+@app.get("/admin/loop")
+async def admin_loop(token: Optional[str] = Header(None, alias="x-admin-token")):
+    # 토큰을 설정하지 않은 서버에서는 관리자 엔드포인트를 열지 않음 (스택에 내부 코드 경로가 드러나므로)
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="관리자 토큰이 필요합니다.")
+    if not loop_monitor.enabled:
+        raise HTTPException(status_code=404, detail="이벤트 루프 모니터가 꺼져 있습니다 (CHAT_LOOPMON=1).")
+    return loop_monitor.snapshot()
+
+# [운영] Prometheus 메트릭
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 # 서버 실행
 # Render에서는 PORT 환경 변수를 사용
+# WEB_CONCURRENCY로 워커 프로세스 수를 지정 (2 이상이면 BACKPLANE=unix 필요)
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        if BACKPLANE == "local":
+            print("경고: BACKPLANE=local에서는 워커 간 메시지가 전달되지 않습니다. BACKPLANE=unix를 설정하세요.")
+        uvicorn.run("server:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        ChatServer(uvicorn.Config(app, host="0.0.0.0", port=port)).run()
\ No newline at end of file
@@ -0,0 +1,394 @@
+# 메시지 저장소
+# 서버는 MessageStore 인터페이스만 사용하고, 실제 엔진은 환경 변수 CHAT_STORE로 선택
+#   firestore - Firebase Firestore (기본값)
+#   sqlite    - 로컬 SQLite 파일 (WAL 모드, 단일 노드 배포용)
+#   memory    - 프로세스 메모리 (테스트/벤치마크용, 재시작하면 사라짐)
+#
+# 모든 메서드는 동기 함수이며, 서버는 이벤트 루프를 막지 않도록 별도 스레드에서 호출
+# 메시지 레코드 형식: {"id", "nickname", "content", "timestamp" (UTC datetime), "seq"}
+import bisect
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class MessageStore(ABC):
+    """메시지 저장소 인터페이스"""
+    name = "base"
+
+    def new_id(self) -> str:
+        """새 메시지 ID 생성 (저장소 왕복 없이 로컬에서 생성)"""
+        return uuid.uuid4().hex[:20]
+
+    @abstractmethod
+    def add_many(self, items: list):
+        """(방, 메시지 ID, 레코드) 목록을 한 번에 저장"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def recent(self, room: str, limit: int) -> list:
+        """방의 최근 메시지 최대 limit개 (과거 -> 현재 순)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def oldest(self, room: str, limit: int) -> list:
+        """방의 가장 오래된 메시지 최대 limit개 (과거 -> 현재 순)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def before(self, room: str, timestamp: datetime, limit: int) -> list:
+        """timestamp 이전 메시지 중 가장 최근 것 최대 limit개 (과거 -> 현재 순)"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def count(self, room: str) -> int:
+        """방에 저장된 메시지 수"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, room: str, ids: list) -> int:
+        """방에서 지정한 ID의 메시지를 삭제하고 삭제한 수 반환"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_oldest(self, room: str, num_to_delete: int) -> list:
+        """방의 가장 오래된 메시지부터 최대 num_to_delete개 삭제하고 삭제한 메시지 ID 목록 반환"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# --- Firestore ---
+
+def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    # 1. Render Secret Files에서 로드 시도 (우선순위 1)
+    firebase_key_path = os.getenv("FIREBASE_KEY_PATH", "/etc/secrets/firebase-key.json")
+    if os.path.exists(firebase_key_path):
+        cred = credentials.Certificate(firebase_key_path)
+        firebase_admin.initialize_app(cred)
+        print(f"Firebase 초기화 완료 (Secret Files에서 로드: {firebase_key_path})")
+        return
+
+    # 2. 환경 변수에서 JSON 문자열로 로드 시도 (우선순위 2)
+    firebase_key_json = os.getenv("FIREBASE_KEY_JSON")
+    if firebase_key_json:
+        try:
+            key_dict = json.loads(firebase_key_json)
+            cred = credentials.Certificate(key_dict)
+            firebase_admin.initialize_app(cred)
+            print("Firebase 초기화 완료 (환경 변수에서 로드)")
+            return
+        except json.JSONDecodeError as e:
+            print(f"환경 변수 FIREBASE_KEY_JSON 파싱 실패: {e}")
+            raise
+
+    # 3. 로컬 개발 환경: 파일에서 로드 (우선순위 3)
+    if os.path.exists("secureKey.json"):
+        cred = credentials.Certificate("secureKey.json")
+        firebase_admin.initialize_app(cred)
+        print("Firebase 초기화 완료 (로컬 파일에서 로드)")
+        return
+
+    # 모든 방법 실패
+    raise FileNotFoundError(
+        "Firebase 키를 찾을 수 없습니다. 다음 중 하나를 설정하세요:\n"
+        "1. Render Secret Files: /etc/secrets/firebase-key.json\n"
+        "2. 환경 변수: FIREBASE_KEY_JSON (JSON 문자열)\n"
+        "3. 로컬 파일: secureKey.json"
+    )
+
+
+class FirestoreStore(MessageStore):
+    """Firestore 저장소 (기본 방은 "messages" 컬렉션, 다른 방은 rooms/{방 이름}/messages)"""
+    name = "firestore"
+    # Firestore 배치 한도
+    BATCH_LIMIT = 500
+
+    def __init__(self, default_room: str):
+        # firebase_admin은 무거우므로 Firestore 엔진을 사용할 때만 불러옴
+        from firebase_admin import firestore
+
+        init_firebase()
+        self.firestore = firestore
+        self.db = firestore.client()
+        self.default_room = default_room
+
+    def collection(self, room: str):
+        """방의 메시지가 저장된 Firestore 컬렉션"""
+        if room == self.default_room:
+            return self.db.collection("messages")
+        return self.db.collection("rooms").document(room).collection("messages")
+
+    def new_id(self) -> str:
+        # 문서 ID는 클라이언트 라이브러리가 로컬에서 생성 (네트워크 왕복 없음)
+        return self.db.collection("messages").document().id
+
+    def add_many(self, items: list):
+        for start in range(0, len(items), self.BATCH_LIMIT):
+            batch = self.db.batch()
+            for room, doc_id, record in items[start:start + self.BATCH_LIMIT]:
+                batch.set(self.collection(room).document(doc_id), record)
+            batch.commit()
+
+    def recent(self, room: str, limit: int) -> list:
+        return self._records(self.collection(room).order_by("timestamp").limit_to_last(limit).get())
+
+    def oldest(self, room: str, limit: int) -> list:
+        return self._records(self.collection(room).order_by("timestamp").limit(limit).get())
+
+    def before(self, room: str, timestamp: datetime, limit: int) -> list:
+        query = self.collection(room).where("timestamp", "<", timestamp).order_by("timestamp")
+        return self._records(query.limit_to_last(limit).get())
+
+    @staticmethod
+    def _records(docs) -> list:
+        records = []
+        for doc in docs:
+            record = doc.to_dict()
+            # 타임스탬프가 없는 문서는 정렬할 수 없으므로 제외
+            if not isinstance(record.get("timestamp"), datetime):
+                continue
+            record["id"] = doc.id
+            records.append(record)
+        return records
+
+    def count(self, room: str) -> int:
+        # 전체 문서를 읽지 않고 개수만 가져옴 (Aggregation Query)
+        count_snapshot = self.collection(room).count().get()
+        return count_snapshot[0][0].value
+
+    def delete_oldest(self, room: str, num_to_delete: int) -> list:
+        messages_ref = self.collection(room)
+        # 배치 한도(500)에 맞춰 페이지 단위로 오래된 순서대로 삭제
+        deleted = []
+        while len(deleted) < num_to_delete:
+            page_size = min(self.BATCH_LIMIT, num_to_delete - len(deleted))
+            docs = messages_ref.order_by("timestamp", direction=self.firestore.Query.ASCENDING).limit(page_size).get()
+            if not docs:
+                break
+            batch = self.db.batch()
+            for doc in docs:
+                batch.delete(doc.reference)
+            batch.commit()
+            deleted.extend(doc.id for doc in docs)
+        return deleted
+
+    def delete(self, room: str, ids: list) -> int:
+        messages_ref = self.collection(room)
+        for start in range(0, len(ids), self.BATCH_LIMIT):
+            batch = self.db.batch()
+            for doc_id in ids[start:start + self.BATCH_LIMIT]:
+                batch.delete(messages_ref.document(doc_id))
+            batch.commit()
+        return len(ids)
+
+
+# --- 메모리 ---
+
+class MemoryStore(MessageStore):
+    """프로세스 메모리 저장소 (테스트/벤치마크용)"""
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 방 이름: 시간순으로 정렬된 레코드 목록
+        self._rooms: dict[str, list] = {}
+
+    def add_many(self, items: list):
+        with self._lock:
+            for room, doc_id, record in items:
+                records = self._rooms.setdefault(room, [])
+                record = dict(record, id=doc_id)
+                # 대부분 시간순으로 들어오므로 끝에 추가, 아니면 정렬 위치에 삽입
+                if not records or records[-1]["timestamp"] <= record["timestamp"]:
+                    records.append(record)
+                else:
+                    bisect.insort(records, record, key=lambda r: r["timestamp"])
+
+    def recent(self, room: str, limit: int) -> list:
+        with self._lock:
+            records = self._rooms.get(room, [])
+            return [dict(r) for r in records[max(0, len(records) - limit):]]
+
+    def oldest(self, room: str, limit: int) -> list:
+        with self._lock:
+            return [dict(r) for r in self._rooms.get(room, [])[:limit]]
+
+    def before(self, room: str, timestamp: datetime, limit: int) -> list:
+        with self._lock:
+            records = self._rooms.get(room, [])
+            end = bisect.bisect_left(records, timestamp, key=lambda r: r["timestamp"])
+            return [dict(r) for r in records[max(0, end - limit):end]]
+
+    def count(self, room: str) -> int:
+        with self._lock:
+            return len(self._rooms.get(room, []))
+
+    def delete(self, room: str, ids: list) -> int:
+        targets = set(ids)
+        with self._lock:
+            records = self._rooms.get(room, [])
+            kept = [r for r in records if r["id"] not in targets]
+            self._rooms[room] = kept
+            return len(records) - len(kept)
+
+    def delete_oldest(self, room: str, num_to_delete: int) -> list:
+        with self._lock:
+            records = self._rooms.get(room, [])
+            deleted = [r["id"] for r in records[:num_to_delete]]
+            del records[:len(deleted)]
+            return deleted
+
+
+# --- SQLite ---
+
+class SQLiteStore(MessageStore):
+    """로컬 SQLite 저장소 (WAL 모드, 방+시간 인덱스)"""
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # 서버는 여러 작업 스레드에서 호출하므로 스레드 검사를 끄고 잠금으로 직렬화
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # timestamp는 UTC 기준 마이크로초 정수로 저장 (정렬/비교가 정확하도록)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id TEXT PRIMARY KEY,"
+            " room TEXT NOT NULL,"
+            " nickname TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " timestamp INTEGER NOT NULL,"
+            " seq INTEGER)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_room_timestamp ON messages (room, timestamp)")
+        print(f"SQLite 저장소 사용: {path}")
+
+    @staticmethod
+    def _to_micros(timestamp: datetime) -> int:
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=timezone.utc)
+        delta = timestamp - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+    @staticmethod
+    def _from_micros(micros: int) -> datetime:
+        seconds, micro = divmod(micros, 1_000_000)
+        return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(microsecond=micro)
+
+    def add_many(self, items: list):
+        rows = [
+            (doc_id, room, record["nickname"], record["content"], self._to_micros(record["timestamp"]), record.get("seq"))
+            for room, doc_id, record in items
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO messages (id, room, nickname, content, timestamp, seq) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def recent(self, room: str, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, nickname, content, timestamp, seq FROM messages WHERE room = ? ORDER BY timestamp DESC LIMIT ?",
+                (room, limit),
+            ).fetchall()
+        return self._records(reversed(rows))
+
+    def oldest(self, room: str, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, nickname, content, timestamp, seq FROM messages WHERE room = ? ORDER BY timestamp LIMIT ?",
+                (room, limit),
+            ).fetchall()
+        return self._records(rows)
+
+    def before(self, room: str, timestamp: datetime, limit: int) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, nickname, content, timestamp, seq FROM messages WHERE room = ? AND timestamp < ?"
+                " ORDER BY timestamp DESC LIMIT ?",
+                (room, self._to_micros(timestamp), limit),
+            ).fetchall()
+        return self._records(reversed(rows))
+
+    def _records(self, rows) -> list:
+        records = []
+        for doc_id, nickname, content, timestamp, seq in rows:
+            record = {"id": doc_id, "nickname": nickname, "content": content, "timestamp": self._from_micros(timestamp)}
+            if seq is not None:
+                record["seq"] = seq
+            records.append(record)
+        return records
+
+    def count(self, room: str) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages WHERE room = ?", (room,)).fetchone()[0]
+
+    def delete_oldest(self, room: str, num_to_delete: int) -> list:
+        with self._lock:
+            # 삭제할 ID를 먼저 읽고 같은 트랜잭션에서 삭제 (다른 프로세스가 그사이 지우거나 추가해도 목록이 정확하도록)
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                deleted = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM messages WHERE room = ? ORDER BY timestamp LIMIT ?",
+                    (room, num_to_delete),
+                )]
+                for start in range(0, len(deleted), 500):
+                    chunk = deleted[start:start + 500]
+                    self._conn.execute(f"DELETE FROM messages WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return deleted
+
+    def delete(self, room: str, ids: list) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                deleted = 0
+                for start in range(0, len(ids), 500):
+                    chunk = ids[start:start + 500]
+                    cursor = self._conn.execute(
+                        f"DELETE FROM messages WHERE room = ? AND id IN ({','.join('?' * len(chunk))})",
+                        (room, *chunk),
+                    )
+                    deleted += cursor.rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_store(kind: str, default_room: str, sqlite_path: Optional[str] = None) -> MessageStore:
+    """설정 값에 맞는 저장소 생성"""
+    if kind == "firestore":
+        return FirestoreStore(default_room)
+    if kind == "sqlite":
+        return SQLiteStore(sqlite_path or "chat.db")
+    if kind == "memory":
+        return MemoryStore()
+    raise ValueError(f"지원하지 않는 CHAT_STORE 값입니다: {kind} (firestore, sqlite, memory 중 하나)")
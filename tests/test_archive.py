@@ -0,0 +1,89 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from archive import SEGMENT_SUFFIX, MessageArchive
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def message(i: int) -> dict:
+    return {"id": f"m{i}", "seq": i, "nickname": "a", "content": f"hello {i}",
+            "timestamp": (BASE + timedelta(seconds=i)).isoformat()}
+
+
+def ids(messages: list) -> list:
+    return [int(m["id"][1:]) for m in messages]
+
+
+def read_all(archive: MessageArchive, room: str, page: int) -> list:
+    """가장 최근부터 before로 페이지를 넘기며 모두 읽음 (과거 -> 현재 순)"""
+    results, cursor = [], None
+    while True:
+        messages = archive.before(room, cursor, page)
+        if not messages:
+            return results
+        results[:0] = messages
+        cursor = datetime.fromisoformat(messages[0]["timestamp"])
+
+
+def test_append_before_round_trip(tmp_path):
+    archive = MessageArchive(str(tmp_path), block_messages=16)
+    assert archive.append("main", [message(i) for i in range(100)]) == 100
+
+    assert archive.count("main") == 100
+    assert ids(archive.before("main", None, 5)) == [95, 96, 97, 98, 99]
+    assert ids(archive.before("main", BASE + timedelta(seconds=40), 3)) == [37, 38, 39]
+    assert ids(read_all(archive, "main", 7)) == list(range(100))
+    # 다른 인스턴스(다른 워커)도 파일에서 같은 내용을 읽음
+    assert ids(read_all(MessageArchive(str(tmp_path)), "main", 30)) == list(range(100))
+
+
+def test_append_skips_messages_already_archived(tmp_path):
+    archive = MessageArchive(str(tmp_path), block_messages=16)
+    archive.append("main", [message(i) for i in range(50)])
+
+    assert archive.append("main", [message(i) for i in range(40, 60)]) == 10
+    assert archive.append("main", [message(i) for i in range(60)]) == 0
+    assert ids(read_all(archive, "main", 25)) == list(range(60))
+
+
+def test_append_keeps_late_messages(tmp_path):
+    archive = MessageArchive(str(tmp_path), block_messages=16)
+    late = {5, 33, 34, 70}
+    archive.append("main", [message(i) for i in range(80) if i not in late])
+
+    # 이미 보관된 메시지보다 이른 시각의 메시지도 보관되고 시각 순으로 조회됨
+    assert archive.append("main", [message(i) for i in sorted(late)]) == len(late)
+    assert archive.count("main") == 80
+    assert ids(read_all(archive, "main", 9)) == list(range(80))
+    assert ids(archive.before("main", BASE + timedelta(seconds=36), 4)) == [32, 33, 34, 35]
+    assert archive.append("main", [message(i) for i in sorted(late)]) == 0
+
+
+def test_truncated_trailing_block_is_ignored(tmp_path):
+    archive = MessageArchive(str(tmp_path), block_messages=10)
+    archive.append("main", [message(i) for i in range(20)])
+    archive.append("main", [message(i) for i in range(20, 25)])
+    archive.close()
+
+    # 마지막 블록을 쓰는 도중에 종료된 상황
+    segment = tmp_path / "main" / f"000001{SEGMENT_SUFFIX}"
+    os.truncate(segment, segment.stat().st_size - 3)
+
+    reopened = MessageArchive(str(tmp_path), block_messages=10)
+    assert reopened.count("main") == 20
+    assert ids(reopened.before("main", None, 50)) == list(range(20))
+
+    # 잘린 블록의 메시지는 다시 보관되며 새 세그먼트 파일에 씀
+    assert reopened.append("main", [message(i) for i in range(15, 30)]) == 10
+    assert sorted(os.listdir(tmp_path / "main")) == [".lock", f"000001{SEGMENT_SUFFIX}", f"000002{SEGMENT_SUFFIX}"]
+    assert ids(read_all(reopened, "main", 8)) == list(range(30))
+
+
+def test_read_does_not_create_room(tmp_path):
+    archive = MessageArchive(str(tmp_path / "archive"))
+
+    assert archive.before("missing", None, 10) == []
+    assert archive.count("missing") == 0
+    assert not (tmp_path / "archive").exists()
+    assert archive.rooms == {}
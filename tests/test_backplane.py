@@ -0,0 +1,38 @@
+import threading
+
+from backplane import InProcessBackplane, UnixSocketBackplane
+
+
+def test_in_process_backplane_has_no_shared_sequence():
+    assert InProcessBackplane().next_sequence("main", 5) is None
+
+
+def test_shared_sequence_is_unique_across_workers(tmp_path):
+    workers = [UnixSocketBackplane(str(tmp_path)) for _ in range(2)]
+    allocated = []
+    lock = threading.Lock()
+
+    def allocate(backplane):
+        for _ in range(200):
+            seq, timestamp = backplane.next_sequence("main", 0)
+            with lock:
+                allocated.append((seq, timestamp))
+
+    threads = [threading.Thread(target=allocate, args=(w,)) for w in workers for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    seqs = sorted(seq for seq, _ in allocated)
+    assert seqs == list(range(1, 801))
+    # 번호 순서와 수신 시각 순서가 같음
+    by_seq = [timestamp for _, timestamp in sorted(allocated)]
+    assert by_seq == sorted(by_seq)
+
+
+def test_shared_sequence_respects_floor(tmp_path):
+    backplane = UnixSocketBackplane(str(tmp_path))
+    assert backplane.next_sequence("main", 41)[0] == 42
+    assert backplane.next_sequence("main", 0)[0] == 43
+    assert backplane.next_sequence("other", 0)[0] == 1
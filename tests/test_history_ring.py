@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+
+import server
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def at(seconds: float) -> datetime:
+    return BASE + timedelta(seconds=seconds)
+
+
+def message(seq: int) -> dict:
+    return {"id": f"m{seq}", "seq": seq, "timestamp": at(seq).isoformat()}
+
+
+def seqs(messages: list) -> list:
+    return [m["seq"] for m in messages]
+
+
+def filled(capacity: int, count: int) -> server.MessageRing:
+    ring = server.MessageRing(capacity)
+    for seq in range(1, count + 1):
+        ring.append(at(seq), message(seq))
+    return ring
+
+
+def test_catchup_returns_missed_messages():
+    ring = filled(10, 6)
+
+    frame = ring.catchup(3)
+    assert seqs(frame["messages"]) == [4, 5, 6]
+    assert frame["last_seq"] == 6
+    assert not frame["truncated"]
+    assert ring.catchup(6)["messages"] == []
+    assert seqs(ring.catchup(0)["messages"]) == [1, 2, 3, 4, 5, 6]
+
+
+def test_catchup_marks_truncated_when_buffer_or_limit_is_exceeded():
+    ring = filled(5, 12)
+
+    frame = ring.catchup(2)
+    assert seqs(frame["messages"]) == [8, 9, 10, 11, 12]
+    assert frame["truncated"]
+    frame = ring.catchup(8, limit=2)
+    assert seqs(frame["messages"]) == [11, 12]
+    assert frame["truncated"]
+
+
+def test_next_seq_continues_after_remote_messages():
+    ring = filled(5, 3)
+    ring.append(at(10), message(10))
+
+    assert ring.next_seq() == 11
+
+
+def test_late_message_is_inserted_in_seq_order():
+    ring = server.MessageRing(10)
+    for seq in (1, 2, 4, 5):
+        ring.append(at(seq), message(seq))
+    # 다른 워커가 먼저 번호를 받았지만 늦게 도착한 메시지
+    ring.append(at(3), message(3))
+
+    assert seqs(ring.latest(10)) == [1, 2, 3, 4, 5]
+    assert seqs(ring.catchup(2)["messages"]) == [3, 4, 5]
+    assert seqs(ring.before(at(4), 10)) == [1, 2, 3]
+    assert seqs(ring.after(at(2), 10)) == [3, 4, 5]
+
+
+def test_late_message_sort_key_is_clamped_between_neighbours():
+    ring = server.MessageRing(10)
+    for seq in (1, 2, 4):
+        ring.append(at(seq), message(seq))
+    # 시각이 뒤 메시지보다 늦어도 시퀀스 순서 위치에 두고 정렬 키는 뒤 메시지 시각으로 맞춤
+    ring.append(at(9), message(3))
+
+    assert seqs(ring.latest(10)) == [1, 2, 3, 4]
+    assert seqs(ring.before(at(4), 10)) == [1, 2]
+    assert seqs(ring.after(at(2), 10)) == [3, 4]
+
+
+def test_late_message_older_than_full_buffer_is_dropped():
+    ring = filled(3, 5)
+    ring.append(at(1), {"id": "old", "seq": 2, "timestamp": at(1).isoformat()})
+
+    assert seqs(ring.latest(3)) == [3, 4, 5]
+
+
+def test_sort_keys_stay_monotonic_when_clock_goes_back():
+    ring = filled(5, 3)
+    ring.append(at(1), message(4))
+
+    assert seqs(ring.after(at(2), 10)) == [3, 4]
+    assert seqs(ring.before(at(3), 10)) == [1, 2]
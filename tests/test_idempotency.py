@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import server
+
+
+def test_same_key_publishes_once():
+    calls = []
+
+    async def publish():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": "m1", "seq": 1}
+
+    async def run():
+        cache = server.IdempotencyCache(ttl=60, max_keys=10)
+        # 첫 요청이 게시 중일 때 온 재전송은 같은 결과를 기다림
+        first, second = await asyncio.gather(cache.run(("a", "main", "c1"), publish),
+                                             cache.run(("a", "main", "c1"), publish))
+        third = await cache.run(("a", "main", "c1"), publish)
+        return cache, first, second, third
+
+    cache, first, second, third = asyncio.run(run())
+    assert len(calls) == 1
+    assert first == ({"id": "m1", "seq": 1}, False)
+    assert second == third == ({"id": "m1", "seq": 1}, True)
+    assert cache.seen(("a", "main", "c1"))
+    assert not cache.seen(("b", "main", "c1"))
+
+
+def test_failed_publish_forgets_key():
+    attempts = []
+
+    async def publish():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("store down")
+        return {"id": "m1"}
+
+    async def run():
+        cache = server.IdempotencyCache(ttl=60, max_keys=10)
+        with pytest.raises(RuntimeError):
+            await cache.run(("a", "main", "c1"), publish)
+        assert not cache.seen(("a", "main", "c1"))
+        return await cache.run(("a", "main", "c1"), publish)
+
+    assert asyncio.run(run()) == ({"id": "m1"}, False)
+    assert len(attempts) == 2
+
+
+def test_keys_expire_by_ttl_and_count(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+
+    async def publish():
+        return {}
+
+    async def run():
+        cache = server.IdempotencyCache(ttl=10, max_keys=2)
+        await cache.run(("k", 1), publish)
+        now[0] += 11
+        assert not cache.seen(("k", 1))
+        _, duplicate = await cache.run(("k", 1), publish)
+        assert not duplicate
+        await cache.run(("k", 2), publish)
+        await cache.run(("k", 3), publish)
+        return cache
+
+    cache = asyncio.run(run())
+    assert len(cache) == 2
+    assert not cache.seen(("k", 1))
+    assert cache.seen(("k", 3))
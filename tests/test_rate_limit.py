@@ -0,0 +1,57 @@
+import pytest
+
+import server
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_burst_and_refill(clock):
+    bucket = server.TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        assert bucket.retry_after(clock[0]) == 0
+        bucket.take()
+
+    assert bucket.retry_after(clock[0]) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert bucket.retry_after(clock[0]) == 0
+    # 오래 쉬어도 burst 이상 쌓이지 않음
+    clock[0] += 100
+    assert bucket.retry_after(clock[0]) == 0
+    assert bucket.tokens == 3
+    assert bucket.is_full(clock[0])
+
+
+def test_check_rate_limit_does_not_spend_tokens_when_blocked(clock, monkeypatch):
+    monkeypatch.setattr(server, "nickname_limiter", server.RateLimiter(rate=1, burst=2))
+    conn = server.Connection(None, "a", "main", None, 1)
+    conn.bucket = server.TokenBucket(rate=1, burst=5)
+
+    assert server.check_rate_limit("a", conn) == 0
+    assert server.check_rate_limit("a", conn) == 0
+    # 닉네임 버킷이 막히면 연결 버킷의 토큰도 쓰지 않음
+    assert server.check_rate_limit("a", conn) == pytest.approx(1.0)
+    assert conn.bucket.tokens == 3
+    # 같은 닉네임의 다른 연결도 막힘
+    assert server.check_rate_limit("a", server.Connection(None, "a", "main", None, 1)) > 0
+    assert server.check_rate_limit("b", conn) == 0
+
+
+def test_rate_limiter_disabled_and_sweeps_full_buckets(clock):
+    assert server.RateLimiter(rate=0, burst=5).bucket("a") is None
+
+    limiter = server.RateLimiter(rate=1, burst=2)
+    limiter.bucket("idle")
+    limiter.bucket("busy").take()
+    clock[0] += limiter.SWEEP_INTERVAL - 0.5
+    limiter.bucket("busy").retry_after(clock[0])
+    limiter.bucket("busy").take()
+    limiter.bucket("busy").take()
+    clock[0] += 1
+    limiter.bucket("other")
+
+    assert set(limiter.buckets) == {"busy", "other"}
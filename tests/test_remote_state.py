@@ -0,0 +1,32 @@
+from remote_state import RemoteState
+
+
+def test_apply_merges_other_origins_and_ignores_own():
+    state = RemoteState("me", ttl=10)
+
+    assert state.apply("main", {"origin": "me", "nicknames": ["a"]}) is None
+    assert state.apply("main", {"origin": "w1", "nicknames": "a"}) is None
+    assert state.apply("main", {"origin": "w1", "nicknames": ["a", "b", 3]}) == (frozenset(), frozenset({"a", "b"}))
+    assert state.apply("main", {"origin": "w2", "nicknames": ["b", "c"]}) == (frozenset(), frozenset({"b", "c"}))
+    assert state.nicknames("main") == {"a", "b", "c"}
+
+    # 빈 목록은 그 프로세스의 상태를 지움
+    assert state.apply("main", {"origin": "w1", "nicknames": []}) == (frozenset({"a", "b"}), frozenset())
+    assert state.nicknames("main") == {"b", "c"}
+    state.apply("main", {"origin": "w2", "nicknames": []})
+    assert state.rooms == {}
+
+
+def test_expire_drops_origins_that_stopped_reporting(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("remote_state.time.monotonic", lambda: now[0])
+    state = RemoteState("me", ttl=10)
+    state.apply("main", {"origin": "w1", "nicknames": ["a"]})
+    now[0] = 105.0
+    state.apply("main", {"origin": "w2", "nicknames": ["b"]})
+
+    assert state.expire(109.0) == []
+    assert state.expire(110.0) == [("main", frozenset({"a"}))]
+    assert state.nicknames("main") == {"b"}
+    assert state.expire(115.0) == [("main", frozenset({"b"}))]
+    assert state.rooms == {}
@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from archive import MessageArchive
+from search_index import SearchIndex
+from storage import MemoryStore
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def record(i: int) -> dict:
+    return {"nickname": "a", "content": f"hello {i}", "timestamp": BASE + timedelta(seconds=i), "seq": i}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = MemoryStore()
+    store.add_many([("main", f"m{i}", record(i)) for i in range(10)])
+    index = SearchIndex()
+    # 색인에는 아직 저장되지 않은 최신 메시지도 있음
+    index.build("main", [server.record_to_message(dict(record(i), id=f"m{i}")) for i in range(12)])
+    monkeypatch.setattr(server, "store", store)
+    monkeypatch.setattr(server, "search_index", index)
+    monkeypatch.setattr(server, "archive", None)
+    return store
+
+
+def trim(scheduler: server.RetentionScheduler):
+    asyncio.run(scheduler.trim())
+
+
+def found(query: str) -> list:
+    return sorted(m["id"] for m in server.search_index.search("main", query, limit=50)[1])
+
+
+def test_trim_deletes_oldest_beyond_keep(store):
+    scheduler = server.RetentionScheduler(keep=4, high_water=6)
+    scheduler.counts["main"] = None
+    trim(scheduler)
+
+    assert [r["id"] for r in store.recent("main", 10)] == ["m6", "m7", "m8", "m9"]
+    assert scheduler.counts["main"] == 4
+    # 삭제된 메시지만 색인에서 빠지고 저장 대기 중인 메시지는 남음
+    assert found("hello") == ["m10", "m11", "m6", "m7", "m8", "m9"]
+
+
+def test_trim_leaves_rooms_under_keep(store):
+    scheduler = server.RetentionScheduler(keep=20, high_water=30)
+    scheduler.counts["main"] = None
+    trim(scheduler)
+
+    assert store.count("main") == 10
+    assert scheduler.counts["main"] == 10
+
+
+def test_note_added_tracks_count_and_wakes_over_high_water(store):
+    scheduler = server.RetentionScheduler(keep=4, high_water=6)
+    scheduler.counts["main"] = 5
+    scheduler.note_added("main")
+    assert not scheduler._wakeup.is_set()
+    scheduler.note_added("main", 2)
+    assert scheduler._wakeup.is_set()
+    assert scheduler.counts["main"] == 8
+
+
+def test_trim_moves_messages_to_archive(store, monkeypatch, tmp_path):
+    archive = MessageArchive(str(tmp_path))
+    monkeypatch.setattr(server, "archive", archive)
+    scheduler = server.RetentionScheduler(keep=4, high_water=6)
+    scheduler.counts["main"] = 10
+    trim(scheduler)
+
+    assert store.count("main") == 4
+    assert [m["id"] for m in archive.before("main", None, 10)] == [f"m{i}" for i in range(6)]
+    # 보관소로 옮긴 메시지는 계속 검색됨
+    assert len(found("hello")) == 12
+
+
+def test_failed_trim_keeps_count(store, monkeypatch):
+    def fail(room, n):
+        raise RuntimeError("store down")
+
+    monkeypatch.setattr(store, "delete_oldest", fail)
+    scheduler = server.RetentionScheduler(keep=4, high_water=6)
+    scheduler.counts["main"] = 10
+    trim(scheduler)
+
+    assert scheduler.counts["main"] == 10
+    assert store.count("main") == 10
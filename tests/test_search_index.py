@@ -0,0 +1,75 @@
+from search_index import SearchIndex
+
+
+def message(i: int, content: str, nickname: str = "a") -> dict:
+    return {"id": f"m{i}", "seq": i, "nickname": nickname, "content": content}
+
+
+def found(index: SearchIndex, room: str, query: str) -> list:
+    return [m["id"] for m in index.search(room, query)[1]]
+
+
+def test_add_and_search():
+    index = SearchIndex()
+    index.build("main", [message(1, "오늘 점심 뭐 먹지"), message(2, "점심은 김밥"), message(3, "저녁 약속")])
+    index.add("main", message(4, "Lunch 점심시간", nickname="bob"))
+
+    assert sorted(found(index, "main", "점심")) == ["m1", "m2", "m4"]
+    assert found(index, "main", "김밥 점심") == ["m2"]
+    # 대소문자 무시, 닉네임도 검색
+    assert found(index, "main", "lunch") == ["m4"]
+    assert found(index, "main", "BOB") == ["m4"]
+    # n-gram은 있지만 단어가 실제로 들어 있지 않은 메시지는 제외
+    assert found(index, "main", "심점") == []
+    # 색인하지 않는 방은 빈 결과
+    assert index.search("other", "점심") == (0, [])
+
+
+def test_search_ties_prefer_recent_and_paginate():
+    index = SearchIndex()
+    index.build("main", [message(i, "hello") for i in range(5)])
+
+    total, results = index.search("main", "hello", offset=1, limit=2)
+    assert total == 5
+    assert [m["id"] for m in results] == ["m3", "m2"]
+
+
+def test_add_ignores_duplicates_and_unknown_rooms():
+    index = SearchIndex()
+    index.build("main", [message(1, "hello")])
+    index.add("main", message(1, "hello again"))
+    index.add("other", message(2, "hello"))
+
+    assert index.size("main") == 1
+    assert not index.has_room("other")
+
+
+def test_trim_keeps_most_recent():
+    index = SearchIndex(max_docs_per_room=3)
+    index.build("main", [message(i, f"hello {i}") for i in range(5)])
+
+    assert index.size("main") == 3
+    assert sorted(found(index, "main", "hello")) == ["m2", "m3", "m4"]
+    index.trim("main", 1)
+    assert found(index, "main", "hello") == ["m4"]
+    assert found(index, "main", "2") == []
+
+
+def test_remove_drops_only_given_ids():
+    index = SearchIndex()
+    index.build("main", [message(i, f"hello {i}") for i in range(5)])
+
+    index.remove("main", ["m0", "m3", "missing"])
+    assert sorted(found(index, "main", "hello")) == ["m1", "m2", "m4"]
+    assert found(index, "main", "3") == []
+    # 제거한 메시지만 남긴 n-gram은 색인에서도 사라짐
+    assert "3" not in index.rooms["main"].postings
+
+
+def test_evict_skips_rooms_in_use():
+    index = SearchIndex(max_rooms=2)
+    for room in ("main", "a", "b", "c"):
+        index.build(room, [message(1, "hello")])
+
+    index.evict(lambda room: room == "main")
+    assert list(index.rooms) == ["main", "c"]
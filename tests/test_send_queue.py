@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import server
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = None
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = (code, reason)
+
+
+def join(manager: server.ConnectionManager, room: str = "main") -> server.Connection:
+    conn = server.Connection(FakeWebSocket(), "a", room, None, manager.queue_size)
+    manager.active_connections[conn.websocket] = conn
+    manager.rooms.setdefault(room, set()).add(conn)
+    return conn
+
+
+def queued(conn: server.Connection) -> list:
+    return [json.loads(frame)["n"] for frame, _ in list(conn.queue._queue)]
+
+
+def test_drop_oldest_keeps_newest_frames():
+    async def run():
+        manager = server.ConnectionManager(queue_size=3, policy="drop_oldest")
+        conn = join(manager)
+        for n in range(5):
+            manager.deliver_local("main", {"n": n})
+        return manager, conn
+
+    manager, conn = asyncio.run(run())
+    assert queued(conn) == [2, 3, 4]
+    assert conn.dropped == 2
+    assert conn in manager.rooms["main"]
+
+
+def test_drop_client_removes_connection():
+    async def run():
+        manager = server.ConnectionManager(queue_size=2, policy="drop_client")
+        slow, fast = join(manager), join(manager)
+        for n in range(2):
+            manager.deliver_local("main", {"n": n})
+        fast.queue.get_nowait()
+        manager.deliver_local("main", {"n": 2})
+        await asyncio.sleep(0)
+        return manager, slow, fast
+
+    manager, slow, fast = asyncio.run(run())
+    # 느린 연결만 정리되고 다른 연결은 계속 받음
+    assert manager.rooms["main"] == {fast}
+    assert slow.websocket not in manager.active_connections
+    assert slow.websocket.closed == (1000, "")
+    assert queued(fast) == [1, 2]
+
+
+def test_close_policy_uses_try_again_later():
+    async def run():
+        manager = server.ConnectionManager(queue_size=1, policy="close")
+        conn = join(manager)
+        manager.deliver_local("main", {"n": 0})
+        manager.deliver_local("main", {"n": 1})
+        await asyncio.sleep(0)
+        return manager, conn
+
+    manager, conn = asyncio.run(run())
+    assert "main" not in manager.rooms
+    assert conn.websocket.closed == (1013, "Send queue overflow")
+    assert conn.dropped == 1
+
+
+def test_broadcast_encodes_once_per_codec():
+    async def run():
+        manager = server.ConnectionManager(queue_size=4)
+        first, second = join(manager), join(manager)
+        manager.deliver_local("main", {"n": 1})
+        manager.deliver_local("other", {"n": 2})
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert queued(first) == queued(second) == [1]
+    assert first.queue._queue[0][0] is second.queue._queue[0][0]
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from storage import MemoryStore, SQLiteStore
+
+BASE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    store = MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "chat.db"))
+    yield store
+    store.close()
+
+
+def record(i: int) -> dict:
+    return {"nickname": "a", "content": f"hello {i}", "timestamp": BASE + timedelta(seconds=i), "seq": i}
+
+
+def ids(records: list) -> list:
+    return [r["id"] for r in records]
+
+
+def fill(store, room: str, numbers) -> None:
+    store.add_many([(room, f"m{i}", record(i)) for i in numbers])
+
+
+def test_add_and_read_in_time_order(store):
+    # 시간순이 아니게 들어와도 시각 순서로 조회됨
+    fill(store, "main", [3, 1, 2, 5, 4])
+    fill(store, "other", [9])
+
+    assert ids(store.recent("main", 3)) == ["m3", "m4", "m5"]
+    assert ids(store.oldest("main", 2)) == ["m1", "m2"]
+    assert ids(store.before("main", BASE + timedelta(seconds=4), 2)) == ["m2", "m3"]
+    assert store.count("main") == 5
+    assert store.count("empty") == 0
+
+    first = store.recent("main", 1)[0]
+    assert first == {"id": "m5", "nickname": "a", "content": "hello 5",
+                     "timestamp": BASE + timedelta(seconds=5), "seq": 5}
+
+
+def test_delete_by_id_is_scoped_to_room(store):
+    fill(store, "main", range(5))
+    fill(store, "other", [10])
+
+    assert store.delete("main", ["m1", "m3", "m10", "missing"]) in (2, 4)
+    assert ids(store.recent("main", 10)) == ["m0", "m2", "m4"]
+    assert store.count("other") == 1
+
+
+def test_delete_oldest_returns_deleted_ids(store):
+    fill(store, "main", range(6))
+
+    assert store.delete_oldest("main", 4) == ["m0", "m1", "m2", "m3"]
+    assert ids(store.recent("main", 10)) == ["m4", "m5"]
+    assert store.delete_oldest("main", 10) == ["m4", "m5"]
+    assert store.delete_oldest("main", 1) == []
+
+
+def test_sqlite_store_persists_across_connections(tmp_path):
+    path = str(tmp_path / "chat.db")
+    first = SQLiteStore(path)
+    fill(first, "main", range(3))
+    first.close()
+
+    second = SQLiteStore(path)
+    assert ids(second.recent("main", 10)) == ["m0", "m1", "m2"]
+    second.close()